@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookmarks', '0002_auto_20150811_1201'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookmark',
+            name='subscribed',
+            field=models.BooleanField(default=False, help_text='Notify the user when matching documents are updated', verbose_name='Subscribed'),
+        ),
+    ]
@@ -24,6 +24,10 @@ class Bookmark(models.Model):
     created_on = models.DateField(
         _('Created on'),
         default=timezone.now)
+    subscribed = models.BooleanField(
+        _('Subscribed'),
+        default=False,
+        help_text=_('Notify the user when matching documents are updated'))
 
     class Meta:
         verbose_name = _('Bookmark')
@@ -55,7 +55,7 @@ MANAGERS = ADMINS
 # See: https://docs.djangoproject.com/en/dev/ref/settings/#databases
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'transaction_hooks.backends.sqlite3',
         'NAME': normpath(join(DJANGO_ROOT, 'phase.db')),
         'USER': '',
         'PASSWORD': '',
@@ -372,6 +372,8 @@ PIPELINE_JS = {
             'js/ui/models.js',
             'js/ui/views.js',
             'js/ui/app.js',
+            'js/search/views.js',
+            'js/search/app.js',
         ),
         'output_filename': 'js/base.js',
     },
@@ -450,6 +452,13 @@ PIPELINE_JS = {
         ),
         'output_filename': 'js/transmittal-list.js',
     },
+    'export_list': {
+        'source_filenames': (
+            'js/exports/views.js',
+            'js/exports/app.js',
+        ),
+        'output_filename': 'js/export-list.js',
+    },
 }
 # ######### END PIPELINE CONFIGURATION
 
@@ -472,10 +481,36 @@ CELERY_RESULT_SERIALIZER = 'betterjson'
 CELERY_RESULT_BACKEND = 'amqp'
 
 # ######### SEARCH CONFIG
+# Use 'search.backends.db.DatabaseBackend' to search documents without
+# elasticsearch
+SEARCH_BACKEND = 'search.backends.elastic.ElasticBackend'
+
 ELASTIC_HOSTS = [{'host': 'localhost', 'port': 9200}]
+# This is the name of an alias, pointing to a versioned physical index
 ELASTIC_INDEX = 'documents'
+# All categories share the `ELASTIC_INDEX` index ('shared'), or every
+# organisation ('organisation') or category ('category') has it's own index.
+# Indexes must be rebuilt with `reindex_all` when the layout is changed.
+ELASTIC_INDEX_LAYOUT = 'shared'
 ELASTIC_BULK_SIZE = 150
 ELASTIC_AUTOINDEX = True
+ELASTIC_REPLICAS = 1
+ELASTIC_REINDEX_WORKERS = 4
+ELASTIC_REINDEX_CHUNK_SIZE = 10000
+ELASTIC_REINDEX_CHECKPOINT = SITE_ROOT.child('private').child('reindex_checkpoint.json')
+# Delay (in seconds) before pending index operations are processed
+ELASTIC_QUEUE_DELAY = 5
+# Analysis of the full text search field for new indexes, see
+# `search.ANALYSIS_PROFILES`. Existing indexes must be rebuilt with
+# `reindex_all` to use a new profile.
+ELASTIC_ANALYSIS_PROFILE = 'ngram'
+# Search results cache timeout (in seconds), can be overriden per category
+SEARCH_CACHE_TIMEOUT = 60
+SEARCH_CACHE_TIMEOUTS = {}
+# Number of buckets returned for every facet of the document list
+SEARCH_FACET_SIZE = 25
+# Number of hits returned for every category by the global search
+GLOBAL_SEARCH_HITS = 5
 
 # ######### CUSTOM CONFIGURATION
 PAGINATE_BY = 50  # Document list pagination
@@ -498,6 +533,10 @@ USE_X_SENDFILE = False
 EXPORTS_URL = '/exports/'
 EXPORTS_SUBDIR = 'exports'
 EXPORTS_CHUNK_SIZE = 150
+# Number of celery tasks a csv export is split into
+EXPORTS_PARALLELISM = 1
+# Exports of at most this number of rows are directly downloaded
+EXPORTS_STREAMING_THRESHOLD = 1000
 EXPORTS_VALIDITY_DURATION = 2
 
 # Where to look for files to import?
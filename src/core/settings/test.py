@@ -8,7 +8,7 @@ TEMPLATE_DEBUG = False
 # ######### IN-MEMORY TEST DATABASE
 SQLITE = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
+        "ENGINE": "transaction_hooks.backends.sqlite3",
         "NAME": ":memory:",
         "USER": "",
         "PASSWORD": "",
@@ -19,7 +19,7 @@ SQLITE = {
 
 PG = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
+        'ENGINE': 'transaction_hooks.backends.postgresql_psycopg2',
         'NAME': 'phase_test',
         'USER': 'phase',
         'PASSWORD': 'phase',
@@ -49,6 +49,7 @@ STATICFILES_STORAGE = 'pipeline.storage.NonPackagingPipelineStorage'
 
 ELASTIC_INDEX = 'test_documents'
 ELASTIC_AUTOINDEX = False
+ELASTIC_REINDEX_CHECKPOINT = '/tmp/phase_media/reindex_checkpoint.json'
 
 # Makes Celery working synchronously and in memory
 CELERY_ALWAYS_EAGER = True
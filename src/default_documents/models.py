@@ -158,7 +158,15 @@ class ContractorDeliverable(ScheduleMixin, Metadata):
             'document_type', 'under_review', 'overdue', 'leader', 'approver'
         )
         searchable_fields = ('document_number', 'title',)
+        date_filter_fields = (
+            'review_start_date', 'review_due_date',
+            'status_ifa_forecast_date', 'status_ifc_forecast_date',
+        )
         indexable_fields = ['is_existing', 'can_be_transmitted']
+        indexable_field_types = {
+            'is_existing': 'boolean',
+            'can_be_transmitted': 'boolean',
+        }
         column_fields = (
             ('Document Number', 'document_number'),
             ('Title', 'title'),
@@ -3,6 +3,7 @@ from collections import OrderedDict
 from django import forms
 from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
+from django.utils.text import capfirst
 
 
 class BaseDocumentFilterForm(forms.Form):
@@ -56,6 +57,13 @@ additional_filter_fields = {
     )
 }
 
+# Date range filters are made of two fields, e.g "review_due_date_from" and
+# "review_due_date_to".
+DATE_RANGE_FIELDS = (
+    ('from', _('%s (from)')),
+    ('to', _('%s (to)')),
+)
+
 
 def filterform_factory(model):
     """Dynamically create a filter form for the given Metadata model.
@@ -95,6 +103,19 @@ def filterform_factory(model):
             field = additional_filter_fields[field_name]
             field_list.append((field_name, field))
 
+    # Add date range filters to filter form
+    date_filter_fields = getattr(config, 'date_filter_fields', ())
+    date_range_names = []
+    for field_name in date_filter_fields:
+        verbose_name = capfirst(all_fields[field_name].verbose_name)
+        for suffix, label in DATE_RANGE_FIELDS:
+            field = forms.DateField(
+                label=label % verbose_name,
+                widget=forms.DateInput(attrs={'class': 'dateinput'}),
+                **kwargs)
+            date_range_names.append('%s_%s' % (field_name, suffix))
+            field_list.append((date_range_names[-1], field))
+
     # Add custom filters to filter form
     custom_filters = getattr(config, 'custom_filters', {})
     for field_name, filter_config in custom_filters.items():
@@ -124,6 +145,10 @@ def filterform_factory(model):
         # `filter_fields_order` list manually.
         # TODO Find a better way to do this.
         fields_order = ['size', 'start'] + filter_fields_order
+
+        # Date range inputs that are not explicitly ordered come last
+        fields_order += [name for name in date_range_names
+                         if name not in fields_order]
         form.base_fields = OrderedDict(
             (k, form.base_fields[k]) for k in fields_order)
     return form
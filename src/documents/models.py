@@ -424,9 +424,18 @@ class MetadataRevision(models.Model):
         TODO refactor to replace with a foreign key in each
         MetadataRevision subclass.
 
+        The metadata object can be set beforehand to prevent a useless query,
+        e.g when serializing revisions in batch.
+
         """
+        if hasattr(self, '_metadata_cache'):
+            return self._metadata_cache
         return self.document.get_metadata()
 
+    @metadata.setter
+    def metadata(self, metadata):
+        self._metadata_cache = metadata
+
     @property
     def name(self):
         """A revision identifier should be displayed with two digits"""
@@ -486,8 +495,10 @@ class MetadataRevision(models.Model):
         filter_fields = list(config.filter_fields)
         searchable_fields = list(config.searchable_fields)
         column_fields = dict(config.column_fields).values()
+        date_filter_fields = list(getattr(config, 'date_filter_fields', []))
         indexable_fields = getattr(config, 'indexable_fields', [])
-        fields_to_index = set(filter_fields + searchable_fields + column_fields + indexable_fields)
+        fields_to_index = set(filter_fields + searchable_fields + column_fields +
+                              date_filter_fields + indexable_fields)
 
         for field in fields_to_index:
             fields += add_to_fields(field)
@@ -502,6 +513,7 @@ class MetadataRevision(models.Model):
             u'pk': self.pk,
             u'revision': self.revision,
             u'is_latest_revision': document.current_revision == self.revision,
+            u'updated_on': self.updated_on,
         })
         return fields_infos
 
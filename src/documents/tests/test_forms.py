@@ -8,6 +8,8 @@ from django.conf import settings
 from django.core.urlresolvers import reverse
 from django.test import TestCase
 
+from mock import patch
+
 from accounts.factories import UserFactory
 from categories.factories import CategoryFactory
 from default_documents.models import DemoMetadataRevision, \
@@ -551,5 +553,28 @@ class FilterFormTest(TestCase):
         # attribute
         form_fields = form.fields.keys()[2:]
 
-        # Checking fields are in the right order
-        self.assertEqual(form_fields, fields_order)
\ No newline at end of file
+        # Checking fields are in the right order, date range inputs that
+        # are not ordered come last
+        self.assertEqual(form_fields[:len(fields_order)], fields_order)
+        date_filter_fields = ContractorDeliverable.PhaseConfig.date_filter_fields
+        self.assertEqual(form_fields[len(fields_order):], [
+            '%s_%s' % (field, suffix)
+            for field in date_filter_fields for suffix in ('from', 'to')])
+
+    def test_date_range_filters(self):
+        config = ContractorDeliverable.PhaseConfig
+        with patch.object(config, 'filter_fields_order', [], create=True):
+            form = filterform_factory(ContractorDeliverable)()
+        self.assertIn('review_due_date_from', form.fields)
+
+        with patch.object(
+                config, 'filter_fields_order',
+                ['review_due_date_to', 'leader'], create=True):
+            form = filterform_factory(ContractorDeliverable)()
+        self.assertEqual(form.fields.keys()[2:5], [
+            'review_due_date_to', 'leader', 'review_start_date_from'])
+        self.assertIn('review_due_date_from', form.fields)
+        self.assertIn('review_due_date_to', form.fields)
+        self.assertEqual(
+            form.fields['review_due_date_from'].label,
+            'Review due date (from)')
@@ -58,6 +58,7 @@ class DocumentTest(TestCase):
                 u'url': document.get_absolute_url(),
                 u'revision': 1,
                 u'is_latest_revision': True,
+                u'updated_on': document.metadata.latest_revision.updated_on,
                 u'pk': document.metadata.latest_revision.pk,
                 u'document_pk': document.pk,
                 u'metadata_pk': document.metadata.pk,
@@ -151,6 +151,7 @@ class DocumentList(BaseDocumentList):
             'form': FilterForm(),
             'documents_active': True,
             'paginate_by': settings.PAGINATE_BY,
+            'facet_size': settings.SEARCH_FACET_SIZE,
             'sort_by': model._meta.ordering[0],
             'document_class': self.get_document_class(),
         })
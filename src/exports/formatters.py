@@ -1,6 +1,30 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import shutil
+import datetime
+import tempfile
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from django.db import models
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.encoding import force_text
+
+from openpyxl import Workbook, __version__ as openpyxl_version
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.writer.dump_worksheet import WriteOnlyCell
+
+from reportlab.lib import colors
+from reportlab.lib.units import mm
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfgen import canvas
+from reportlab.platypus import Paragraph
+from reportlab.platypus.tables import Table, TableStyle
+
 from documents.models import MetadataRevision
 from transmittals.utils import FieldWrapper
 from documents.utils import stringify_value as stringify
@@ -35,20 +59,49 @@ class BaseFormatter(object):
     def format_doc(self, doc):
         raise NotImplementedError()
 
+    def get_data(self, doc):
+        """Returns the exported values of a doc, as strings.
 
-class CSVFormatter(BaseFormatter):
-    """Converts a queryset into csv data."""
+        `doc` is a list of values (e.g the header), a revision or the
+        indexed data of a revision.
 
-    def format_doc(self, doc):
+        """
         if isinstance(doc, list):
             data = doc
         elif isinstance(doc, MetadataRevision):
+            # The revision's metadata is set by the generator, so accessing
+            # it does not trigger a query
             doc = FieldWrapper((
                 doc,
-                doc.document.metadata,
+                doc.metadata,
                 doc.document))
             fields = self.fields.values()
             data = [self.get_field(doc, field) for field in fields]
+        elif isinstance(doc, dict):
+            # Indexed data
+            fields = self.fields.values()
+            data = [stringify(doc.get(field), none_val='') for field in fields]
+        return data
+
+    def get_field(self, doc, field):
+        data = getattr(doc, field, '')
+        return stringify(data, none_val='')
+
+    def finish(self, the_file):
+        """Called once all the data was formatted.
+
+        Formats that cannot be written chunk by chunk (e.g zip based
+        formats) must write their data in `the_file` here.
+
+        """
+        pass
+
+
+class CSVFormatter(BaseFormatter):
+    """Converts a queryset into csv data."""
+
+    def format_doc(self, doc):
+        data = self.get_data(doc)
 
         # Some fields can contain new lines and break csv formatting so we
         # need to remove them (eg: document title TextField)
@@ -56,6 +109,266 @@ class CSVFormatter(BaseFormatter):
         csv_data = '{}\n'.format(csv_data)
         return csv_data.encode('utf-8')
 
-    def get_field(self, doc, field):
-        data = getattr(doc, field, '')
-        return stringify(data, none_val='')
+
+# Line breaks between the rows of a write-only worksheet are cosmetic, and
+# can only be written through the openpyxl 2.1 internals.
+XLSX_LINE_BREAKS = openpyxl_version.startswith('2.1.')
+
+XLSX_DATETIME_FORMAT = 'yyyy-mm-dd hh:mm:ss'
+
+
+def write_line_break(worksheet):
+    """Write a line break after the last row of a write-only worksheet.
+
+    This is cosmetic only: the worksheet xml is valid either way, the line
+    breaks only let openpyxl copy it line by line when the workbook is saved.
+    It relies on private openpyxl internals, so it is skipped on other
+    versions, or if those internals are not there.
+
+    Returns whether the line break was written.
+
+    """
+    if not XLSX_LINE_BREAKS:
+        return False
+
+    try:
+        content_generator = worksheet._get_content_generator
+    except AttributeError:
+        return False
+
+    content_generator().ignorableWhitespace('\n')
+    return True
+
+
+class XLSXFormatter(BaseFormatter):
+    """Converts a queryset into an excel worksheet.
+
+    The workbook is created in write-only mode: rows are streamed to a
+    temporary file, so the memory usage does not depend on the number of
+    rows. The xlsx file is assembled in `finish`.
+
+    Dates and numbers are written as such, not as strings.
+
+    """
+    def __init__(self, fields):
+        super(XLSXFormatter, self).__init__(fields)
+        self.workbook = Workbook(write_only=True)
+        self.worksheet = self.workbook.create_sheet(title='Export')
+
+    def format(self, docs):
+        if docs is None:
+            return b''
+
+        for doc in docs:
+            self.worksheet.append(self.format_doc(doc))
+            write_line_break(self.worksheet)
+        return b''
+
+    def format_doc(self, doc):
+        fields = self.fields.values()
+        if isinstance(doc, list):
+            data = doc
+        elif isinstance(doc, MetadataRevision):
+            doc = FieldWrapper((
+                doc,
+                doc.metadata,
+                doc.document))
+            data = [getattr(doc, field, None) for field in fields]
+        elif isinstance(doc, dict):
+            # Indexed dates are strings
+            data = [self.parse_value(doc.get(field)) for field in fields]
+
+        row = []
+        date_format = False
+        for value in map(self.get_value, data):
+            if isinstance(value, datetime.datetime):
+                # Dates and datetimes get the same format by default, which
+                # would hide the time
+                value = WriteOnlyCell(self.worksheet, value=value)
+                value.number_format = XLSX_DATETIME_FORMAT
+                date_format = False
+            elif isinstance(value, datetime.date):
+                date_format = True
+            elif value is not None and date_format:
+                # The write-only worksheet reuses the same cell for plain
+                # values, so the date format would stick to the value that
+                # follows a date, unless it gets a cell of its own.
+                value = WriteOnlyCell(self.worksheet, value=value)
+                date_format = False
+            row.append(value)
+        return row
+
+    def parse_value(self, value):
+        if isinstance(value, basestring):
+            return parse_datetime(value) or parse_date(value) or value
+        return value
+
+    def get_value(self, value):
+        if value is None:
+            return None
+
+        if isinstance(value, (bool, int, long, float)):
+            return value
+
+        if isinstance(value, Decimal):
+            return float(value)
+
+        if isinstance(value, datetime.date):
+            if isinstance(value, datetime.datetime) and \
+                    timezone.is_aware(value):
+                value = timezone.localtime(value).replace(tzinfo=None)
+            return value
+
+        if isinstance(value, models.Model):
+            value = value.__unicode__()
+        return ILLEGAL_CHARACTERS_RE.sub('', force_text(value))
+
+    def finish(self, the_file):
+        self.workbook.save(the_file)
+
+
+class PDFFormatter(BaseFormatter):
+    """Converts a queryset into a paginated pdf table.
+
+    Every chunk of rows is laid out and drawn on the canvas right away.
+    Hence, the whole list is never laid out at once, and only the drawing
+    instructions of finished pages are kept until the file is written. The
+    header row is repeated on every page.
+
+    The pdf document is written in `finish`.
+
+    """
+    pagesize = landscape(A4)
+    margin = 10 * mm
+
+    # Longer values are truncated, so a single row always fits in a page
+    max_length = 300
+
+    # Rows are laid out by small tables, so splitting a table at the end of
+    # a page does not lay out the whole chunk again
+    table_size = 10
+
+    font_size = 7
+    cell_padding = 12
+
+    def __init__(self, fields):
+        super(PDFFormatter, self).__init__(fields)
+        self.width, self.height = self.pagesize
+        self.col_width = (self.width - 2 * self.margin) / max(len(fields), 1)
+        self.style = ParagraphStyle(
+            name='export_style',
+            parent=getSampleStyleSheet()['Normal'],
+            fontSize=self.font_size,
+            leading=self.font_size + 1)
+        self.header_style = ParagraphStyle(
+            name='export_header_style',
+            parent=self.style,
+            fontName='Helvetica-Bold')
+
+        self.buff = tempfile.TemporaryFile()
+        self.canvas = canvas.Canvas(
+            self.buff, pagesize=self.pagesize, pageCompression=1)
+        self.header = None
+        self.page_started = False
+
+    def format(self, docs):
+        if docs is None:
+            return b''
+
+        rows = []
+        for doc in docs:
+            if isinstance(doc, list):
+                self.header = self.get_row(doc, self.header_style)
+            else:
+                rows.append(self.get_row(self.get_data(doc), self.style))
+
+        if rows:
+            self.draw_rows(rows)
+        return b''
+
+    def get_row(self, data, style):
+        return [self.get_cell(value, style) for value in data]
+
+    def get_cell(self, value, style):
+        """Values that fit in the column are drawn as is, others wrapped."""
+        value = value[:self.max_length]
+        width = stringWidth(value, style.fontName, style.fontSize)
+        if width <= self.col_width - self.cell_padding and '\n' not in value:
+            return value
+        return Paragraph(escape(value), style)
+
+    def get_table(self, rows, header=False):
+        table = Table(rows, colWidths=[self.col_width] * len(self.fields))
+        style = self.header_style if header else self.style
+        table_style = [
+            ('FONT', (0, 0), (-1, -1), style.fontName, style.fontSize),
+            ('INNERGRID', (0, 0), (-1, -1), 0.25, colors.black),
+            ('BOX', (0, 0), (-1, -1), 0.25, colors.black),
+            ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+        ]
+        if header:
+            table_style.append(
+                ('BACKGROUND', (0, 0), (-1, -1), colors.lightgrey))
+        table.setStyle(TableStyle(table_style))
+        return table
+
+    def draw_table(self, table):
+        width, height = table.wrapOn(
+            self.canvas, self.width - 2 * self.margin, self.y - self.margin)
+        table.drawOn(self.canvas, self.margin, self.y - height)
+        self.y -= height
+
+    def start_page(self):
+        if self.page_started:
+            self.canvas.showPage()
+        self.page_started = True
+
+        self.canvas.setFont('Helvetica', 8)
+        self.canvas.drawRightString(
+            self.width - self.margin,
+            self.margin / 2,
+            'Page %d' % self.canvas.getPageNumber())
+
+        self.y = self.height - self.margin
+        if self.header:
+            self.draw_table(self.get_table([self.header], header=True))
+        self.page_top = self.y
+
+    def draw_rows(self, rows):
+        """Draw rows, and start new pages as needed."""
+        if not self.page_started:
+            self.start_page()
+
+        for start in range(0, len(rows), self.table_size):
+            self.draw_rows_table(rows[start:start + self.table_size])
+
+    def draw_rows_table(self, rows):
+        table = self.get_table(rows)
+        while table is not None:
+            available = self.y - self.margin
+            width, height = table.wrapOn(
+                self.canvas, self.width - 2 * self.margin, available)
+            if height <= available:
+                self.draw_table(table)
+                return
+
+            parts = table.split(self.width - 2 * self.margin, available)
+            if len(parts) < 2:
+                if self.y == self.page_top:
+                    # The row is higher than a page
+                    self.draw_table(table)
+                    return
+                self.start_page()
+                continue
+
+            self.draw_table(parts[0])
+            self.start_page()
+            table = parts[1]
+
+    def finish(self, the_file):
+        if not self.page_started:
+            self.start_page()
+        self.canvas.save()
+        self.buff.seek(0)
+        shutil.copyfileobj(self.buff, the_file)
+        self.buff.close()
@@ -1,9 +1,13 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+from itertools import islice
+
 from django.conf import settings
 
+from search.backends import get_backend
 from search.builder import SearchBuilder
+from search.utils import prefetch_revisions
 
 
 class ExportGenerator(object):
@@ -12,34 +16,69 @@ class ExportGenerator(object):
     Use Elasticsearch and the db to efficiently (as far as possible) fetch data
     from a certain category filtered by the given filters.
 
-    Yields data in chunks.
+    Revision ids are streamed from the search backend, and the revisions of
+    each chunk are fetched with their related objects in a fixed number of
+    queries. There is no limit on the number of exported revisions.
+
+    When `from_source` is set, every exported field must be indexed. The
+    indexed data is then exported as is, and the db is not queried at all.
+
+    Revision ids are fetched with an unsorted scan, unless `ordered` is set.
+    When `part` is given, as a `(start, size)` tuple, only this slice of the
+    list is exported, in the list order. It is used to export a part of a
+    list (see `Export.get_parts`). The last part has no size.
+
+    Yields data in chunks. The number of rows yielded so far is available in
+    `nb_rows`.
 
     """
-    def __init__(self, category, filters, fields):
+    def __init__(self, category, filters, fields, from_source=False,
+                 part=None, with_header=True, ordered=False):
         self.category = category
         self.fields = fields
         self.filters = filters
+        self.from_source = from_source
+        self.part = part
+        self.with_header = with_header
+        self.ordered = ordered or part is not None
+        self.chunk_size = settings.EXPORTS_CHUNK_SIZE
+
+        # With a scan, the size is the number of hits fetched per shard at
+        # each scroll request, not a limit.
         self.filters.update({
             'start': 0,
-            'size': 60000})
+            'size': self.chunk_size})
 
     def __iter__(self):
-        self.pks, self.total = self.get_es_results()
-        self.start = -1
-        self.chunk_size = settings.EXPORTS_CHUNK_SIZE
+        self.results = iter(self.get_es_results())
+        self.header_sent = not self.with_header
+        self.nb_rows = 0
         return self
 
     def get_es_results(self):
-        """Perform initial doc search using elasticsearch.
+        """Perform initial doc search using the search backend.
 
-        Only return document ids, since the actual data export will use db.
+        Only return document ids, since the actual data export will use db,
+        unless data is exported from the indexed source. Results are yielded
+        while the backend scrolls them.
 
         """
         builder = SearchBuilder(self.category, self.filters)
-        result = builder.scan_results(['pk'], only_latest_revisions=False)
-        pks = [doc['pk'][0] for doc in result]
-        total = len(pks)
-        return pks, total
+        backend = get_backend()
+        if self.from_source:
+            results = backend.scan_sources(
+                builder, self.fields.values(),
+                only_latest_revisions=False, ordered=self.ordered)
+        else:
+            results = (doc['pk'] for doc in backend.scan(
+                builder, ['pk'], only_latest_revisions=False,
+                ordered=self.ordered))
+
+        if self.part is not None:
+            start, size = self.part
+            stop = None if size is None else start + size
+            results = islice(results, start, stop)
+        return results
 
     def __next__(self):
         return self.next()
@@ -54,30 +93,43 @@ class ExportGenerator(object):
         dumped in the file.
 
         """
-        if self.start == -1:
-            self.start = 0
+        if not self.header_sent:
+            self.header_sent = True
             return self.data_header()
 
-        if self.start >= self.total:
+        results = list(islice(self.results, self.chunk_size))
+        if not results:
             raise StopIteration()
 
-        chunk = self.get_chunk()
-        self.start += self.chunk_size
+        chunk = self.get_chunk(results)
+        self.nb_rows += len(chunk)
         return chunk
 
     def data_header(self):
         return
 
-    def get_chunk(self):
-        """Get a single piece of data."""
-        Model = self.category.revision_class()
-        pks = self.pks[self.start:self.start + self.chunk_size]
-        qs = Model.objects \
-            .filter(pk__in=pks) \
-            .select_related()
-        return qs
+    def get_chunk(self, results):
+        """Get the data matching a single chunk of search results.
+
+        Revisions are fetched from the db, or indexed sources are returned
+        as is.
+
+        """
+        if self.from_source:
+            return results
+
+        return list(prefetch_revisions(
+            self.category, results, batch_size=self.chunk_size))
 
 
 class CSVGenerator(ExportGenerator):
     def data_header(self):
         return [self.fields.keys()]
+
+
+class XLSXGenerator(CSVGenerator):
+    pass
+
+
+class PDFGenerator(CSVGenerator):
+    pass
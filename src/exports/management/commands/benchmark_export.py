@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import time
+import tempfile
+import resource
+from multiprocessing import Pool
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from django.conf import settings
+
+from exports.models import Export
+from search.utils import get_categories
+
+
+def init_worker():
+    """Make sure forked processes don't share parent's connections."""
+    connections.close_all()
+
+
+def write_part(args):
+    export, index, part = args
+    return export.write_part(index, part)
+
+
+class Command(BaseCommand):
+    """Measure the export throughput on real data.
+
+    The whole content of the given categories is exported in a temporary
+    file, that is deleted afterwards. The number of rows, the duration and
+    the number of sql queries are reported for every category, as well as
+    whether the data was exported from the index or from the db.
+
+    With the `--rows` option, the given number of generated rows are
+    formatted instead, so formats can be compared without the cost of
+    fetching the data.
+
+    With the `--parallelism` option, the export is split in parts that are
+    written by a pool of processes, the same way celery workers would, and
+    the wall-clock duration is reported. Use `--workers` to set the number
+    of processes (defaults to the number of parts).
+
+    The peak memory usage (RSS) of the process is reported too.
+
+    """
+    args = '<organisation_slug/category_slug ...>'
+    help = 'Benchmark the document exports.'
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--format',
+            type='choice', dest='format', default='csv',
+            choices=[value for value, label in Export.FORMATS]),
+        make_option(
+            '--querystring',
+            dest='querystring', default='',
+            help='Search filters, e.g "status=STD"'),
+        make_option(
+            '--from-db',
+            action='store_true', dest='from_db', default=False,
+            help='Query the db even if every exported field is indexed.'),
+        make_option(
+            '--compressed',
+            action='store_true', dest='compressed', default=False,
+            help='Gzip csv files.'),
+        make_option(
+            '--rows',
+            type='int', dest='rows', default=None,
+            help='Format this number of generated rows.'),
+        make_option(
+            '--parallelism',
+            type='int', dest='parallelism', default=None,
+            help='Write the export in this number of parallel parts.'),
+        make_option(
+            '--workers',
+            type='int', dest='workers', default=None,
+            help='Number of processes writing the parts.'),
+    )
+
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError('At least one category must be given.')
+
+        try:
+            categories = get_categories(args)
+        except ValueError as e:
+            raise CommandError(e)
+
+        for category in categories:
+            export = Export(
+                category=category,
+                querystring=options['querystring'],
+                format=options['format'],
+                compressed=options['compressed'])
+            if options['rows']:
+                self.benchmark_format(export, options['rows'])
+            elif options['parallelism']:
+                self.benchmark_parallel(
+                    export,
+                    options['parallelism'],
+                    options['workers'] or options['parallelism'])
+            else:
+                self.benchmark(export, options['from_db'])
+
+    def benchmark(self, export, from_db=False):
+        generator = export.get_data_generator()
+        if from_db:
+            generator.from_source = False
+
+        started = time.time()
+        with CaptureQueriesContext(connection) as queries:
+            with tempfile.TemporaryFile() as the_file:
+                for written_rows in export.write_chunks(the_file, generator):
+                    pass
+                size = the_file.tell()
+        duration = time.time() - started
+
+        self.stdout.write(
+            '{}: {} rows in {:.1f}s ({:.0f}/s), {} queries, from {}, '
+            '{:.1f} MB, peak RSS {:.0f} MB'.format(
+                export.category,
+                generator.nb_rows,
+                duration,
+                generator.nb_rows / duration if duration else 0,
+                len(queries),
+                'index' if generator.from_source else 'db',
+                size / 1024.0 / 1024.0,
+                self.get_peak_rss()))
+
+    def benchmark_parallel(self, export, parallelism, workers):
+        started = time.time()
+        parts = export.get_parts(parallelism)
+        if not parts:
+            self.stdout.write(
+                '{}: this export cannot be split'.format(export.category))
+            return
+
+        nb_rows = self.write_parts([
+            (export, index, part) for index, part in enumerate(parts)],
+            workers)
+        export.merge_parts(len(parts))
+        os.remove(export.get_filepath())
+        duration = time.time() - started
+
+        self.stdout.write(
+            '{}: {} rows in {} parts in {:.1f}s ({:.0f}/s)'.format(
+                export.category,
+                sum(nb_rows),
+                len(parts),
+                duration,
+                sum(nb_rows) / duration if duration else 0))
+
+    def write_parts(self, parts, workers):
+        """Write the parts across a pool of processes."""
+        if workers <= 1:
+            return map(write_part, parts)
+
+        # Forked processes must not inherit the current db connection
+        connections.close_all()
+        pool = Pool(workers, initializer=init_worker)
+        try:
+            return pool.map(write_part, parts)
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def benchmark_format(self, export, nb_rows):
+        fields = export.get_fields()
+        formatter = export.get_data_formatter()
+        chunk_size = settings.EXPORTS_CHUNK_SIZE
+
+        started = time.time()
+        with tempfile.TemporaryFile() as the_file:
+            the_file.write(formatter.format([fields.keys()]))
+            for start in range(0, nb_rows, chunk_size):
+                chunk = [
+                    self.get_row(fields.values(), number)
+                    for number in range(start, min(start + chunk_size, nb_rows))]
+                the_file.write(formatter.format(chunk))
+            formatter.finish(the_file)
+            size = the_file.tell()
+        duration = time.time() - started
+
+        self.stdout.write(
+            '{}: {} generated rows formatted in {:.1f}s ({:.0f}/s), '
+            '{:.1f} MB, peak RSS {:.0f} MB'.format(
+                export.format,
+                nb_rows,
+                duration,
+                nb_rows / duration if duration else 0,
+                size / 1024.0 / 1024.0,
+                self.get_peak_rss()))
+
+    def get_row(self, fields, number):
+        """Generate indexed data with strings, dates and numbers."""
+        values = (
+            'Document {}'.format(number),
+            '2015-{:02d}-{:02d}'.format(number % 12 + 1, number % 28 + 1),
+            number,
+        )
+        return dict(
+            (field, values[i % len(values)]) for i, field in enumerate(fields))
+
+    def get_peak_rss(self):
+        """Peak memory usage of the process, in MB."""
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exports', '0003_export_format'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='export',
+            name='format',
+            field=models.CharField(default='csv', max_length=5, verbose_name='Format', choices=[('csv', 'csv'), ('xlsx', 'xlsx'), ('pdf', 'pdf')]),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exports', '0004_xlsx_format'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='export',
+            name='generation',
+            field=models.BigIntegerField(help_text='The search index generation when the export started', null=True, verbose_name='Index generation', blank=True),
+        ),
+        migrations.AddField(
+            model_name='export',
+            name='nb_rows',
+            field=models.PositiveIntegerField(default=0, verbose_name='Written rows'),
+        ),
+        migrations.AddField(
+            model_name='export',
+            name='task_id',
+            field=models.CharField(default='', max_length=50, verbose_name='Task id', blank=True),
+        ),
+        migrations.AlterField(
+            model_name='export',
+            name='status',
+            field=models.CharField(default='new', max_length=30, verbose_name='Status', choices=[('new', 'New'), ('processing', 'Processing'), ('done', 'Done'), ('cancelled', 'Cancelled')]),
+        ),
+    ]
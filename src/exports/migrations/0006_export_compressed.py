@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exports', '0005_export_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='export',
+            name='compressed',
+            field=models.BooleanField(default=False, help_text='Gzip the csv file', verbose_name='Compressed'),
+        ),
+    ]
@@ -2,25 +2,54 @@
 from __future__ import unicode_literals
 
 import os
+import gzip
+import math
 import uuid
+import shutil
 import logging
+from io import BytesIO
+from datetime import timedelta
+from collections import OrderedDict
 
 from django.db import models
+from django.db.models import F
 from django.utils.translation import ugettext_lazy as _
 from django.utils import timezone
 from django.utils.module_loading import import_string
 from django.http import QueryDict
+from django.utils.http import urlencode
 from django.core.urlresolvers import reverse
 from django.conf import settings
 
+from celery import current_task
+from celery.utils import uuid as task_uuid
 from model_utils import Choices
 
-from exports.tasks import process_export
+from exports.errors import ExportCancelled
+from exports.tasks import process_export, finish_export
+from search.backends import get_backend
+from search.builder import SearchBuilder
+from search.cache import get_generation
 
 
 logger = logging.getLogger(__name__)
 
 
+def normalize_querystring(querystring):
+    """Returns a stable representation of the search filters.
+
+    Empty filters are dropped, and filters are sorted, so identical searches
+    give identical querystrings.
+
+    """
+    filters = QueryDict(querystring)
+    return urlencode([
+        (key, value)
+        for key in sorted(filters.keys())
+        for value in sorted(filters.getlist(key))
+        if value])
+
+
 class Export(models.Model):
     """Represents a document export request."""
 
@@ -28,8 +57,14 @@ class Export(models.Model):
         ('new', _('New')),
         ('processing', _('Processing')),
         ('done', _('Done')),
+        ('cancelled', _('Cancelled')),
     )
-    FORMATS = Choices('csv', 'pdf')
+    FORMATS = Choices('csv', 'xlsx', 'pdf')
+    CONTENT_TYPES = {
+        'csv': 'text/csv',
+        'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        'pdf': 'application/pdf',
+    }
 
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     owner = models.ForeignKey(
@@ -52,9 +87,24 @@ class Export(models.Model):
         max_length=5,
         choices=FORMATS,
         default=FORMATS.csv)
+    compressed = models.BooleanField(
+        _('Compressed'),
+        default=False,
+        help_text=_('Gzip the csv file'))
     created_on = models.DateTimeField(
         _('Created on'),
         default=timezone.now)
+    task_id = models.CharField(
+        _('Task id'),
+        max_length=50,
+        blank=True, default='')
+    nb_rows = models.PositiveIntegerField(
+        _('Written rows'),
+        default=0)
+    generation = models.BigIntegerField(
+        _('Index generation'),
+        null=True, blank=True,
+        help_text=_('The search index generation when the export started'))
 
     class Meta:
         app_label = 'exports'
@@ -67,33 +117,58 @@ class Export(models.Model):
     def is_ready(self):
         return self.status == self.STATUSES.done
 
+    def is_pending(self):
+        return self.status in (self.STATUSES.new, self.STATUSES.processing)
+
     def get_filters(self):
         """Parse querystring and returns a dict."""
         return QueryDict(self.querystring, mutable=True)
 
     def get_fields(self):
-        """Get the list of fields that must be exported."""
+        """Get the list of fields that must be exported.
+
+        Pdf files are printable lists, so only the document list columns are
+        exported.
+
+        """
         default_fields = {
             'Document Number': 'document_key',
             'Title': 'title',
         }
         Model = self.category.document_class()
+        if self.format == self.FORMATS.pdf:
+            return OrderedDict(Model.PhaseConfig.column_fields)
+
         fields = getattr(Model.PhaseConfig, 'export_fields', default_fields)
         return fields
 
+    def is_compressed(self):
+        """Only csv files are compressed, other formats already are."""
+        return self.compressed and self.format == self.FORMATS.csv
+
+    def get_extension(self):
+        if self.is_compressed():
+            return '{}.gz'.format(self.format)
+        return self.format
+
+    def get_content_type(self):
+        if self.is_compressed():
+            return 'application/gzip'
+        return self.CONTENT_TYPES[self.format]
+
     def get_pretty_filename(self):
         """Return the filename as it should be downloaded."""
         return 'export_{time:%Y%m%d-%H%M}_{org}_{cat}.{exten}'.format(
             time=timezone.localtime(self.created_on),
             org=self.category.organisation.slug,
             cat=self.category.category_template.slug,
-            exten=self.format)
+            exten=self.get_extension())
 
     def get_filename(self):
         return 'export_{time:%Y%m%d}_{uid}.{exten}'.format(
             time=self.created_on,
             uid=self.id,
-            exten=self.format)
+            exten=self.get_extension())
 
     def get_url(self):
         return os.path.join(
@@ -111,26 +186,254 @@ class Export(models.Model):
             self.get_filename())
 
     def start_export(self, async=True):
-        """Asynchronously starts the export"""
-        logger.info('Starting import {}'.format(self.id))
+        """Asynchronously starts the export.
+
+        If an identical export was already written since the last update of
+        the category index, its file is reused instead.
+
+        """
+        self.generation = get_generation(self.category.document_type())
+        duplicate = self.get_duplicate()
+        if duplicate:
+            logger.info('Export {} reuses the file of export {}'.format(
+                self.id, duplicate.id))
+            self.copy_file(duplicate)
+            self.nb_rows = duplicate.nb_rows
+            self.status = self.STATUSES.processing
+            self.save()
+            finish_export(self)
+            return
 
+        logger.info('Starting export {}'.format(self.id))
+        self.task_id = task_uuid()
+        self.save()
         if async:
-            process_export.delay(unicode(self.pk))
+            process_export.apply_async(
+                (unicode(self.pk),), task_id=self.task_id)
         else:
             process_export(unicode(self.pk))
 
+    def get_duplicate(self):
+        """Returns a finished export with the same data, or None.
+
+        Exports are identical if they have the same category, querystring and
+        format, and were started at the same index generation, i.e no document
+        of the category was modified in between. Files that may have been
+        cleaned up are not considered.
+
+        """
+        if self.generation is None:
+            return None
+
+        validity = timedelta(days=settings.EXPORTS_VALIDITY_DURATION)
+        exports = Export.objects \
+            .filter(category=self.category) \
+            .filter(querystring=self.querystring) \
+            .filter(format=self.format) \
+            .filter(compressed=self.compressed) \
+            .filter(generation=self.generation) \
+            .filter(status=self.STATUSES.done) \
+            .filter(created_on__gt=timezone.now() - validity) \
+            .exclude(pk=self.pk) \
+            .order_by('-created_on')
+        for export in exports:
+            if os.path.exists(export.get_filepath()):
+                return export
+        return None
+
+    def copy_file(self, export):
+        """Use the file of another export.
+
+        The file is hard linked when possible, so it is not duplicated on
+        disk, and both exports can be cleaned up independently.
+
+        """
+        try:
+            os.link(export.get_filepath(), self.get_filepath())
+        except OSError:
+            shutil.copyfile(export.get_filepath(), self.get_filepath())
+
+    def cancel(self):
+        """Cancel a pending export.
+
+        The export task stops before writing the next chunk of data.
+
+        Returns False if the export is not pending anymore.
+
+        """
+        cancelled = Export.objects \
+            .filter(pk=self.pk) \
+            .filter(status__in=(self.STATUSES.new, self.STATUSES.processing)) \
+            .update(status=self.STATUSES.cancelled)
+        if cancelled:
+            self.status = self.STATUSES.cancelled
+        return bool(cancelled)
+
+    def report_progress(self, nb_rows):
+        """Add written rows to the export counter.
+
+        The total number of written rows is reported to the export task, so
+        the progression can be polled.
+
+        Raises `ExportCancelled` if the export was cancelled.
+
+        """
+        # Exports that are not saved (e.g in benchmarks) are not tracked
+        if self._state.adding:
+            return
+
+        updated = Export.objects \
+            .filter(pk=self.pk) \
+            .exclude(status=self.STATUSES.cancelled) \
+            .update(nb_rows=F('nb_rows') + nb_rows)
+        if not updated:
+            raise ExportCancelled()
+
+        if self.task_id and current_task:
+            total_rows = Export.objects \
+                .filter(pk=self.pk) \
+                .values_list('nb_rows', flat=True) \
+                .get()
+            current_task.update_state(
+                task_id=self.task_id,
+                state='PROGRESS',
+                meta={'rows': total_rows})
+
     def write_file(self):
-        """Generates and write the file."""
-        data_generator = self.get_data_generator()
-        formatter = self.get_data_formatter()
+        """Generates and write the file.
+
+        Returns the number of written rows.
 
+        """
         with self.open_file() as the_file:
-            for data_chunk in data_generator:
-                the_file.write(formatter.format(data_chunk))
+            nb_rows, from_source = self.write_data(the_file)
+
+        logger.info('Export {} done, {} rows written{}'.format(
+            self.id,
+            nb_rows,
+            ' from the index' if from_source else ''))
+        return nb_rows
+
+    def write_data(self, the_file, part=None, with_header=True):
+        """Write the exported data in the given file.
 
-        logger.info('Import {} done'.format(self.id))
+        Returns the number of written rows, and whether the data was
+        exported from the index.
 
-    def open_file(self):
+        """
+        data_generator = self.get_data_generator(part, with_header)
+
+        nb_rows = 0
+        for written_rows in self.write_chunks(the_file, data_generator):
+            self.report_progress(written_rows - nb_rows)
+            nb_rows = written_rows
+            logger.debug('Export {}: {} rows written'.format(
+                self.id, nb_rows))
+
+        return data_generator.nb_rows, data_generator.from_source
+
+    def write_chunks(self, the_file, data_generator):
+        """Format and write the data in the given file, chunk by chunk.
+
+        Yields the number of rows written so far. Compressed data is written as a
+        gzip member, so compressed parts can be concatenated.
+
+        """
+        formatter = self.get_data_formatter()
+        if self.is_compressed():
+            the_file = gzip.GzipFile(filename='', mode='wb', fileobj=the_file)
+
+        for data_chunk in data_generator:
+            the_file.write(formatter.format(data_chunk))
+            yield data_generator.nb_rows
+        formatter.finish(the_file)
+
+        if self.is_compressed():
+            # Writes the gzip trailer, the underlying file is not closed
+            the_file.close()
+
+    def stream_file(self):
+        """Yields the file content as it is generated.
+
+        Nothing is written on disk, and the export progress is not tracked.
+
+        """
+        buf = BytesIO()
+
+        def flush():
+            data = buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+            return data
+
+        for written_rows in self.write_chunks(buf, self.get_data_generator()):
+            yield flush()
+        yield flush()
+
+    def count_rows(self):
+        """Returns the number of exported rows, according to the index."""
+        builder = SearchBuilder(self.category, self.get_filters())
+        return get_backend().count(builder, only_latest_revisions=False)
+
+    def get_parts(self, parallelism=None):
+        """Split the exported list, to export it in parallel.
+
+        Returns a list of `(start, size)` slices of the list, or an empty
+        list if the export must be written at once. The last part has no
+        size, so revisions created in the meantime are exported too. Each
+        part fetches its revision ids itself, with a sorted scan, so no id
+        list goes through the broker.
+
+        Only csv files exported from the db can be split: xlsx and pdf files
+        cannot be concatenated, and indexed data is fetched along with the
+        revision ids anyway. Parts contain at least `EXPORTS_CHUNK_SIZE`
+        revisions.
+
+        """
+        if parallelism is None:
+            parallelism = settings.EXPORTS_PARALLELISM
+
+        if parallelism < 2 or self.format != self.FORMATS.csv or \
+                self.is_indexed():
+            return []
+
+        nb_rows = self.count_rows()
+        part_size = max(
+            settings.EXPORTS_CHUNK_SIZE,
+            int(math.ceil(nb_rows / float(parallelism))))
+        starts = range(0, nb_rows, part_size)
+        return [(start, part_size if start != starts[-1] else None)
+                for start in starts]
+
+    def get_part_filepath(self, index):
+        return '{}.part{}'.format(self.get_filepath(), index)
+
+    def write_part(self, index, part):
+        """Write a part of the file.
+
+        The header is only written in the first part.
+
+        Returns the number of written rows.
+
+        """
+        with self.open_file(self.get_part_filepath(index)) as the_file:
+            nb_rows, _ = self.write_data(
+                the_file, part, with_header=(index == 0))
+
+        logger.info('Export {}: part {} done, {} rows written'.format(
+            self.id, index, nb_rows))
+        return nb_rows
+
+    def merge_parts(self, nb_parts):
+        """Concatenate the parts in the file, and delete them."""
+        with self.open_file() as the_file:
+            for index in range(nb_parts):
+                part_filepath = self.get_part_filepath(index)
+                with open(part_filepath, 'rb') as part:
+                    shutil.copyfileobj(part, the_file)
+                os.remove(part_filepath)
+
+    def open_file(self, filepath=None):
         """Opens the file in which data should be dumped."""
 
         # Create the export dir if it does not exist
@@ -138,13 +441,35 @@ class Export(models.Model):
         if not os.path.exists(export_dir):
             os.makedirs(export_dir)
 
-        return open(self.get_filepath(), 'wb')
+        return open(filepath or self.get_filepath(), 'wb')
+
+    def is_indexed(self):
+        """Are all the exported fields indexed?
+
+        If so, the data can be exported from the index, without querying the
+        db. The live index is checked, since it may have been built before
+        some fields were indexed.
+
+        """
+        indexed_fields = get_backend().get_indexed_fields(self.category)
+        return set(self.get_fields().values()) <= indexed_fields
+
+    def get_data_generator(self, part=None, with_header=True):
+        """Returns a generator that yields chunks of data to export.
+
+        When `part` is given, only this part of the list is exported, from
+        the db (see `get_parts`).
 
-    def get_data_generator(self):
-        """Returns a generator that yields chunks of data to export."""
+        """
         generator_class = 'exports.generators.{}Generator'.format(self.format.upper())
         Generator = import_string(generator_class)
-        generator = Generator(self.category, self.get_filters(), self.get_fields())
+        generator = Generator(
+            self.category,
+            self.get_filters(),
+            self.get_fields(),
+            from_source=part is None and self.is_indexed(),
+            part=part,
+            with_header=with_header)
         return generator
 
     def get_data_formatter(self):
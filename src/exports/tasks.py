@@ -1,23 +1,118 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import os
+import logging
+
 from django.utils.translation import ugettext_lazy as _
 
+from celery import chord
+from celery.utils import uuid
+
 from core.celery import app
+from exports.errors import ExportCancelled
 from notifications.models import notify
 
 
+logger = logging.getLogger(__name__)
+
+
 @app.task
 def process_export(export_id):
+    """Write the export file.
+
+    When the export can be split (see `Export.get_parts`), parts are written
+    in parallel by distinct tasks, and concatenated afterwards. The progress
+    is then reported to the final task, whose id replaces the export's
+    `task_id`.
+
+    """
     from exports.models import Export
+    started = Export.objects \
+        .filter(id=export_id) \
+        .exclude(status=Export.STATUSES.cancelled) \
+        .update(status=Export.STATUSES.processing, nb_rows=0)
+    if not started:
+        return
+
     export = Export.objects.select_related().get(id=export_id)
-    export.status = 'processing'
-    export.save()
-    export.write_file()
-    export.status = 'done'
-    export.save()
+    try:
+        parts = export.get_parts()
+        if len(parts) > 1:
+            export.task_id = uuid()
+            export.save(update_fields=['task_id'])
+            part_tasks = [
+                write_export_part.s(export_id, index, part)
+                for index, part in enumerate(parts)]
+            merge_task = merge_export_parts.subtask(
+                (export_id,), task_id=export.task_id)
+            chord(part_tasks)(merge_task)
+        else:
+            export.write_file()
+            finish_export(export)
+    except ExportCancelled:
+        cancel_export(export)
+
+
+@app.task
+def write_export_part(export_id, index, part):
+    """Write a part of the export.
+
+    Returns the number of written rows, or None if the export was cancelled.
+
+    """
+    from exports.models import Export
+    export = Export.objects.select_related().get(id=export_id)
+    try:
+        return export.write_part(index, part)
+    except ExportCancelled:
+        return None
+
 
+@app.task
+def merge_export_parts(nb_rows, export_id):
+    """Concatenate the parts, once they were all written.
+
+    `nb_rows` is the list of rows written in every part.
+
+    """
+    from exports.models import Export
+    export = Export.objects.select_related().get(id=export_id)
+    if None in nb_rows or export.status == Export.STATUSES.cancelled:
+        cancel_export(export, nb_parts=len(nb_rows))
+        return
+
+    export.merge_parts(len(nb_rows))
+    finish_export(export)
+
+
+def finish_export(export):
+    """Mark the export as done, and notify the owner.
+
+    If the export was cancelled in the meantime, the file is deleted.
+
+    """
+    from exports.models import Export
+    done = Export.objects \
+        .filter(pk=export.pk) \
+        .filter(status=Export.STATUSES.processing) \
+        .update(status=Export.STATUSES.done)
+    if not done:
+        cancel_export(export)
+        return
+
+    export.status = Export.STATUSES.done
     url = export.get_absolute_url()
     message = _('The export <a href="{}">you required for category {} is ready</a>.'.format(
         url, export.category))
     notify(export.owner, message)
+
+
+def cancel_export(export, nb_parts=0):
+    """Delete the files of a cancelled export."""
+    logger.info('Export {} was cancelled'.format(export.id))
+    filepaths = [export.get_filepath()] + [
+        export.get_part_filepath(index) for index in range(nb_parts)]
+    for filepath in filepaths:
+        if os.path.exists(filepath):
+            os.remove(filepath)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.contrib.contenttypes.models import ContentType
+
+from documents.factories import DocumentFactory
+from categories.factories import CategoryFactory
+from default_documents.factories import (
+    ContractorDeliverableFactory, ContractorDeliverableRevisionFactory)
+from default_documents.models import ContractorDeliverable
+from search.models import IndexOperation
+from search.tasks import flush_index_queue
+
+
+@override_settings(
+    SEARCH_BACKEND='search.backends.db.DatabaseBackend',
+    EXPORTS_CHUNK_SIZE=5)
+class BenchmarkExportTests(TestCase):
+    def setUp(self):
+        Model = ContentType.objects.get_for_model(ContractorDeliverable)
+        self.category = CategoryFactory(category_template__metadata_model=Model)
+        for i in range(12):
+            doc = DocumentFactory(
+                metadata_factory_class=ContractorDeliverableFactory,
+                revision_factory_class=ContractorDeliverableRevisionFactory,
+                category=self.category)
+            IndexOperation.objects.queue_index(doc)
+        flush_index_queue()
+
+    def test_benchmark_export(self):
+        out = StringIO()
+        call_command('benchmark_export', '{}/{}'.format(
+            self.category.organisation.slug,
+            self.category.category_template.slug), stdout=out)
+        self.assertIn('12 rows', out.getvalue())
+
+    def test_benchmark_parallel_export(self):
+        out = StringIO()
+        call_command('benchmark_export', '{}/{}'.format(
+            self.category.organisation.slug,
+            self.category.category_template.slug),
+            parallelism=2, workers=1, stdout=out)
+        self.assertIn('12 rows in 2 parts', out.getvalue())
@@ -1,6 +1,12 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import re
+import datetime
+import zipfile
+from io import BytesIO
+from collections import OrderedDict
+
 from django.test import TestCase
 from django.contrib.contenttypes.models import ContentType
 
@@ -10,7 +16,12 @@ from categories.factories import CategoryFactory
 from default_documents.factories import (
     ContractorDeliverableFactory, ContractorDeliverableRevisionFactory)
 from default_documents.models import ContractorDeliverable
-from exports.formatters import CSVFormatter
+from exports.formatters import (
+    CSVFormatter, XLSXFormatter, PDFFormatter, XLSX_DATETIME_FORMAT,
+    write_line_break)
+
+from mock import patch, PropertyMock
+from openpyxl import load_workbook
 
 
 class FormatterTests(TestCase):
@@ -53,3 +64,141 @@ class FormatterTests(TestCase):
         csv = formatter.format([revision])
         expected_csv = b'{};Grand Schtroumpf\n'.format(metadata.document_key)
         self.assertEqual(csv, expected_csv)
+
+    def get_xlsx_rows(self, formatter, docs):
+        formatter.format(docs)
+        the_file = BytesIO()
+        formatter.finish(the_file)
+        the_file.seek(0)
+        worksheet = load_workbook(the_file).active
+        return [[cell.value for cell in row] for row in worksheet.rows]
+
+    def test_xlsx_formatter(self):
+        fields = OrderedDict((
+            ('Document Number', 'document_key'),
+            ('Revision', 'revision'),
+            ('Revision date', 'revision_date'),
+            ('Title', 'title'),
+        ))
+        revision = self.revisions[0]
+        revision.revision_date = datetime.date(2015, 10, 1)
+        formatter = XLSXFormatter(fields)
+        rows = self.get_xlsx_rows(formatter, [fields.keys(), revision])
+        self.assertEqual(rows, [
+            fields.keys(),
+            [
+                self.docs[0].document_key,
+                revision.revision,
+                datetime.datetime(2015, 10, 1),
+                self.docs[0].title,
+            ],
+        ])
+
+    def test_xlsx_formatter_indexed_data(self):
+        fields = OrderedDict((
+            ('Created on', 'created_on'),
+            ('Weight', 'weight'),
+            ('Leader', 'leader'),
+            ('Title', 'title'),
+        ))
+        formatter = XLSXFormatter(fields)
+        rows = self.get_xlsx_rows(formatter, [{
+            'created_on': '2015-10-01',
+            'weight': 1.5,
+            'title': 'Control\x07 characters',
+            'leader': None,
+        }])
+        self.assertEqual(rows, [[
+            datetime.datetime(2015, 10, 1), 1.5, None, 'Control characters']])
+
+    def test_xlsx_formatter_datetimes(self):
+        fields = OrderedDict((
+            ('Created on', 'created_on'),
+            ('Updated on', 'updated_on'),
+            ('Title', 'title'),
+        ))
+        formatter = XLSXFormatter(fields)
+        the_file = BytesIO()
+        formatter.format([{
+            'created_on': '2015-10-01',
+            'updated_on': '2015-10-02T13:45:30',
+            'title': 'Title',
+        }])
+        formatter.finish(the_file)
+        the_file.seek(0)
+
+        worksheet = load_workbook(the_file).active
+        created_on, updated_on, title = worksheet.rows[0]
+        self.assertEqual(
+            updated_on.value, datetime.datetime(2015, 10, 2, 13, 45, 30))
+        self.assertEqual(updated_on.number_format, XLSX_DATETIME_FORMAT)
+        self.assertEqual(created_on.number_format, 'yyyy-mm-dd')
+        self.assertEqual(title.number_format, 'General')
+
+    def get_xlsx_sheet(self, formatter, rows):
+        formatter.format(rows)
+        the_file = BytesIO()
+        formatter.finish(the_file)
+        return zipfile.ZipFile(the_file).read('xl/worksheets/sheet1.xml')
+
+    def test_xlsx_rows_are_separated_by_line_breaks(self):
+        rows = [['a', 'b'], ['c', 'd']]
+        formatter = XLSXFormatter(OrderedDict())
+        sheet = self.get_xlsx_sheet(formatter, rows)
+        self.assertEqual(sheet.count(b'</row>\n'), 2)
+
+    @patch('exports.formatters.XLSX_LINE_BREAKS', False)
+    def test_xlsx_line_breaks_are_optional(self):
+        rows = [['a', 'b'], ['c', 'd']]
+        formatter = XLSXFormatter(OrderedDict())
+        sheet = self.get_xlsx_sheet(formatter, rows)
+        self.assertEqual(sheet.count(b'</row>\n'), 0)
+        self.assertEqual(sheet.count(b'</row>'), 2)
+
+    def test_xlsx_line_breaks_need_openpyxl_internals(self):
+        formatter = XLSXFormatter(OrderedDict())
+        worksheet = formatter.worksheet
+        with patch.object(
+                type(worksheet), '_get_content_generator', create=True,
+                new_callable=PropertyMock, side_effect=AttributeError):
+            self.assertFalse(write_line_break(worksheet))
+
+    def get_pdf(self, formatter, chunks):
+        for chunk in chunks:
+            formatter.format(chunk)
+        the_file = BytesIO()
+        formatter.finish(the_file)
+        return the_file.getvalue()
+
+    def count_pages(self, pdf):
+        return len(re.findall(br'/Type /Page\b(?!s)', pdf))
+
+    def test_pdf_formatter(self):
+        fields = OrderedDict((
+            ('Document Number', 'document_key'),
+            ('Title', 'title'),
+        ))
+        formatter = PDFFormatter(fields)
+        pdf = self.get_pdf(formatter, [[fields.keys()], self.revisions])
+        self.assertTrue(pdf.startswith(b'%PDF'))
+        self.assertEqual(self.count_pages(pdf), 1)
+
+    def test_pdf_formatter_pagination(self):
+        fields = OrderedDict((
+            ('Document Number', 'document_key'),
+            ('Title', 'title'),
+        ))
+        chunks = [[fields.keys()]]
+        for start in range(0, 500, 150):
+            chunks.append([
+                {'document_key': 'KEY-{}'.format(i), 'title': 'Title ' * 20}
+                for i in range(start, min(start + 150, 500))])
+
+        formatter = PDFFormatter(fields)
+        pdf = self.get_pdf(formatter, chunks)
+        self.assertGreater(self.count_pages(pdf), 10)
+
+    def test_pdf_formatter_empty_export(self):
+        formatter = PDFFormatter({'Title': 'title'})
+        pdf = self.get_pdf(formatter, [[['Title']]])
+        self.assertEqual(self.count_pages(pdf), 1)
@@ -6,31 +6,35 @@ from collections import OrderedDict
 from django.test import TestCase, override_settings
 from django.contrib.contenttypes.models import ContentType
 
-from mock import MagicMock
+from mock import MagicMock, patch
+
+from search.models import IndexOperation
+from search.tasks import flush_index_queue
 
 from documents.factories import DocumentFactory
 from categories.factories import CategoryFactory
 from default_documents.factories import (
     ContractorDeliverableFactory, ContractorDeliverableRevisionFactory)
-from default_documents.models import ContractorDeliverable
+from default_documents.models import (
+    ContractorDeliverable, ContractorDeliverableRevision)
 from exports.generators import ExportGenerator, CSVGenerator
+from exports.formatters import CSVFormatter
 
 
 class ExportGeneratorTests(TestCase):
     def setUp(self):
         Model = ContentType.objects.get_for_model(ContractorDeliverable)
         self.category = CategoryFactory(category_template__metadata_model=Model)
-        self.docs = (
+        self.docs = [
             DocumentFactory(
                 metadata_factory_class=ContractorDeliverableFactory,
                 revision_factory_class=ContractorDeliverableRevisionFactory,
                 category=self.category)
-            for i in range(1, 20))
+            for i in range(1, 20)]
 
-        self.es_mock = MagicMock(return_value=(
-            [doc.latest_revision.pk for doc in self.docs],
-            20
-        ))
+        # Ids are streamed by the search backend
+        self.pks = [doc.latest_revision.pk for doc in self.docs]
+        self.es_mock = MagicMock(side_effect=lambda: iter(self.pks))
 
     @override_settings(EXPORTS_CHUNK_SIZE=5)
     def test_generator_iterator(self):
@@ -40,16 +44,16 @@ class ExportGeneratorTests(TestCase):
         chunk = iterator.next()  # header
 
         chunk = iterator.next()
-        self.assertEqual(chunk.count(), 5)
+        self.assertEqual(len(chunk), 5)
 
         chunk = iterator.next()
-        self.assertEqual(chunk.count(), 5)
+        self.assertEqual(len(chunk), 5)
 
         chunk = iterator.next()
-        self.assertEqual(chunk.count(), 5)
+        self.assertEqual(len(chunk), 5)
 
         chunk = iterator.next()
-        self.assertEqual(chunk.count(), 4)
+        self.assertEqual(len(chunk), 4)
 
         with self.assertRaises(StopIteration):
             chunk = iterator.next()
@@ -63,3 +67,122 @@ class ExportGeneratorTests(TestCase):
         iterator = iter(generator)
         chunk = iterator.next()
         self.assertEqual(chunk, [['Title', 'Document number']])
+
+    @override_settings(EXPORTS_CHUNK_SIZE=5)
+    def test_chunk_queries(self):
+        fields = ContractorDeliverable.PhaseConfig.export_fields
+        generator = CSVGenerator(self.category, {}, fields)
+        generator.get_es_results = self.es_mock
+        iterator = iter(generator)
+        iterator.next()  # header
+
+        # Revisions, then metadata and related objects
+        with self.assertNumQueries(2):
+            chunk = iterator.next()
+
+        formatter = CSVFormatter(fields)
+        with self.assertNumQueries(0):
+            csv = formatter.format(chunk)
+        self.assertEqual(len(csv.splitlines()), 5)
+
+    @override_settings(EXPORTS_CHUNK_SIZE=5)
+    def test_deleted_revisions_are_skipped(self):
+        ContractorDeliverableRevision.objects \
+            .filter(pk=self.pks[0]) \
+            .delete()
+        generator = ExportGenerator(self.category, {}, {})
+        generator.get_es_results = self.es_mock
+        chunks = list(generator)[1:]
+        self.assertEqual(sum(len(chunk) for chunk in chunks), 18)
+
+    @override_settings(
+        SEARCH_BACKEND='search.backends.db.DatabaseBackend',
+        EXPORTS_CHUNK_SIZE=5)
+    def test_export_from_source(self):
+        for doc in self.docs:
+            IndexOperation.objects.queue_index(doc)
+        flush_index_queue()
+
+        fields = OrderedDict((
+            ('Document number', 'document_key'),
+            ('Title', 'title'),
+            ('Leader', 'leader')))
+        generator = CSVGenerator(
+            self.category, {}, fields, from_source=True)
+        iterator = iter(generator)
+        iterator.next()  # header
+
+        with self.assertNumQueries(1):
+            chunk = iterator.next()
+        self.assertEqual(len(chunk), 5)
+
+        # Indexed values are formatted like db values
+        revision = ContractorDeliverableRevision.objects \
+            .get(document__document_key=chunk[0]['document_key'])
+        formatter = CSVFormatter(fields)
+        self.assertEqual(
+            formatter.format(chunk[:1]),
+            formatter.format([revision]))
+
+        # Iterating again starts a new scan
+        list(generator)
+        self.assertEqual(generator.nb_rows, 19)
+
+    @override_settings(
+        SEARCH_BACKEND='search.backends.db.DatabaseBackend',
+        EXPORTS_CHUNK_SIZE=5)
+    def test_export_follows_the_list_order(self):
+        for doc in self.docs:
+            IndexOperation.objects.queue_index(doc)
+        flush_index_queue()
+
+        generator = ExportGenerator(
+            self.category, {'sort_by': '-document_key'}, {}, ordered=True)
+        revisions = [revision for chunk in list(generator)[1:]
+                     for revision in chunk]
+        self.assertEqual(
+            [revision.document.document_key for revision in revisions],
+            sorted([doc.document_key for doc in self.docs], reverse=True))
+
+        fields = OrderedDict((('Document number', 'document_key'),))
+        generator = ExportGenerator(
+            self.category, {'sort_by': '-document_key'}, fields,
+            from_source=True, ordered=True)
+        sources = [source for chunk in list(generator)[1:]
+                   for source in chunk]
+        self.assertEqual(
+            [source['document_key'] for source in sources],
+            sorted([doc.document_key for doc in self.docs], reverse=True))
+
+    def test_unsplit_exports_are_not_sorted(self):
+        generator = ExportGenerator(self.category, {}, {})
+        with patch('exports.generators.get_backend') as backend_mock:
+            backend_mock.return_value.scan.return_value = []
+            list(generator.get_es_results())
+        self.assertFalse(backend_mock().scan.call_args[1]['ordered'])
+
+    @override_settings(
+        SEARCH_BACKEND='search.backends.db.DatabaseBackend',
+        EXPORTS_CHUNK_SIZE=5)
+    def test_export_part(self):
+        for doc in self.docs:
+            IndexOperation.objects.queue_index(doc)
+        flush_index_queue()
+
+        filters = {'sort_by': 'document_key'}
+        keys = sorted(doc.document_key for doc in self.docs)
+        generator = ExportGenerator(self.category, filters, {}, part=(5, 10))
+        self.assertTrue(generator.ordered)
+        revisions = [revision for chunk in list(generator)[1:]
+                     for revision in chunk]
+        self.assertEqual(
+            [revision.document.document_key for revision in revisions],
+            keys[5:15])
+
+        generator = ExportGenerator(
+            self.category, filters, {}, part=(15, None))
+        revisions = [revision for chunk in list(generator)[1:]
+                     for revision in chunk]
+        self.assertEqual(
+            [revision.document.document_key for revision in revisions],
+            keys[15:])
@@ -1,17 +1,27 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import os
 import datetime
 from uuid import UUID
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.utils.timezone import UTC
+from django.contrib.contenttypes.models import ContentType
+
+from mock import patch
+from elasticsearch.exceptions import ConnectionError
 
 from categories.factories import CategoryFactory
 from accounts.factories import UserFactory
+from default_documents.models import ContractorDeliverable
 from exports.factories import ExportFactory
+from exports.models import normalize_querystring
+from exports.errors import ExportCancelled
 from exports.generators import ExportGenerator
-from exports.formatters import CSVFormatter
+from exports.formatters import CSVFormatter, XLSXFormatter, PDFFormatter
+from search.cache import bump_generation
+from search.utils import get_mapping
 
 
 class ExportTests(TestCase):
@@ -45,11 +55,65 @@ class ExportTests(TestCase):
         generator = export.get_data_generator()
         self.assertTrue(isinstance(generator, ExportGenerator))
 
+    def mock_live_mapping(self, category, exclude=()):
+        """The live index has the category mapping, but `exclude` fields."""
+        document_type = category.document_type()
+        properties = get_mapping(category.document_class())['properties']
+        properties = dict((field, value) for field, value in properties.items()
+                          if field not in exclude)
+        patcher = patch('search.backends.elastic.elastic')
+        self.elastic_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.elastic_mock.indices.get_mapping.return_value = {
+            'test_documents_20150101120000000000': {'mappings': {
+                document_type: {'properties': properties}}}}
+
+    def test_default_fields_are_indexed(self):
+        export = self.create_export()
+        self.mock_live_mapping(self.category)
+        self.assertTrue(export.is_indexed())
+        self.assertTrue(export.get_data_generator().from_source)
+
+    def test_fields_not_indexed(self):
+        Model = ContentType.objects.get_for_model(ContractorDeliverable)
+        category = CategoryFactory(category_template__metadata_model=Model)
+        export = self.create_export(category=category)
+        self.mock_live_mapping(category)
+        self.assertFalse(export.is_indexed())
+        self.assertFalse(export.get_data_generator().from_source)
+
+    def test_fields_missing_from_the_live_index(self):
+        export = self.create_export()
+        self.mock_live_mapping(self.category, exclude=['title'])
+        self.assertFalse(export.is_indexed())
+
+    def test_live_mapping_cannot_be_read(self):
+        export = self.create_export()
+        self.mock_live_mapping(self.category)
+        self.elastic_mock.indices.get_mapping.side_effect = ConnectionError
+        self.assertFalse(export.is_indexed())
+
     def test_get_data_formatter(self):
         export = self.create_export()
         formatter = export.get_data_formatter()
         self.assertTrue(isinstance(formatter, CSVFormatter))
 
+    def test_get_xlsx_data_formatter(self):
+        export = self.create_export(format='xlsx')
+        formatter = export.get_data_formatter()
+        self.assertTrue(isinstance(formatter, XLSXFormatter))
+        self.assertEqual(
+            export.get_filename()[-5:], '.xlsx')
+
+    def test_pdf_export_fields(self):
+        Model = ContentType.objects.get_for_model(ContractorDeliverable)
+        category = CategoryFactory(category_template__metadata_model=Model)
+        export = self.create_export(category=category, format='pdf')
+        self.assertEqual(
+            export.get_fields().items(),
+            list(ContractorDeliverable.PhaseConfig.column_fields))
+        self.assertTrue(isinstance(export.get_data_formatter(), PDFFormatter))
+
     def test_get_filters(self):
         qs = 'toto=riri&tata=fifi&tutu=loulou'
         export = self.create_export(querystring=qs)
@@ -57,3 +121,80 @@ class ExportTests(TestCase):
         self.assertEqual(filters['toto'], 'riri')
         self.assertEqual(filters['tata'], 'fifi')
         self.assertEqual(filters['tutu'], 'loulou')
+
+    def test_normalize_querystring(self):
+        self.assertEqual(
+            normalize_querystring('status=STD&leader=&docclass=3&docclass=1'),
+            'docclass=1&docclass=3&status=STD')
+
+    def test_cancel(self):
+        export = self.create_export(status='processing')
+        self.assertTrue(export.cancel())
+        self.assertEqual(export.status, 'cancelled')
+        self.assertRaises(ExportCancelled, export.write_file)
+
+        export = self.create_export(status='done')
+        self.assertFalse(export.cancel())
+
+
+@override_settings(SEARCH_BACKEND='search.backends.db.DatabaseBackend')
+class DuplicateExportTests(TestCase):
+    def setUp(self):
+        self.category = CategoryFactory()
+        self.user = UserFactory(
+            email='testadmin@phase.fr',
+            password='pass',
+            is_superuser=True,
+            category=self.category)
+        self.export = self.create_export()
+        self.export.start_export(async=False)
+        self.export.refresh_from_db()
+
+    def tearDown(self):
+        for filepath in self.filepaths:
+            if os.path.exists(filepath):
+                os.remove(filepath)
+
+    def create_export(self, **kwargs):
+        data = {
+            'owner': self.user,
+            'category': self.category,
+            'querystring': 'status=STD'}
+        data.update(kwargs)
+        export = ExportFactory(**data)
+        self.filepaths = getattr(self, 'filepaths', []) + [
+            export.get_filepath()]
+        return export
+
+    def test_identical_export_reuses_the_file(self):
+        export = self.create_export()
+        export.start_export(async=False)
+        self.assertEqual(export.get_duplicate(), self.export)
+        self.assertEqual(export.status, 'done')
+        self.assertEqual(export.task_id, '')
+        self.assertTrue(os.path.samefile(
+            export.get_filepath(), self.export.get_filepath()))
+
+    def test_updated_index_is_exported_again(self):
+        bump_generation(self.category.document_type())
+        export = self.create_export()
+        export.start_export(async=False)
+        self.assertIsNone(export.get_duplicate())
+        self.assertNotEqual(export.task_id, '')
+        self.assertFalse(os.path.samefile(
+            export.get_filepath(), self.export.get_filepath()))
+
+    def test_different_exports_are_not_reused(self):
+        export = self.create_export(querystring='status=SPD')
+        export.generation = self.export.generation
+        self.assertIsNone(export.get_duplicate())
+
+        export = self.create_export(format='xlsx')
+        export.generation = self.export.generation
+        self.assertIsNone(export.get_duplicate())
+
+    def test_deleted_file_is_not_reused(self):
+        os.remove(self.export.get_filepath())
+        export = self.create_export()
+        export.generation = self.export.generation
+        self.assertIsNone(export.get_duplicate())
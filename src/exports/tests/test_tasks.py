@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import gzip
+import json
+from io import BytesIO
+
+from django.test import TestCase, override_settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.urlresolvers import reverse
+
+from mock import patch
+
+from accounts.factories import UserFactory
+from documents.factories import DocumentFactory
+from categories.factories import CategoryFactory
+from default_documents.factories import (
+    ContractorDeliverableFactory, ContractorDeliverableRevisionFactory)
+from default_documents.models import ContractorDeliverable
+from exports.factories import ExportFactory
+from exports.formatters import CSVFormatter
+from exports.models import Export
+from exports.tasks import process_export
+from notifications.models import Notification
+from search.models import IndexOperation
+from search.tasks import flush_index_queue
+
+
+@override_settings(
+    SEARCH_BACKEND='search.backends.db.DatabaseBackend',
+    EXPORTS_CHUNK_SIZE=5)
+class ParallelExportTests(TestCase):
+    def setUp(self):
+        Model = ContentType.objects.get_for_model(ContractorDeliverable)
+        self.category = CategoryFactory(category_template__metadata_model=Model)
+        self.user = UserFactory(
+            email='testadmin@phase.fr',
+            password='pass',
+            is_superuser=True,
+            category=self.category)
+        for i in range(12):
+            doc = DocumentFactory(
+                metadata_factory_class=ContractorDeliverableFactory,
+                revision_factory_class=ContractorDeliverableRevisionFactory,
+                category=self.category)
+            IndexOperation.objects.queue_index(doc)
+        flush_index_queue()
+
+    def export(self, **kwargs):
+        export = ExportFactory(owner=self.user, category=self.category, **kwargs)
+        process_export(unicode(export.pk))
+        export.refresh_from_db()
+        self.assertEqual(export.status, 'done')
+        with open(export.get_filepath(), 'rb') as the_file:
+            content = the_file.read()
+        os.remove(export.get_filepath())
+        return export, content
+
+    def test_get_parts(self):
+        export = ExportFactory(owner=self.user, category=self.category)
+        self.assertEqual(export.get_parts(parallelism=1), [])
+        self.assertEqual(
+            export.get_parts(parallelism=3), [(0, 5), (5, 5), (10, None)])
+        self.assertEqual(
+            export.get_parts(parallelism=2), [(0, 6), (6, None)])
+
+    def test_xlsx_exports_are_not_split(self):
+        export = ExportFactory(
+            owner=self.user, category=self.category, format='xlsx')
+        self.assertEqual(export.get_parts(parallelism=3), [])
+
+    def test_parallel_export(self):
+        with self.settings(EXPORTS_PARALLELISM=1):
+            _, serial_content = self.export()
+
+        with self.settings(EXPORTS_PARALLELISM=3):
+            export, content = self.export()
+
+        # Serial exports are not sorted, parts are concatenated in the list
+        # order
+        lines = content.splitlines()
+        serial_lines = serial_content.splitlines()
+        self.assertEqual(lines[0], serial_lines[0])
+        self.assertEqual(sorted(lines[1:]), sorted(serial_lines[1:]))
+        self.assertEqual(len(lines), 13)
+        for index in range(3):
+            self.assertFalse(os.path.exists(export.get_part_filepath(index)))
+
+    def test_parallel_export_follows_the_list_order(self):
+        with self.settings(EXPORTS_PARALLELISM=3):
+            export, content = self.export(
+                querystring='sort_by=-document_number')
+
+        numbers = [line.split(';')[0] for line in content.splitlines()[1:]]
+        self.assertEqual(len(numbers), 12)
+        self.assertEqual(numbers, sorted(numbers, reverse=True))
+
+    def test_parallel_compressed_export(self):
+        with self.settings(EXPORTS_PARALLELISM=1):
+            _, content = self.export()
+
+        with self.settings(EXPORTS_PARALLELISM=3):
+            export, compressed = self.export(compressed=True)
+
+        # Compressed parts are concatenated gzip members
+        self.assertTrue(export.get_filepath().endswith('.csv.gz'))
+        self.assertEqual(
+            gzip.GzipFile(fileobj=BytesIO(compressed)).read(), content)
+
+    def test_rows_are_counted(self):
+        with self.settings(EXPORTS_PARALLELISM=3):
+            export, _ = self.export()
+        self.assertEqual(export.nb_rows, 12)
+
+    def test_progress_is_reported_to_the_task(self):
+        export = ExportFactory(
+            owner=self.user, category=self.category, task_id='task-id')
+        Export.objects.filter(pk=export.pk).update(status='processing')
+        with patch('exports.models.current_task') as task:
+            export.report_progress(5)
+            export.report_progress(3)
+        task.update_state.assert_called_with(
+            task_id='task-id', state='PROGRESS', meta={'rows': 8})
+
+    def test_poll_written_rows(self):
+        process_export.backend.store_result('task-id', {'rows': 8}, 'PROGRESS')
+        self.client.login(email=self.user.email, password='pass')
+        res = self.client.get(reverse('task_poll', args=['task-id']))
+        data = json.loads(res.content)
+        self.assertFalse(data['done'])
+        self.assertEqual(data['rows'], 8)
+
+    def test_cancelled_export_is_not_processed(self):
+        export = ExportFactory(
+            owner=self.user, category=self.category, status='cancelled')
+        process_export(unicode(export.pk))
+        export.refresh_from_db()
+        self.assertEqual(export.status, 'cancelled')
+        self.assertFalse(os.path.exists(export.get_filepath()))
+
+    def cancel_during_export(self, parallelism):
+        export = ExportFactory(owner=self.user, category=self.category)
+
+        def cancel(data_chunk):
+            export.cancel()
+            return b''
+
+        with self.settings(EXPORTS_PARALLELISM=parallelism):
+            with patch.object(CSVFormatter, 'format', side_effect=cancel):
+                process_export(unicode(export.pk))
+
+        export.refresh_from_db()
+        self.assertEqual(export.status, 'cancelled')
+        self.assertFalse(os.path.exists(export.get_filepath()))
+        for index in range(3):
+            self.assertFalse(os.path.exists(export.get_part_filepath(index)))
+        self.assertEqual(Notification.objects.count(), 0)
+
+    def test_cancel_during_export(self):
+        self.cancel_during_export(parallelism=1)
+
+    def test_cancel_during_parallel_export(self):
+        self.cancel_during_export(parallelism=3)
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import gzip
+from io import BytesIO
+
+from django.test import TestCase, override_settings
+from django.core.urlresolvers import reverse
+
+from accounts.factories import UserFactory
+from categories.factories import CategoryFactory
+from documents.factories import DocumentFactory
+from exports.factories import ExportFactory
+from exports.models import Export
+from search.models import IndexOperation
+from search.tasks import flush_index_queue
+
+
+@override_settings(
+    SEARCH_BACKEND='search.backends.db.DatabaseBackend',
+    EXPORTS_STREAMING_THRESHOLD=0)
+class ExportViewTests(TestCase):
+    def setUp(self):
+        self.category = CategoryFactory()
+        self.user = UserFactory(
+            email='testadmin@phase.fr',
+            password='pass',
+            is_superuser=True,
+            category=self.category)
+        self.client.login(email=self.user.email, password='pass')
+        self.create_url = reverse('export_create', args=[
+            self.category.organisation.slug,
+            self.category.slug])
+
+    def post_export(self, querystring):
+        data = {
+            'csrfmiddlewaretoken': 'token',
+            'start': 0,
+            'size': 50,
+            'sort_by': 'document_key'}
+        data.update(querystring)
+        return self.client.post(self.create_url, data)
+
+    def create_export(self, querystring):
+        res = self.post_export(querystring)
+        self.assertRedirects(res, reverse('export_list'))
+        export = Export.objects.order_by('-created_on')[0]
+        self.addCleanup(os.remove, export.get_filepath())
+        return export
+
+    def test_identical_export_is_reused(self):
+        export = self.create_export({'status': 'STD', 'leader': ''})
+        self.assertEqual(
+            export.querystring, 'sort_by=document_key&status=STD')
+        self.assertEqual(export.status, 'done')
+
+        duplicate = self.create_export({'status': 'STD'})
+        self.assertEqual(duplicate.status, 'done')
+        self.assertEqual(duplicate.task_id, '')
+        self.assertTrue(os.path.samefile(
+            export.get_filepath(), duplicate.get_filepath()))
+
+    def test_pending_export_list(self):
+        export = ExportFactory(
+            owner=self.user, category=self.category,
+            status='processing', task_id='task-id', nb_rows=150)
+        res = self.client.get(reverse('export_list'))
+        self.assertContains(res, reverse('task_poll', args=['task-id']))
+        self.assertContains(res, '<span class="export-rows">150</span>')
+        self.assertContains(res, reverse('export_cancel', args=[export.id]))
+
+    def test_cancel_export(self):
+        export = ExportFactory(
+            owner=self.user, category=self.category, status='processing')
+        res = self.client.post(reverse('export_cancel', args=[export.id]))
+        self.assertRedirects(res, reverse('export_list'))
+        export.refresh_from_db()
+        self.assertEqual(export.status, 'cancelled')
+
+    def test_cannot_cancel_other_users_exports(self):
+        other_user = UserFactory(
+            email='other@phase.fr', password='pass', category=self.category)
+        export = ExportFactory(
+            owner=other_user, category=self.category, status='processing')
+        res = self.client.post(reverse('export_cancel', args=[export.id]))
+        self.assertEqual(res.status_code, 404)
+        export.refresh_from_db()
+        self.assertEqual(export.status, 'processing')
+
+    def test_download_compressed_export(self):
+        export = self.create_export({'compressed': '1'})
+        self.assertTrue(export.get_filename().endswith('.csv.gz'))
+
+        res = self.client.get(export.get_absolute_url())
+        self.assertEqual(res['Content-Type'], 'application/gzip')
+        self.assertFalse(res.has_header('Content-Encoding'))
+        content = b''.join(res.streaming_content)
+        self.assertTrue(
+            gzip.GzipFile(fileobj=BytesIO(content)).read().startswith(
+                b'Document Number;Title\n'))
+
+    @override_settings(EXPORTS_STREAMING_THRESHOLD=2)
+    def test_small_exports_are_streamed(self):
+        for i in range(2):
+            doc = DocumentFactory(category=self.category)
+            IndexOperation.objects.queue_index(doc)
+        flush_index_queue()
+
+        res = self.post_export({})
+        self.assertEqual(res['Content-Type'], 'text/csv')
+        self.assertIn('attachment; filename=export_', res['Content-Disposition'])
+        content = b''.join(res.streaming_content)
+        self.assertEqual(len(content.splitlines()), 3)
+        self.assertFalse(Export.objects.exists())
+
+        res = self.post_export({'compressed': '1'})
+        self.assertEqual(res['Content-Type'], 'application/gzip')
+        compressed = b''.join(res.streaming_content)
+        self.assertEqual(
+            gzip.GzipFile(fileobj=BytesIO(compressed)).read(), content)
+
+        doc = DocumentFactory(category=self.category)
+        IndexOperation.objects.queue_index(doc)
+        flush_index_queue()
+        export = self.create_export({})
+        self.assertEqual(export.nb_rows, 3)
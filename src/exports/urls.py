@@ -3,7 +3,7 @@ from __future__ import unicode_literals
 
 from django.conf.urls import patterns, url
 
-from exports.views import ExportCreate, ExportList, DownloadView
+from exports.views import ExportCreate, ExportList, ExportCancel, DownloadView
 
 
 urlpatterns = patterns(
@@ -12,6 +12,9 @@ urlpatterns = patterns(
     url(r'^$',
         ExportList.as_view(),
         name="export_list"),
+    url(r'^(?P<uid>[0-9a-f-]{36})/cancel/$',
+        ExportCancel.as_view(),
+        name='export_cancel'),
     url(r'^(?P<organisation>[\w-]+)/(?P<category>[\w-]+)/$',
         ExportCreate.as_view(),
         name="export_create"),
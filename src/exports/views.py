@@ -6,14 +6,15 @@ import os
 from django.views.generic import ListView, UpdateView, View
 from django.utils.translation import ugettext_lazy as _
 from django.core.urlresolvers import reverse
-from django.http import HttpResponse, Http404
+from django.http import (
+    HttpResponse, HttpResponseRedirect, StreamingHttpResponse, Http404)
 from django.views.static import serve
 from django.shortcuts import get_object_or_404
 from django.conf import settings
 
 from braces.views import LoginRequiredMixin
 
-from exports.models import Export
+from exports.models import Export, normalize_querystring
 from documents.views import DocumentListMixin
 
 
@@ -25,10 +26,16 @@ class ExportCreate(LoginRequiredMixin, DocumentListMixin, UpdateView):
     want to initialize the default instance ourselves in
     the `get_object` method.
 
+    The querystring is normalized, so identical exports can be detected and
+    their file reused.
+
+    Exports of at most `EXPORTS_STREAMING_THRESHOLD` rows are directly
+    streamed in the response, without being saved.
+
     """
 
     model = Export
-    fields = ('querystring',)
+    fields = ('querystring', 'format', 'compressed')
     http_method_names = ['post']
 
     def breadcrumb_section(self):
@@ -39,11 +46,14 @@ class ExportCreate(LoginRequiredMixin, DocumentListMixin, UpdateView):
         qd.pop('csrfmiddlewaretoken')
         qd.pop('start')
         qd.pop('size')
-        qd.pop('sort_by')
+        export_format = qd.pop('format', [Export.FORMATS.csv])[0]
+        compressed = qd.pop('compressed', [''])[0] == '1'
 
         kwargs = super(ExportCreate, self).get_form_kwargs()
         kwargs.update({'data': {
-            'querystring': qd.urlencode()
+            'querystring': normalize_querystring(qd.urlencode()),
+            'format': export_format,
+            'compressed': compressed,
         }})
         return kwargs
 
@@ -58,10 +68,22 @@ class ExportCreate(LoginRequiredMixin, DocumentListMixin, UpdateView):
         return reverse('export_list')
 
     def form_valid(self, form):
+        threshold = settings.EXPORTS_STREAMING_THRESHOLD
+        if threshold and self.object.count_rows() <= threshold:
+            return self.stream_export(self.object)
+
         return_value = super(ExportCreate, self).form_valid(form)
         self.object.start_export()
         return return_value
 
+    def stream_export(self, export):
+        response = StreamingHttpResponse(
+            export.stream_file(),
+            content_type=export.get_content_type())
+        response['Content-Disposition'] = 'attachment; filename={}'.format(
+            export.get_pretty_filename())
+        return response
+
 
 class ExportList(LoginRequiredMixin, ListView):
     model = Export
@@ -76,6 +98,17 @@ class ExportList(LoginRequiredMixin, ListView):
             .order_by('-created_on')
 
 
+class ExportCancel(LoginRequiredMixin, View):
+    """Cancel a pending export."""
+    http_method_names = ['post']
+
+    def post(self, request, *args, **kwargs):
+        qs = Export.objects.filter(owner=self.request.user)
+        export = get_object_or_404(qs, id=kwargs.get('uid'))
+        export.cancel()
+        return HttpResponseRedirect(reverse('export_list'))
+
+
 class DownloadView(LoginRequiredMixin, View):
     def get(self, request, *args, **kwargs):
         uid = kwargs.get('uid')
@@ -95,4 +128,10 @@ class DownloadView(LoginRequiredMixin, View):
             response['X-Accel-Redirect '] = url
             return response
         else:
-            return serve(request, url, settings.PRIVATE_ROOT)
+            response = serve(request, url, settings.PRIVATE_ROOT)
+            if export.is_compressed():
+                # Gzip files must be downloaded as is, not decoded by the
+                # browser
+                del response['Content-Encoding']
+                response['Content-Type'] = export.get_content_type()
+            return response
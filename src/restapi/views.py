@@ -34,6 +34,8 @@ class TaskPollView(View):
     ...     # do things
     ...     return 'done'
 
+    Other meta values (e.g the number of processed items) are also returned.
+
     """
     def get(self, request, job_id):
         """Return json data to describe the task."""
@@ -42,16 +44,18 @@ class TaskPollView(View):
         done = job.ready()
         success = job.successful()
         result = job.result
+        data = {}
         if isinstance(result, dict):
+            data.update(result)
             progress = result.get('progress', 0)
         else:
             progress = 100.0 if done else 0.0
 
-        data = {
+        data.update({
             'done': done,
             'success': success,
             'progress': progress
-        }
+        })
 
         # in case of error
         if done and not success:
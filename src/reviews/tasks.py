@@ -8,12 +8,14 @@ from django.db import transaction
 from django.utils.translation import ugettext
 from django.contrib.contenttypes.models import ContentType
 from celery import current_task
+from elasticsearch.exceptions import ElasticsearchException
 
 from core.celery import app
 from reviews.signals import pre_batch_review, post_batch_review, batch_item_indexed
 from reviews.models import Review
 from notifications.models import notify
 from discussion.models import Note
+from search.tasks import flush_index_queue
 
 
 logger = logging.getLogger(__name__)
@@ -68,6 +70,8 @@ def do_batch_import(user_id, category_id, contenttype_id, document_ids,
                     revision=doc.latest_revision.revision,
                     body=remark)
 
+            # Prevent `to_json` from fetching the metadata again
+            doc.latest_revision.metadata = doc
             batch_item_indexed.send(
                 sender=do_batch_import,
                 document_type=doc.document.document_type(),
@@ -86,6 +90,13 @@ def do_batch_import(user_id, category_id, contenttype_id, document_ids,
 
     post_batch_review.send(sender=do_batch_import, user_id=user_id)
 
+    # The document list is reloaded as soon as the task ends, so the index
+    # must be up to date. Otherwise, pending updates are processed later.
+    try:
+        flush_index_queue(document_ids=[doc.document_id for doc in ok])
+    except ElasticsearchException:
+        logger.error('Cannot reach ES, the index will be updated later')
+
     # Send success and failure notifications
     if len(ok) > 0:
         ok_message = ugettext('The review started for the following documents:')
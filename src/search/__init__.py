@@ -12,9 +12,15 @@ elastic = Elasticsearch(
     connection_class=RequestsHttpConnection)
 
 
-INDEX_SETTINGS = {
-    "settings": {
-        "analysis": {
+# Analysis settings used to index and search the `_all` field. The profile
+# is chosen when an index is created, with `settings.ELASTIC_ANALYSIS_PROFILE`.
+ANALYSIS_PROFILES = {
+    # Any part of a searchable value can be matched, but every value is split
+    # in (a lot of) grams of every possible length.
+    'ngram': {
+        'index_analyzer': 'nGram_analyzer',
+        'search_analyzer': 'whitespace_analyzer',
+        'analysis': {
             "filter": {
                 "nGram_filter": {
                     "type": "nGram",
@@ -41,8 +47,49 @@ INDEX_SETTINGS = {
                     ]
                 }
             }
-        }
-    }
+        },
+    },
+    # Only the beginning of words can be matched, e.g "pump" or "pum" match
+    # "Condensate Recycle Pump", but "ump" does not. The index is much
+    # smaller, and searches are faster.
+    'edge_ngram': {
+        'index_analyzer': 'edge_nGram_analyzer',
+        'search_analyzer': 'word_analyzer',
+        'analysis': {
+            "filter": {
+                "edge_nGram_filter": {
+                    "type": "edgeNGram",
+                    "min_gram": 2,
+                    "max_gram": 20,
+                },
+                # Longer search terms would not match any gram
+                "truncate_filter": {
+                    "type": "truncate",
+                    "length": 20,
+                }
+            },
+            "analyzer": {
+                "edge_nGram_analyzer": {
+                    "type": "custom",
+                    "tokenizer": "standard",
+                    "filter": [
+                        "lowercase",
+                        "asciifolding",
+                        "edge_nGram_filter"
+                    ]
+                },
+                "word_analyzer": {
+                    "type": "custom",
+                    "tokenizer": "standard",
+                    "filter": [
+                        "lowercase",
+                        "asciifolding",
+                        "truncate_filter"
+                    ]
+                }
+            }
+        },
+    },
 }
 
 
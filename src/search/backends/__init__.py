@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+def get_backend():
+    """Returns an instance of the search backend set in the settings."""
+    Backend = import_string(settings.SEARCH_BACKEND)
+    return Backend()
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+
+class BaseBackend(object):
+    """Executes the searches built by a `SearchBuilder`.
+
+    The builder parses the search filters. The backend runs the search and
+    returns results in the same format, whatever the search engine.
+
+    """
+
+    # If set, the index is managed with the functions in `search.utils` and
+    # `search.tasks`, that directly talk to elasticsearch. Otherwise, index
+    # updates go through the `bulk` and `run_operations` methods.
+    uses_elasticsearch = False
+
+    def search(self, builder, source_fields=None, with_aggregations=False):
+        """Returns a page of results.
+
+        Results are a dict with the `total` number of hits, the `data` of
+        the hits, a `cursor` to fetch the next page (or None) and the
+        `aggregations` if they were requested.
+
+        `source_fields` restricts the returned data to the given fields.
+
+        """
+        raise NotImplementedError()
+
+    def facets(self, builder):
+        """Returns the aggregations, e.g `{'status': {'STD': 12}}`."""
+        raise NotImplementedError()
+
+    def facet_values(self, builder, field, prefix):
+        """Returns the buckets of a single facet, e.g `{'STD': 12}`.
+
+        Only values starting with `prefix` are returned.
+
+        """
+        raise NotImplementedError()
+
+    def global_search(self, builder):
+        """Search the categories of a `GlobalSearchBuilder`.
+
+        Returns the `total` number of hits, and the `categories` with hits,
+        most hits first. Each category is a dict with the `document_type`,
+        the `total` number of hits, and the top `hits` data.
+
+        """
+        raise NotImplementedError()
+
+    def count(self, builder, only_latest_revisions=True):
+        """Returns the number of hits."""
+        raise NotImplementedError()
+
+    def scan(self, builder, fields, only_latest_revisions=True,
+             ordered=False):
+        """Yields every hit, as dicts of the given fields.
+
+        Pagination is ignored. Hits are only sorted if `ordered` is set,
+        which is slower.
+
+        """
+        raise NotImplementedError()
+
+    def scan_sources(self, builder, fields, only_latest_revisions=True,
+                     ordered=False):
+        """Yields the indexed data of every hit, restricted to the given fields.
+
+        Missing values are `None`. Pagination is ignored. Hits are only sorted
+        if `ordered` is set, which is slower.
+
+        """
+        raise NotImplementedError()
+
+    def get_indexed_fields(self, category):
+        """Returns the set of fields the index actually has for the category.
+
+        It can differ from the category mapping, e.g when fields were added
+        to the model since the index was built.
+
+        """
+        raise NotImplementedError()
+
+    def bulk(self, actions):
+        """Write elasticsearch like bulk actions (index, update, delete).
+
+        Returns the number of written documents and the list of errors.
+
+        """
+        raise NotImplementedError()
+
+    def run_operations(self, operations):
+        """Process queued `IndexOperation`s.
+
+        Returns counters of written documents and revisions, and the list of
+        updated document types.
+
+        """
+        raise NotImplementedError()
+
+    def refresh(self):
+        """Make the modifications visible to searches."""
+        pass
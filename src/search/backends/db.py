@@ -0,0 +1,480 @@
+# -*- coding: utf-8 -*-
+
+"""Search documents in the database, without elasticsearch.
+
+Indexed revisions are stored in a denormalized table (`SearchEntry`), and
+every field value in an indexed key / value table (`SearchValue`). Filters,
+sorting and aggregations are done with subqueries on the values table.
+
+The full text search has the same semantics as the elasticsearch analysis
+profile (`settings.ELASTIC_ANALYSIS_PROFILE`), case and accents being
+ignored. With the `ngram` profile, the search terms are matched as a whole,
+so a document matches if its searchable fields contain the whole phrase.
+With the `edge_ngram` profile, search terms are split in words, and a
+document matches if its searchable fields contain every word.
+
+"""
+
+from __future__ import unicode_literals
+
+import json
+import unicodedata
+from collections import Counter, OrderedDict, defaultdict
+
+from django.db import transaction
+from django.db.models import Q, Count
+from django.db.models.functions import Substr
+from django.conf import settings
+
+from elasticsearch.serializer import JSONSerializer
+
+from categories.models import Category
+from documents.models import Document
+from search.backends.base import BaseBackend
+from search.builder import GLOBAL_HIT_FIELDS, encode_cursor
+from search.models import IndexOperation, SearchEntry, SearchValue
+from search.utils import get_mapping, iter_index_data
+
+
+serializer = JSONSerializer()
+
+
+def normalize(text):
+    """Lowercase the text and remove accents, like the `asciifolding` filter."""
+    text = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in text if not unicodedata.combining(c)).lower()
+
+
+def get_search_q(search_terms):
+    """Entries whose searchable fields match the search terms."""
+    search_terms = normalize(search_terms)
+    if settings.ELASTIC_ANALYSIS_PROFILE != 'edge_ngram':
+        return Q(search_text__contains=search_terms)
+
+    q = Q()
+    for term in search_terms.split():
+        q &= Q(search_text__contains=term)
+    return q
+
+
+def get_field_name(field):
+    """Returns the indexed field name, e.g "status.raw" -> "status"."""
+    if field.endswith('.raw'):
+        field = field[:-len('.raw')]
+    return field
+
+
+def get_indexed_values(source):
+    """Yields (field, value, number) tuples for every scalar field."""
+    for field, value in source.items():
+        if value is None or isinstance(value, (list, dict)):
+            continue
+
+        if isinstance(value, bool):
+            yield field, 'T' if value else 'F', None
+        elif isinstance(value, (int, long, float)):
+            yield field, unicode(value), value
+        else:
+            yield field, unicode(value)[:255], None
+
+
+def get_value_lookup(value, operator=None):
+    """Returns the `SearchValue` lookup matching an indexed value."""
+    if isinstance(value, bool):
+        column, value = 'value', 'T' if value else 'F'
+    elif isinstance(value, (int, long, float)):
+        column = 'number'
+    else:
+        column = 'value'
+
+    if operator is not None:
+        column = '{}__{}'.format(column, operator)
+    return {column: value}
+
+
+def get_bucket_key(value, number):
+    if number is None:
+        return value
+    return int(number) if number == int(number) else number
+
+
+class DatabaseBackend(BaseBackend):
+    """Search documents in the database.
+
+    Well suited for small deployments and test environments. Pagination
+    cursors use the same range filters as with elasticsearch.
+
+    """
+
+    def search(self, builder, source_fields=None, with_aggregations=False):
+        entries = self.get_entries(builder)
+        size = builder.get_size()
+        if builder.search_after is not None:
+            page = entries.filter(
+                self.get_filter_q(builder.get_cursor_filter()))
+            page = self.sort_entries(page, builder)[:size]
+        else:
+            start = builder.filters.get('start') or 0
+            page = self.sort_entries(entries, builder)[start:start + size]
+        page = list(page)
+
+        results = {
+            'total': entries.count(),
+            'data': [self.get_source(entry, source_fields) for entry in page],
+            'cursor': self.get_cursor(page, size),
+            'aggregations': None,
+        }
+        if with_aggregations:
+            results['aggregations'] = self.get_aggregations(builder, entries)
+        return results
+
+    def facets(self, builder):
+        return self.get_aggregations(builder, self.get_entries(builder))
+
+    def facet_values(self, builder, field, prefix):
+        entries = self.get_entries(builder).filter(self.get_filter_q(
+            builder.get_facet_values_filter(field, prefix)))
+        return self.get_buckets(
+            entries, builder.get_aggregation_fields()[field])
+
+    def global_search(self, builder):
+        """Hits are ordered by document key, there is no relevance score."""
+        entries = SearchEntry.objects \
+            .filter(document_type__in=builder.document_types) \
+            .filter(is_latest_revision=True) \
+            .filter(get_search_q(builder.search_terms))
+        counts = entries \
+            .values_list('document_type') \
+            .annotate(total=Count('id')) \
+            .order_by('-total', 'document_type')
+
+        categories = []
+        for document_type, total in counts:
+            hits = entries \
+                .filter(document_type=document_type) \
+                .order_by('document_key')[:builder.size]
+            categories.append({
+                'document_type': document_type,
+                'total': total,
+                'hits': [self.get_source(entry, GLOBAL_HIT_FIELDS)
+                         for entry in hits],
+            })
+        return {
+            'total': sum(category['total'] for category in categories),
+            'categories': categories,
+        }
+
+    def count(self, builder, only_latest_revisions=True):
+        return self.get_entries(builder, only_latest_revisions).count()
+
+    def scan(self, builder, fields, only_latest_revisions=True,
+             ordered=False):
+        entries = self.get_entries(builder, only_latest_revisions)
+        if ordered:
+            entries = self.sort_entries(entries, builder)
+        for entry in entries.only('source').iterator():
+            source = json.loads(entry.source)
+            yield dict((field, source.get(field)) for field in fields)
+
+    def scan_sources(self, builder, fields, only_latest_revisions=True,
+                     ordered=False):
+        return self.scan(builder, fields, only_latest_revisions, ordered)
+
+    def get_indexed_fields(self, category):
+        """The whole revision json is stored, there is no live mapping."""
+        Model = category.document_class()
+        return set(get_mapping(Model)['properties'].keys())
+
+    def get_entries(self, builder, only_latest_revisions=True):
+        """Returns the entries matching the builder filters."""
+        entries = SearchEntry.objects.filter(
+            document_type=builder.category.document_type())
+        if only_latest_revisions:
+            entries = entries.filter(is_latest_revision=True)
+
+        for f in builder.get_filters():
+            entries = entries.filter(self.get_filter_q(f))
+
+        search_terms = builder.filters.get('search_terms', None)
+        if search_terms:
+            entries = entries.filter(get_search_q(search_terms))
+
+        return entries
+
+    def get_filter_q(self, f):
+        """Convert an elasticsearch filter to a `Q` object on entries.
+
+        Supports the `term`, `terms`, `prefix`, `range`, `missing`, `exists`,
+        `and`, `or`, `not` and `bool` filters.
+
+        """
+        if hasattr(f, 'to_dict'):
+            f = f.to_dict()
+        (filter_type, params), = f.items()
+
+        if filter_type == 'term':
+            (field, value), = params.items()
+            return self.get_values_q(field, **get_value_lookup(value))
+
+        if filter_type == 'terms':
+            (field, terms), = params.items()
+            return reduce(lambda a, b: a | b, [
+                self.get_values_q(field, **get_value_lookup(term))
+                for term in terms], Q(pk__in=[]))
+
+        if filter_type == 'prefix':
+            (field, prefix), = params.items()
+            return self.get_values_q(field, value__startswith=prefix)
+
+        if filter_type == 'range':
+            (field, bounds), = params.items()
+            lookups = {}
+            for operator, value in bounds.items():
+                lookups.update(get_value_lookup(value, operator))
+            return self.get_values_q(field, **lookups)
+
+        if filter_type == 'missing':
+            return ~self.get_values_q(params['field'])
+
+        if filter_type == 'exists':
+            return self.get_values_q(params['field'])
+
+        if filter_type in ('and', 'or'):
+            filters = params['filters'] if isinstance(params, dict) else params
+            qs = [self.get_filter_q(sub_filter) for sub_filter in filters]
+            if filter_type == 'and':
+                return reduce(lambda a, b: a & b, qs, Q())
+            return reduce(lambda a, b: a | b, qs, Q(pk__in=[]))
+
+        if filter_type == 'not':
+            return ~self.get_filter_q(params.get('filter', params))
+
+        if filter_type == 'bool':
+            q = Q()
+            for sub_filter in params.get('must', []):
+                q &= self.get_filter_q(sub_filter)
+            for sub_filter in params.get('must_not', []):
+                q &= ~self.get_filter_q(sub_filter)
+            should = [self.get_filter_q(sub_filter)
+                      for sub_filter in params.get('should', [])]
+            if should:
+                q &= reduce(lambda a, b: a | b, should)
+            return q
+
+        raise ValueError('Unsupported search filter {}'.format(filter_type))
+
+    def get_values_q(self, field, **lookups):
+        """Entries having a value for `field` matching the lookups."""
+        values = SearchValue.objects \
+            .filter(field=get_field_name(field), **lookups) \
+            .values('entry_id')
+        return Q(pk__in=values)
+
+    def sort_entries(self, entries, builder):
+        """Sort entries like elasticsearch does.
+
+        Missing values are sorted last, and entries with the same value are
+        sorted by document key.
+
+        """
+        sort_field, sort_direction = builder.get_sort()
+        field = get_field_name(sort_field)
+        prefix = '-' if sort_direction == 'desc' else ''
+
+        subquery = 'SELECT {column} FROM {values} ' \
+                   'WHERE {values}.entry_id = {entries}.id ' \
+                   'AND {values}.field = %s'
+        tables = {
+            'values': SearchValue._meta.db_table,
+            'entries': SearchEntry._meta.db_table,
+        }
+        select = OrderedDict((
+            ('sort_exists', subquery.format(column='COUNT(*)', **tables)),
+            ('sort_number', subquery.format(column='number', **tables)),
+            ('sort_value', subquery.format(column='value', **tables)),
+        ))
+        return entries.extra(
+            select=select,
+            select_params=[field] * len(select),
+            order_by=[
+                '-sort_exists',
+                '{}sort_number'.format(prefix),
+                '{}sort_value'.format(prefix),
+                'document_key'])
+
+    def get_cursor(self, page, size):
+        """Returns the cursor after the last sorted entry of the page.
+
+        If there is no more results, returns None.
+
+        """
+        if len(page) < size:
+            return None
+        last = page[-1]
+        value = None
+        if last.sort_exists:
+            value = last.sort_value if last.sort_number is None \
+                else get_bucket_key(None, last.sort_number)
+        return encode_cursor([value, last.document_key])
+
+    def get_source(self, entry, fields=None):
+        source = json.loads(entry.source)
+        if fields:
+            source = dict((field, source[field]) for field in fields
+                          if field in source)
+        return source
+
+    def get_aggregations(self, builder, entries):
+        aggregations = {}
+        for name, field in builder.get_aggregation_fields().items():
+            aggregations[name] = self.get_buckets(entries, field)
+        for field in builder.date_filter_fields:
+            aggregations[field] = self.get_month_buckets(entries, field)
+        return aggregations
+
+    def get_buckets(self, entries, field):
+        """Returns the `settings.SEARCH_FACET_SIZE` most frequent values."""
+        buckets = SearchValue.objects \
+            .filter(entry__in=entries, field=get_field_name(field)) \
+            .values_list('value', 'number') \
+            .annotate(doc_count=Count('id')) \
+            .order_by('-doc_count', 'number', 'value')
+        return dict(
+            (get_bucket_key(value, number), doc_count)
+            for value, number, doc_count
+            in buckets[:settings.SEARCH_FACET_SIZE])
+
+    def get_month_buckets(self, entries, field):
+        """Monthly histogram of a date field, e.g `{'2015-10-01': 3}`.
+
+        Dates are indexed as ISO strings, so the month is a prefix.
+
+        """
+        buckets = SearchValue.objects \
+            .filter(entry__in=entries, field=field) \
+            .annotate(month=Substr('value', 1, 7)) \
+            .values_list('month') \
+            .annotate(doc_count=Count('id'))
+        return dict(
+            ('{}-01'.format(month), doc_count)
+            for month, doc_count in buckets)
+
+    def bulk(self, actions):
+        nb_written = 0
+        errors = []
+        searchable_fields = {}
+        with transaction.atomic():
+            for action in actions:
+                op_type = action.get('_op_type', 'index')
+                document_type = action['_type']
+                index_id = action['_id']
+                entries = SearchEntry.objects.filter(
+                    document_type=document_type,
+                    index_id=index_id)
+
+                if op_type == 'delete':
+                    entries.delete()
+                    nb_written += 1
+                    continue
+
+                if op_type == 'update':
+                    entry = entries.first()
+                    if entry is None:
+                        errors.append({'update': {
+                            '_id': index_id, 'status': 404}})
+                        continue
+                    source = json.loads(entry.source)
+                    source.update(action['doc'])
+                else:
+                    source = action['_source']
+
+                if document_type not in searchable_fields:
+                    searchable_fields[document_type] = \
+                        self.get_searchable_fields(document_type)
+                self.write_entry(
+                    document_type, index_id, source,
+                    searchable_fields[document_type])
+                nb_written += 1
+
+        return nb_written, errors
+
+    def get_searchable_fields(self, document_type):
+        organisation_slug, category_slug = document_type.split('.', 1)
+        category = Category.objects \
+            .select_related('category_template__metadata_model') \
+            .get(organisation__slug=organisation_slug,
+                 category_template__slug=category_slug)
+        return category.document_class().PhaseConfig.searchable_fields
+
+    def write_entry(self, document_type, index_id, source, searchable_fields):
+        """Create or replace the entry and its values."""
+        # Make sure values are stored like elasticsearch would (e.g dates)
+        source = serializer.loads(serializer.dumps(source))
+        search_text = '\n'.join(
+            normalize(unicode(source[field])) for field in searchable_fields
+            if source.get(field) is not None)
+
+        entry, created = SearchEntry.objects.update_or_create(
+            document_type=document_type,
+            index_id=index_id,
+            defaults={
+                'document_key': source.get('document_key') or '',
+                'is_latest_revision': bool(source.get('is_latest_revision')),
+                'search_text': search_text,
+                'source': serializer.dumps(source),
+            })
+
+        if not created:
+            entry.values.all().delete()
+        SearchValue.objects.bulk_create([
+            SearchValue(entry=entry, field=field, value=value, number=number)
+            for field, value, number in get_indexed_values(source)])
+
+    def run_operations(self, operations):
+        """Process queued operations.
+
+        Contrary to elasticsearch, writes are cheap, so all the revisions of
+        modified documents are entirely reindexed.
+
+        """
+        stats = Counter(documents=len(operations))
+        document_types = set()
+        actions = []
+
+        for operation in operations:
+            if operation.operation == IndexOperation.OPERATIONS.unindex:
+                document_types.add(operation.document_type)
+                actions += [
+                    {
+                        '_op_type': 'delete',
+                        '_type': operation.document_type,
+                        '_id': es_id,
+                    }
+                    for es_id in operation.es_ids.split(',') if es_id
+                ]
+        stats['deleted'] = len(actions)
+
+        document_ids = [
+            operation.document_id for operation in operations
+            if operation.operation == IndexOperation.OPERATIONS.index]
+        documents = Document.objects \
+            .filter(id__in=document_ids) \
+            .filter(is_indexable=True) \
+            .select_related(
+                'category__organisation',
+                'category__category_template__metadata_model')
+        documents_by_category = defaultdict(list)
+        for document in documents:
+            documents_by_category[document.category].append(document.pk)
+
+        for category, document_ids in documents_by_category.items():
+            revisions = category.revision_class().objects \
+                .filter(document_id__in=document_ids) \
+                .order_by('pk')
+            index_actions = list(iter_index_data(category, revisions))
+            stats['indexed'] += len(index_actions)
+            actions += index_actions
+            document_types.add(category.document_type())
+
+        self.bulk(actions)
+        return stats, document_types
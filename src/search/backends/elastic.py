@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import logging
+
+from elasticsearch.exceptions import ElasticsearchException
+
+from search import elastic
+from search.backends.base import BaseBackend
+from search.utils import get_index_alias
+
+
+logger = logging.getLogger(__name__)
+
+
+class ElasticBackend(BaseBackend):
+    """Search documents in elasticsearch.
+
+    The index itself is maintained by `search.utils` and `search.tasks`.
+
+    """
+
+    uses_elasticsearch = True
+
+    def search(self, builder, source_fields=None, with_aggregations=False):
+        query = builder.build_query(source_fields=source_fields)
+        if with_aggregations:
+            query = builder.add_aggregations(query)
+        response = query.execute()
+
+        # The cursor filter also restricts the number of hits
+        total = response.hits.total
+        if builder.search_after is not None:
+            total = self.count(builder)
+
+        results = {
+            'total': total,
+            'data': [hit._d_ for hit in response.hits],
+            'cursor': builder.get_cursor(response),
+            'aggregations': None,
+        }
+        if with_aggregations:
+            results['aggregations'] = self.format_aggregations(
+                response.aggregations)
+        return results
+
+    def facets(self, builder):
+        response = builder.build_facets_query().execute()
+        return self.format_aggregations(response.aggregations)
+
+    def facet_values(self, builder, field, prefix):
+        response = builder.build_facet_values_query(field, prefix).execute()
+        return self.format_aggregations(response.aggregations)[field]
+
+    def global_search(self, builder):
+        response = builder.build_query().execute()
+        buckets = response.aggregations.to_dict()['categories']['buckets']
+        categories = [
+            {
+                'document_type': bucket['key'],
+                'total': bucket['doc_count'],
+                'hits': [hit['_source']
+                         for hit in bucket['top_hits']['hits']['hits']],
+            }
+            for bucket in buckets]
+        return {'total': response.hits.total, 'categories': categories}
+
+    def count(self, builder, only_latest_revisions=True):
+        return builder.build_query(
+            only_latest_revisions=only_latest_revisions,
+            paginate=False).count()
+
+    def scan(self, builder, fields, only_latest_revisions=True,
+             ordered=False):
+        hits = builder.scan_results(
+            fields,
+            only_latest_revisions=only_latest_revisions,
+            ordered=ordered)
+        for hit in hits:
+            yield dict((field, hit[field][0]) for field in fields)
+
+    def scan_sources(self, builder, fields, only_latest_revisions=True,
+                     ordered=False):
+        hits = builder.scan_results(
+            only_latest_revisions=only_latest_revisions,
+            source_fields=fields,
+            ordered=ordered)
+        for hit in hits:
+            source = hit.to_dict()
+            yield dict((field, source.get(field)) for field in fields)
+
+    def get_indexed_fields(self, category):
+        """Read the live mapping of the category.
+
+        Returns an empty set if the mapping cannot be read.
+
+        """
+        document_type = category.document_type()
+        try:
+            response = elastic.indices.get_mapping(
+                index=get_index_alias(document_type),
+                doc_type=document_type)
+        except ElasticsearchException:
+            logger.exception('Cannot read the mapping of {}'.format(
+                document_type))
+            return set()
+
+        fields = set()
+        for index_mapping in response.values():
+            mapping = index_mapping['mappings'].get(document_type, {})
+            fields.update(mapping.get('properties', {}).keys())
+        return fields
+
+    def format_aggregations(self, aggregations):
+        """Transfroms the ES "aggregations" response into something we can use.
+
+        aggregations = {
+            'filter_name': {
+                'buckets': [
+                    {'key': 'some_name', 'doc_count': 123},
+                    …
+                ]
+            },
+            …
+        }
+
+        We want :
+
+        aggregations = {
+            'filter_name': [{'some_name': 123}, …],
+            …
+        }
+
+        Date histogram buckets are identified by their formatted date.
+
+        """
+        def flatten(bucket):
+            key = bucket[0]
+            buckets = bucket[1]['buckets']
+            bucket_values = dict([(b.get('key_as_string', b['key']), b['doc_count'])
+                                  for b in buckets])
+            return (key, bucket_values)
+        buckets = aggregations.to_dict().items()
+        response = dict(map(flatten, buckets))
+        return response
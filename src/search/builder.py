@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import json
+import base64
+from collections import OrderedDict
+
 from django.conf import settings
 from django.forms import ModelChoiceField
 from django.db import models
@@ -9,6 +13,46 @@ from elasticsearch_dsl import Search
 
 from documents.forms.filters import filterform_factory
 from search import elastic
+from search.utils import get_index_alias, get_type_indexes
+
+
+# Filters that only change the pagination or the order of results
+PAGINATION_FILTERS = ('start', 'size', 'sort_by', 'cursor')
+
+# Results with the same sort value are ordered by this unique field
+TIEBREAKER_FIELD = 'document_key.raw'
+
+# Indexed fields used by the document list, in addition to the columns
+LIST_FIELDS = (
+    'url', 'document_key', 'document_number', 'document_pk', 'metadata_pk',
+    'pk', 'revision')
+
+# Date range filter fields suffixes, and the matching range operators
+DATE_RANGE_OPERATORS = (('from', 'gte'), ('to', 'lte'))
+
+# Date filter fields are aggregated by month
+DATE_HISTOGRAM_INTERVAL = 'month'
+DATE_HISTOGRAM_FORMAT = 'yyyy-MM-dd'
+
+# Indexed fields returned for every hit of the global search
+GLOBAL_HIT_FIELDS = ('url', 'document_key', 'document_number', 'title')
+
+
+def encode_cursor(sort_values):
+    """Build an opaque pagination cursor from the last hit's sort values."""
+    return base64.urlsafe_b64encode(json.dumps(sort_values))
+
+
+def decode_cursor(cursor):
+    """Returns the sort values stored in the cursor."""
+    try:
+        sort_values = json.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError):
+        raise RuntimeError('Search cursor is invalid')
+
+    if not isinstance(sort_values, list) or len(sort_values) != 2:
+        raise RuntimeError('Search cursor is invalid')
+    return sort_values
 
 
 class SearchBuilder(object):
@@ -29,8 +73,10 @@ class SearchBuilder(object):
         DocumentModel = self.category.document_class()
         Config = DocumentModel.PhaseConfig
         self.filter_fields = Config.filter_fields
+        self.date_filter_fields = getattr(Config, 'date_filter_fields', ())
         self.custom_filters = getattr(Config, 'custom_filters', {})
         self.searchable_fields = Config.searchable_fields
+        self.column_fields = dict(Config.column_fields).values()
 
     def init_filters(self, filters):
         DocumentModel = self.category.document_class()
@@ -42,36 +88,114 @@ class SearchBuilder(object):
         self.filter_form = form
         self.filters = form.cleaned_data
 
+        # The pagination cursor is not a form field, since it's not meant
+        # to be set by the user
+        cursor = filters.get('cursor')
+        self.filters['cursor'] = cursor or None
+        self.search_after = decode_cursor(cursor) if cursor else None
+
+    @property
+    def facet_filters(self):
+        """Filters that have an effect on the facets counts."""
+        return dict((key, value) for key, value in self.filters.items()
+                    if key not in PAGINATION_FILTERS)
+
     def get_results(self, *args, **kwargs):
         return self.build_query(*args, **kwargs).execute()
 
     def scan_results(self, *args, **kwargs):
-        return self.build_query(*args, **kwargs).scan()
+        """Iterate over every hit of the query.
+
+        With `ordered`, hits are scrolled in the sort order, instead of the
+        faster unsorted scan.
+
+        """
+        ordered = kwargs.pop('ordered', False)
+        s = self.build_query(*args, **kwargs)
+        if ordered:
+            s = s.params(preserve_order=True)
+        return s.scan()
+
+    @property
+    def list_fields(self):
+        """Fields required to display the document list."""
+        return sorted(set(self.column_fields) | set(LIST_FIELDS))
+
+    def build_query(self, fields=None, only_latest_revisions=True,
+                    source_fields=None, paginate=True):
+        """Build the search query.
 
-    def build_query(self, fields=None, only_latest_revisions=True):
+        `fields` are stored fields to return instead of the document source.
+        `source_fields` restricts the document source to the given fields.
+
+        Without `paginate`, the pagination cursor is ignored, so the query
+        matches the whole list (e.g to count hits).
+
+        """
         if fields is None:
             fields = []
         document_type = self.category.document_type()
 
         s = Search(using=elastic, doc_type=document_type) \
-            .index(settings.ELASTIC_INDEX)
+            .index(get_index_alias(document_type))
 
         if only_latest_revisions:
             s = s.filter('term', is_latest_revision=True)
 
-        s = self._add_filter_fields(s)
-        s = self._add_custom_filters(s)
+        s = self._add_filters(s)
         s = self._add_search_query(s)
         s = self._add_sort(s)
-        s = self._add_pagination(s)
+        if paginate:
+            s = self._add_pagination(s)
 
         if fields:
             s = self._limit_fields(s, fields)
+        if source_fields:
+            s = self._limit_source(s, source_fields)
         # result = s
         # import pdb;pdb.set_trace()
         return s
 
-    def _add_filter_fields(self, s):
+    def build_facets_query(self):
+        """Build a query that only returns aggregations, without hits."""
+        s = self.build_query(paginate=False)
+        s = s.extra(from_=0, size=0)
+        s = self.add_aggregations(s)
+        return s
+
+    def build_facet_values_query(self, field, prefix):
+        """Build a query returning the values of a single facet.
+
+        Only values starting with `prefix` are aggregated, so values that
+        are not in the top facet buckets can still be found.
+
+        """
+        s = self.build_query(paginate=False)
+        s = s.extra(from_=0, size=0)
+        s = s.filter(self.get_facet_values_filter(field, prefix))
+        s.aggs.bucket(
+            field, 'terms',
+            field=self.get_aggregation_fields()[field],
+            size=settings.SEARCH_FACET_SIZE)
+        return s
+
+    def get_facet_values_filter(self, field, prefix):
+        """Filter the documents whose facet value starts with `prefix`.
+
+        Foreign keys are aggregated on their ids, but are searched by name.
+
+        """
+        if field not in self.filter_fields:
+            raise ValueError('Unknown facet {}'.format(field))
+        return {'prefix': {'%s.raw' % field: prefix}}
+
+    def get_filters(self):
+        """Returns the filters matching the selected filter values.
+
+        Filters are ES filter dicts (or `F` objects for custom filters).
+
+        """
+        filters = []
         for field in self.filter_fields:
             value = self.filters.get(field, None)
             if value:
@@ -80,31 +204,66 @@ class SearchBuilder(object):
                     field = '%s_id' % field
                 else:
                     field = '%s.raw' % field
-                s = s.filter({'term': {field: value}})
+                filters.append({'term': {field: value}})
 
-        return s
+        for field in self.date_filter_fields:
+            bounds = {}
+            for suffix, operator in DATE_RANGE_OPERATORS:
+                value = self.filters.get('%s_%s' % (field, suffix), None)
+                if value:
+                    bounds[operator] = value.isoformat()
+            if bounds:
+                filters.append({'range': {field: bounds}})
 
-    def _add_custom_filters(self, s):
         for filter_key, filter_data in self.custom_filters.items():
             value = self.filters.get(filter_key, None)
             f = filter_data['filters'].get(value, None)
             if f is not None:
-                s = s.filter(f)
+                filters.append(f)
+
+        return filters
+
+    def _add_filters(self, s):
+        for f in self.get_filters():
+            s = s.filter(f)
 
         return s
 
-    def add_aggregations(self, s):
-        """Add aggregations (facets) to the search query.
+    def get_aggregation_fields(self):
+        """Returns the indexed field to aggregate on, for each filter field.
 
         For foreign key fields, we need to organize buckets by primary keys
         For every other field, the ".raw" field is what we want
 
         """
+        fields = OrderedDict()
         for field in self.filter_fields:
             if isinstance(self.filter_form.fields[field], ModelChoiceField):
-                s.aggs.bucket(field, 'terms', field='%s_id' % field, size=0)
+                fields[field] = '%s_id' % field
             else:
-                s.aggs.bucket(field, 'terms', field='%s.raw' % field, size=0)
+                fields[field] = '%s.raw' % field
+        return fields
+
+    def add_aggregations(self, s):
+        """Add aggregations (facets) to the search query.
+
+        Only the `settings.SEARCH_FACET_SIZE` most frequent values of each
+        facet are returned. Other values are found with
+        `build_facet_values_query`.
+
+        Date filter fields are aggregated in a monthly histogram.
+
+        """
+        for name, field in self.get_aggregation_fields().items():
+            s.aggs.bucket(
+                name, 'terms', field=field, size=settings.SEARCH_FACET_SIZE)
+
+        for field in self.date_filter_fields:
+            s.aggs.bucket(
+                field, 'date_histogram',
+                field=field,
+                interval=DATE_HISTOGRAM_INTERVAL,
+                format=DATE_HISTOGRAM_FORMAT)
 
         return s
 
@@ -123,7 +282,8 @@ class SearchBuilder(object):
 
         return s
 
-    def _add_sort(self, s):
+    def get_sort(self):
+        """Returns the sort field and direction."""
         sort_field = self.filters.get('sort_by', 'document_key') or 'document_key'
         sort_field = '%s.raw' % sort_field
         if sort_field.startswith('-'):
@@ -131,19 +291,128 @@ class SearchBuilder(object):
             sort_direction = 'desc'
         else:
             sort_direction = 'asc'
-        s = s.sort({sort_field: {
-            'order': sort_direction,
-            'unmapped_type': "String"}})
+        return sort_field, sort_direction
+
+    def get_size(self):
+        return self.filters.get('size') or settings.PAGINATE_BY
+
+    def _add_sort(self, s):
+        sort_field, sort_direction = self.get_sort()
+        s = s.sort(
+            {sort_field: {
+                'order': sort_direction,
+                'unmapped_type': "String"}},
+            {TIEBREAKER_FIELD: {'order': 'asc'}})
         return s
 
     def _add_pagination(self, s):
-        s = s.extra(
-            from_=self.filters.get('start', 0),
-            size=self.filters.get('size', settings.PAGINATE_BY)
-        )
+        if self.search_after is not None:
+            s = s.filter(self.get_cursor_filter())
+            s = s.extra(from_=0, size=self.get_size())
+        else:
+            s = s.extra(
+                from_=self.filters.get('start', 0),
+                size=self.get_size()
+            )
         return s
 
+    def get_cursor_filter(self):
+        """Filter the results that come after the cursor.
+
+        Since `search_after` is not available in our version of ES, we
+        emulate it with range filters on the sort field and the tiebreaker.
+        Documents without any value for the sort field are sorted last.
+
+        """
+        sort_field, sort_direction = self.get_sort()
+        value, key = self.search_after
+        after_key = {'range': {TIEBREAKER_FIELD: {'gt': key}}}
+        missing = {'missing': {'field': sort_field}}
+
+        if value is None:
+            f = {'and': {'filters': [missing, after_key]}}
+        else:
+            operator = 'gt' if sort_direction == 'asc' else 'lt'
+            f = {'or': {'filters': [
+                {'range': {sort_field: {operator: value}}},
+                {'and': {'filters': [
+                    {'term': {sort_field: value}},
+                    after_key,
+                ]}},
+                missing,
+            ]}}
+        return f
+
+    def get_cursor(self, response):
+        """Returns the cursor to fetch the next page of results.
+
+        If there is no more results, returns None.
+
+        """
+        hits = response.hits
+        if len(hits) < self.get_size():
+            return None
+        return encode_cursor(hits[-1].meta.sort)
+
     def _limit_fields(self, s, fields):
         """Set the list of returned fields."""
         s = s.fields(fields)
         return s
+
+    def _limit_source(self, s, fields):
+        """Only return the given fields of the document source."""
+        s = s.extra(_source={'include': list(fields)})
+        return s
+
+
+class GlobalSearchBuilder(object):
+    """Build a full text search on several categories at once.
+
+    A single query is sent for all categories, and hits are grouped by
+    document type. Only the `size` most relevant hits of each category are
+    returned, along with the total number of hits per category.
+
+    """
+
+    def __init__(self, categories, search_terms, size=None):
+        self.categories = list(categories)
+        self.search_terms = search_terms
+        self.size = size or settings.GLOBAL_SEARCH_HITS
+
+    @property
+    def document_types(self):
+        return [category.document_type() for category in self.categories]
+
+    def get_searchable_fields(self):
+        """All the searchable fields of the categories."""
+        fields = set()
+        for category in self.categories:
+            Config = category.document_class().PhaseConfig
+            fields.update(Config.searchable_fields)
+        return sorted(fields)
+
+    def build_query(self):
+        document_types = self.document_types
+        s = Search(using=elastic, doc_type=document_types) \
+            .index(get_type_indexes(document_types))
+
+        s = s.filter('term', is_latest_revision=True)
+        raw_search_fields = map(
+            lambda x: '%s.raw' % x, self.get_searchable_fields())
+        s = s.query({
+            'multi_match': {
+                'query': self.search_terms,
+                'fields': ['_all'] + raw_search_fields,
+                'operator': 'and'
+            }
+        })
+        s = s.extra(from_=0, size=0)
+
+        s.aggs \
+            .bucket(
+                'categories', 'terms',
+                field='_type', size=len(document_types)) \
+            .metric(
+                'top_hits', 'top_hits',
+                size=self.size, _source=list(GLOBAL_HIT_FIELDS))
+        return s
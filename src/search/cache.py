@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+
+"""Search results cache.
+
+Many users browse the same document lists at the same time, so search results
+are cached. Cache keys contain a generation number, that is bumped every time
+a category's documents are indexed, so stale results are never served.
+
+When many identical requests miss the cache at the same time, only one of
+them actually queries elasticsearch. The others wait for the result to be
+available in the cache.
+
+"""
+
+from __future__ import unicode_literals
+
+import json
+import time
+import hashlib
+import logging
+
+from django.core.cache import cache
+from django.conf import settings
+from django.db import models
+
+
+logger = logging.getLogger(__name__)
+
+
+# Time (in seconds) during which a process is allowed to compute results
+# before another one takes over
+LOCK_TIMEOUT = 10
+
+# Time (in seconds) spent waiting for another process to compute results
+WAIT_TIMEOUT = 3
+WAIT_INTERVAL = 0.05
+
+
+def get_generation_key(document_type):
+    return 'search_generation_{}'.format(document_type)
+
+
+def get_generation(document_type):
+    """Return the current index generation for the given document type.
+
+    If the counter was evicted from the cache, it is reset to the current
+    timestamp, so it is always greater than the previous value.
+
+    """
+    key = get_generation_key(document_type)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, int(time.time() * 1000), None)
+        generation = cache.get(key)
+    return generation
+
+
+def bump_generation(document_type):
+    """Invalidate all cached results for the given document type."""
+    key = get_generation_key(document_type)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, int(time.time() * 1000), None)
+
+
+def incr_counter(name):
+    key = 'search_cache_{}'.format(name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, None)
+
+
+def get_stats():
+    """Returns the cache counters.
+
+    `coalesced` is the number of misses that were served by waiting for a
+    concurrent identical request.
+
+    """
+    return {
+        'hits': cache.get('search_cache_hits', 0),
+        'misses': cache.get('search_cache_misses', 0),
+        'coalesced': cache.get('search_cache_coalesced', 0),
+    }
+
+
+def get_timeout(document_type):
+    """Get the cache timeout for the given document type.
+
+    The default `SEARCH_CACHE_TIMEOUT` can be overriden by category in the
+    `SEARCH_CACHE_TIMEOUTS` setting, e.g {'organisation.category': 600}. A
+    timeout of 0 disables the cache.
+
+    """
+    timeouts = getattr(settings, 'SEARCH_CACHE_TIMEOUTS', {})
+    return timeouts.get(document_type, settings.SEARCH_CACHE_TIMEOUT)
+
+
+def normalize_filters(filters):
+    """Returns a stable representation of the (cleaned) filters dict."""
+    def normalize(value):
+        if isinstance(value, models.Model):
+            return value.pk
+        return value
+
+    filters = dict((key, normalize(value)) for key, value in filters.items()
+                   if value not in (None, ''))
+    return json.dumps(filters, sort_keys=True, default=unicode)
+
+
+class SearchCache(object):
+    """Cache search results for a category.
+
+    Document lists and facets are cached separately, using different key
+    prefixes.
+
+    """
+
+    def __init__(self, category):
+        self.document_type = category.document_type()
+        self.timeout = get_timeout(self.document_type)
+
+    def get_key(self, filters, prefix='results'):
+        digest = hashlib.md5(normalize_filters(filters)).hexdigest()
+        return 'search_{}_{}_{}_{}'.format(
+            prefix,
+            self.document_type,
+            get_generation(self.document_type),
+            digest)
+
+    def get(self, filters, prefix='results'):
+        """Returns the cached value, or None."""
+        if not self.timeout:
+            return None
+        return cache.get(self.get_key(filters, prefix))
+
+    def set(self, filters, value, prefix='results'):
+        if self.timeout:
+            cache.set(self.get_key(filters, prefix), value, self.timeout)
+
+    def get_or_execute(self, filters, execute, prefix='results'):
+        """Returns the cached results, or call `execute` to compute them.
+
+        Also returns a boolean telling if the cache was hit.
+
+        """
+        if not self.timeout:
+            return execute(), False
+
+        key = self.get_key(filters, prefix)
+        results = cache.get(key)
+        if results is not None:
+            incr_counter('hits')
+            return results, True
+
+        incr_counter('misses')
+        lock_key = '{}_lock'.format(key)
+        locked = cache.add(lock_key, 1, LOCK_TIMEOUT)
+        if not locked:
+            results = self.wait_for(key)
+            if results is not None:
+                incr_counter('coalesced')
+                return results, True
+
+            logger.warning('Timeout waiting for search results {}'.format(key))
+
+        try:
+            results = execute()
+            cache.set(key, results, self.timeout)
+        finally:
+            if locked:
+                cache.delete(lock_key)
+
+        return results, False
+
+    def wait_for(self, key):
+        """Wait for another process to put results in the cache."""
+        waited = 0
+        while waited < WAIT_TIMEOUT:
+            time.sleep(WAIT_INTERVAL)
+            waited += WAIT_INTERVAL
+            results = cache.get(key)
+            if results is not None:
+                return results
+        return None
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+
+"""Check that the search index is consistent with the database.
+
+Revisions are grouped in buckets of consecutive primary keys. For each
+bucket, a checksum (number of revisions, sum of primary keys, sum of update
+timestamps and number of latest revisions) is computed on both sides, with a
+single aggregation query on the database and on the index, so revisions are
+only fetched for diverging buckets.
+
+Indexes built before `updated_on` was part of the indexed data must be
+rebuilt with `reindex_all` first, otherwise every bucket is diverging.
+
+"""
+
+from __future__ import unicode_literals
+
+import logging
+from collections import namedtuple
+from datetime import datetime
+
+from django.db.models import (
+    BigIntegerField, Case, Count, ExpressionWrapper, F, Func, IntegerField,
+    Sum, Value, When)
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from elasticsearch.helpers import scan
+
+from search import elastic
+from search.utils import (
+    get_categories, get_indexable_revisions, iter_index_data, bulk_actions,
+    get_index_alias)
+
+
+logger = logging.getLogger(__name__)
+
+
+# Number of consecutive primary keys in a bucket. Keep it low enough so
+# timestamps sums don't exceed the float precision of ES aggregations.
+BUCKET_SIZE = 1000
+
+EPOCH = datetime(1970, 1, 1)
+
+
+Checksum = namedtuple(
+    'Checksum', ['count', 'pk_sum', 'updated_sum', 'latest'])
+
+
+def to_timestamp(value):
+    """Convert a datetime to milliseconds since epoch, as stored in ES."""
+    if value is None:
+        return 0
+    if timezone.is_aware(value):
+        value = timezone.make_naive(value, timezone.utc)
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000 + \
+        delta.microseconds // 1000
+
+
+class EpochMilliseconds(Func):
+    """Convert a datetime column to milliseconds since epoch, in SQL.
+
+    Sub-millisecond precision is truncated, like in `to_timestamp`.
+
+    """
+
+    def __init__(self, expression, **extra):
+        super(EpochMilliseconds, self).__init__(
+            expression, output_field=BigIntegerField(), **extra)
+
+    def as_sqlite(self, compiler, connection):
+        # Datetimes are stored as 'YYYY-MM-DD HH:MM:SS[.ffffff]' UTC strings
+        self.template = (
+            'CAST(ROUND((julianday(substr(%(expressions)s, 1, 19)) '
+            '- 2440587.5) * 86400) AS INTEGER) * 1000 '
+            '+ CAST(substr(%(expressions)s, 21, 3) AS INTEGER)')
+        return self.as_sql(compiler, connection)
+
+    def as_postgresql(self, compiler, connection):
+        self.template = (
+            "(EXTRACT(EPOCH FROM date_trunc('milliseconds', "
+            "%(expressions)s)) * 1000)::bigint")
+        return self.as_sql(compiler, connection)
+
+
+class ConsistencyReport(object):
+    """Differences between the database and the index for a category."""
+
+    def __init__(self, category):
+        self.category = category
+        self.nb_buckets = 0
+        self.diverging_buckets = []
+
+        # Revisions to reindex, by revision id
+        self.to_index = []
+
+        # Indexed revisions that must be deleted, by index id
+        self.to_delete = []
+
+    def is_consistent(self):
+        return not (self.to_index or self.to_delete)
+
+    def __unicode__(self):
+        return '{}: {}/{} diverging buckets, {} revisions to index, ' \
+            '{} to delete'.format(
+                self.category,
+                len(self.diverging_buckets),
+                self.nb_buckets,
+                len(self.to_index),
+                len(self.to_delete))
+
+
+class ConsistencyChecker(object):
+    """Compare the indexed revisions of a category with the database."""
+
+    def __init__(self, category, bucket_size=BUCKET_SIZE, index=None):
+        self.category = category
+        self.doc_type = category.document_type()
+        self.index = index or get_index_alias(self.doc_type)
+        self.bucket_size = bucket_size
+
+    def get_bucket(self, pk):
+        return pk // self.bucket_size * self.bucket_size
+
+    def iter_db_revisions(self, bucket=None):
+        """Yields the indexable revisions, as the index should see them.
+
+        Yields tuples of `(es_id, (pk, updated_on, is_latest_revision))`
+
+        """
+        revisions = get_indexable_revisions(self.category)
+        if bucket is not None:
+            revisions = revisions.filter(
+                pk__gte=bucket,
+                pk__lt=bucket + self.bucket_size)
+
+        revisions = revisions.values_list(
+            'pk', 'revision', 'updated_on', 'document__document_key',
+            'document__current_revision')
+        for pk, revision, updated_on, document_key, current in \
+                revisions.iterator():
+            es_id = '{}_{:02d}'.format(document_key, revision)
+            yield es_id, (pk, to_timestamp(updated_on), revision == current)
+
+    def get_db_checksums(self):
+        buckets = get_indexable_revisions(self.category) \
+            .order_by() \
+            .annotate(bucket=ExpressionWrapper(
+                F('pk') / self.bucket_size,
+                output_field=IntegerField())) \
+            .values('bucket') \
+            .annotate(
+                count=Count('pk'),
+                pk_sum=Sum('pk'),
+                updated_sum=Sum(EpochMilliseconds('updated_on')),
+                latest=Sum(Case(
+                    When(revision=F('document__current_revision'),
+                         then=Value(1)),
+                    default=Value(0),
+                    output_field=IntegerField())))
+
+        checksums = {}
+        for bucket in buckets:
+            checksums[bucket['bucket'] * self.bucket_size] = Checksum(
+                bucket['count'],
+                int(bucket['pk_sum']),
+                int(bucket['updated_sum'] or 0),
+                int(bucket['latest']))
+        return checksums
+
+    def get_es_checksums(self):
+        body = {
+            'size': 0,
+            'aggs': {
+                'buckets': {
+                    'histogram': {
+                        'field': 'pk',
+                        'interval': self.bucket_size,
+                        'min_doc_count': 1,
+                    },
+                    'aggs': {
+                        'pk_sum': {'sum': {'field': 'pk'}},
+                        'updated_sum': {'sum': {'field': 'updated_on'}},
+                        'latest': {
+                            'filter': {'term': {'is_latest_revision': True}},
+                        },
+                    },
+                },
+            },
+        }
+        response = elastic.search(
+            index=self.index,
+            doc_type=self.doc_type,
+            body=body)
+
+        checksums = {}
+        for bucket in response['aggregations']['buckets']['buckets']:
+            checksums[int(bucket['key'])] = Checksum(
+                bucket['doc_count'],
+                int(bucket['pk_sum']['value'] or 0),
+                int(bucket['updated_sum']['value'] or 0),
+                bucket['latest']['doc_count'])
+        return checksums
+
+    def get_es_revisions(self, bucket):
+        """Returns the indexed revisions of the bucket.
+
+        Returns a dict of `{es_id: (pk, updated_on, is_latest_revision)}`
+
+        """
+        hits = scan(
+            elastic,
+            index=self.index,
+            doc_type=self.doc_type,
+            query={
+                'query': {'filtered': {'filter': {'range': {'pk': {
+                    'gte': bucket,
+                    'lt': bucket + self.bucket_size,
+                }}}}},
+                '_source': ['pk', 'updated_on', 'is_latest_revision'],
+            })
+
+        data = {}
+        for hit in hits:
+            source = hit['_source']
+            updated_on = parse_datetime(source.get('updated_on') or '')
+            data[hit['_id']] = (
+                source.get('pk'),
+                to_timestamp(updated_on),
+                source.get('is_latest_revision'))
+        return data
+
+    def check(self):
+        """Returns a report of the inconsistencies."""
+        report = ConsistencyReport(self.category)
+        db_checksums = self.get_db_checksums()
+        es_checksums = self.get_es_checksums()
+
+        buckets = sorted(set(db_checksums.keys()) | set(es_checksums.keys()))
+        report.nb_buckets = len(buckets)
+        for bucket in buckets:
+            if db_checksums.get(bucket) != es_checksums.get(bucket):
+                report.diverging_buckets.append(bucket)
+                self.compare_bucket(bucket, report)
+
+        return report
+
+    def compare_bucket(self, bucket, report):
+        db_revisions = dict(self.iter_db_revisions(bucket))
+        es_revisions = self.get_es_revisions(bucket)
+
+        for es_id, (pk, updated_on, is_latest) in db_revisions.items():
+            if es_revisions.get(es_id) != (pk, updated_on, is_latest):
+                report.to_index.append(pk)
+
+        for es_id in es_revisions:
+            if es_id not in db_revisions:
+                report.to_delete.append(es_id)
+
+    def repair(self, report):
+        """Reindex and delete diverging revisions."""
+        actions = list(iter_index_data(
+            self.category, report.to_index, index=self.index))
+        actions += [
+            {
+                '_op_type': 'delete',
+                '_index': self.index,
+                '_type': self.doc_type,
+                '_id': es_id,
+            }
+            for es_id in report.to_delete
+        ]
+        if actions:
+            bulk_actions(actions)
+
+
+def check_index(categories=None, repair=False, bucket_size=BUCKET_SIZE):
+    """Check the consistency of the given categories (default: all).
+
+    Diverging revisions are fixed if `repair` is set. Returns the list of
+    reports.
+
+    """
+    if categories is None:
+        categories = get_categories()
+
+    reports = []
+    for category in categories:
+        checker = ConsistencyChecker(category, bucket_size)
+        report = checker.check()
+        reports.append(report)
+        if report.is_consistent():
+            continue
+
+        logger.warning('Index inconsistency: {}'.format(unicode(report)))
+        if repair:
+            checker.repair(report)
+    return reports
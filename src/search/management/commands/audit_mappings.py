@@ -0,0 +1,54 @@
+# -*- coding: utf8 -*-
+
+from __future__ import unicode_literals
+
+from elasticsearch.exceptions import ConnectionError
+
+from django.core.management.base import BaseCommand, CommandError
+
+from search import elastic
+from search.utils import (
+    get_categories, get_fielddata_fields, get_index_alias)
+
+
+class Command(BaseCommand):
+    """Report the indexed fields that still rely on fielddata.
+
+    Those fields are not analyzed, but are not stored as doc values. Sorting
+    or aggregating on them loads every value in the heap. Mappings created
+    before doc values were introduced are fixed with `reindex_all`.
+
+    """
+    args = '<organisation_slug/category_slug ...>'
+    help = 'List indexed fields that are not stored as doc values.'
+
+    def handle(self, *args, **options):
+        try:
+            categories = get_categories(args)
+        except ValueError as e:
+            raise CommandError(e)
+
+        nb_fields = 0
+        try:
+            for category in categories:
+                fields = self.audit(category)
+                nb_fields += len(fields)
+        except ConnectionError:
+            raise CommandError('Elasticsearch cannot be found')
+
+        self.stdout.write('{} field(s) rely on fielddata'.format(nb_fields))
+
+    def audit(self, category):
+        doc_type = category.document_type()
+        response = elastic.indices.get_mapping(
+            index=get_index_alias(doc_type),
+            doc_type=doc_type)
+
+        fields = []
+        for index_mapping in response.values():
+            mapping = index_mapping['mappings'].get(doc_type, {})
+            fields += get_fielddata_fields(mapping.get('properties', {}))
+
+        for field in fields:
+            self.stdout.write('{}: {}'.format(doc_type, field))
+        return fields
@@ -0,0 +1,163 @@
+# -*- coding: utf8 -*-
+
+from __future__ import unicode_literals
+
+import time
+import random
+from optparse import make_option
+
+from elasticsearch.helpers import bulk
+from elasticsearch.exceptions import ConnectionError
+
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+
+from search import elastic, ANALYSIS_PROFILES
+from search.utils import (
+    create_versioned_index, end_bulk_load, get_categories,
+    get_indexable_revisions, get_mapping, iter_index_data)
+
+
+class Command(BaseCommand):
+    """Compare the analysis profiles on real data.
+
+    For every profile, the revisions of the given categories are indexed in
+    a temporary index. The index size, the bulk indexing throughput and the
+    full text search latency are then reported. Temporary indexes are
+    deleted afterwards, the live index is never modified.
+
+    Search terms are picked from the indexed searchable values, so every
+    profile is queried with the same terms.
+
+    """
+    args = '<organisation_slug/category_slug ...>'
+    help = 'Benchmark the index analysis profiles.'
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--profile',
+            action='append', dest='profiles', default=[],
+            help='Profile to benchmark (default: all). Can be used several '
+                 'times.'),
+        make_option(
+            '--limit',
+            type='int', dest='limit', default=10000,
+            help='Maximum number of revisions to index per category.'),
+        make_option(
+            '--queries',
+            type='int', dest='queries', default=100,
+            help='Number of search queries to run per category.'),
+    )
+
+    def handle(self, *args, **options):
+        profiles = options['profiles'] or sorted(ANALYSIS_PROFILES.keys())
+        for profile in profiles:
+            if profile not in ANALYSIS_PROFILES:
+                raise CommandError('Unknown analysis profile {}'.format(
+                    profile))
+
+        try:
+            categories = get_categories(args)
+        except ValueError as e:
+            raise CommandError(e)
+
+        revisions = dict(
+            (category, list(get_indexable_revisions(category)
+                            .values_list('pk', flat=True)[:options['limit']]))
+            for category in categories)
+        terms = dict(
+            (category, self.get_search_terms(
+                category, revisions[category], options['queries']))
+            for category in categories)
+
+        try:
+            for profile in profiles:
+                self.benchmark(profile, categories, revisions, terms)
+        except ConnectionError:
+            raise CommandError('Elasticsearch cannot be found')
+
+    def get_search_terms(self, category, revision_ids, nb_terms):
+        """Pick words of searchable values, and cut them at random."""
+        searchable_fields = category.document_class() \
+            .PhaseConfig.searchable_fields
+        words = []
+        for action in iter_index_data(category, revision_ids[:nb_terms]):
+            for field in searchable_fields:
+                value = action['_source'].get(field)
+                if value:
+                    words += [word for word in unicode(value).split()
+                              if len(word) > 2]
+
+        random.seed(0)
+        random.shuffle(words)
+        return [word[:random.randint(3, len(word))]
+                for word in words[:nb_terms]]
+
+    def benchmark(self, profile, categories, revisions, terms):
+        index = create_versioned_index(
+            '{}_benchmark_{}'.format(settings.ELASTIC_INDEX, profile),
+            bulk_load=True,
+            profile=profile)
+        try:
+            for category in categories:
+                elastic.indices.put_mapping(
+                    index=index,
+                    doc_type=category.document_type(),
+                    body=get_mapping(category.document_class(), profile))
+
+            started = time.time()
+            nb_indexed = 0
+            for category in categories:
+                actions = iter_index_data(
+                    category, revisions[category], index=index)
+                nb_written, _ = bulk(
+                    elastic,
+                    actions,
+                    chunk_size=settings.ELASTIC_BULK_SIZE,
+                    request_timeout=600)
+                nb_indexed += nb_written
+            indexing_duration = time.time() - started
+
+            end_bulk_load(index)
+            elastic.indices.optimize(index=index, max_num_segments=1)
+            stats = elastic.indices.stats(index=index, metric='store')
+            size = stats['_all']['primaries']['store']['size_in_bytes']
+
+            durations = []
+            nb_hits = 0
+            for category in categories:
+                for term in terms[category]:
+                    started = time.time()
+                    response = elastic.search(
+                        index=index,
+                        doc_type=category.document_type(),
+                        body={
+                            'size': settings.PAGINATE_BY,
+                            'query': {'multi_match': {
+                                'query': term,
+                                'fields': ['_all'],
+                                'operator': 'and',
+                            }},
+                        })
+                    durations.append(time.time() - started)
+                    nb_hits += response['hits']['total']
+        finally:
+            elastic.indices.delete(index=index, ignore=404)
+
+        durations.sort()
+        self.stdout.write(
+            '{}: {} revisions, {:.1f} MB, indexed in {:.1f}s ({:.0f}/s), '
+            '{} queries, median {:.1f} ms, p95 {:.1f} ms, {} hits'.format(
+                profile,
+                nb_indexed,
+                size / 1024.0 / 1024.0,
+                indexing_duration,
+                nb_indexed / indexing_duration if indexing_duration else 0,
+                len(durations),
+                self.percentile(durations, 50) * 1000,
+                self.percentile(durations, 95) * 1000,
+                nb_hits))
+
+    def percentile(self, values, percent):
+        if not values:
+            return 0
+        return values[min(len(values) - 1, len(values) * percent // 100)]
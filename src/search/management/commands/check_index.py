@@ -0,0 +1,59 @@
+# -*- coding: utf8 -*-
+
+from __future__ import unicode_literals
+
+import logging
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from elasticsearch.exceptions import ConnectionError
+
+from search.consistency import check_index, BUCKET_SIZE
+from search.utils import get_categories
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    """Compare the search index with the database, and fix differences.
+
+    Only the revisions that are missing, outdated or that should not be
+    indexed anymore are reindexed or deleted.
+
+    """
+    args = '[organisation_slug/category_slug ...]'
+    help = 'Check that the search index is consistent with the database.'
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--dry-run',
+            action='store_true', dest='dry_run', default=False,
+            help='Only report differences, do not fix them.'),
+        make_option(
+            '--bucket-size',
+            type='int', dest='bucket_size', default=BUCKET_SIZE,
+            help='Number of consecutive revision ids compared at once.'),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            categories = get_categories(args)
+        except ValueError as e:
+            raise CommandError(e)
+
+        try:
+            reports = check_index(
+                categories,
+                repair=not options['dry_run'],
+                bucket_size=options['bucket_size'])
+        except ConnectionError:
+            raise CommandError('Elasticsearch cannot be found')
+
+        for report in reports:
+            self.stdout.write(unicode(report))
+            if options['verbosity'] > 1:
+                for pk in report.to_index:
+                    self.stdout.write('  index revision {}'.format(pk))
+                for es_id in report.to_delete:
+                    self.stdout.write('  delete {}'.format(es_id))
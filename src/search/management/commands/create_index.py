@@ -5,11 +5,10 @@ from __future__ import unicode_literals
 import logging
 
 from django.core.management.base import BaseCommand, CommandError
-from django.conf import settings
 
 from elasticsearch.exceptions import ConnectionError
 
-from search.utils import create_index
+from search.utils import create_index, get_index_aliases
 
 
 logger = logging.getLogger(__name__)
@@ -17,7 +16,8 @@ logger = logging.getLogger(__name__)
 
 class Command(BaseCommand):
     def handle(self, *args, **options):
-        logger.info('Creating index %s' % settings.ELASTIC_INDEX)
+        logger.info('Creating indexes behind aliases %s' % ', '.join(
+            get_index_aliases()))
 
         try:
             create_index()
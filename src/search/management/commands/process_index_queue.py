@@ -0,0 +1,25 @@
+# -*- coding: utf8 -*-
+
+from __future__ import unicode_literals
+
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from elasticsearch.exceptions import ConnectionError
+
+from search.tasks import flush_index_queue
+
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Send all pending index operations to elasticsearch.'
+
+    def handle(self, *args, **options):
+        try:
+            stats = flush_index_queue()
+        except ConnectionError:
+            raise CommandError('Elasticsearch cannot be found')
+        logger.info('%d index operations were processed' % stats['operations'])
@@ -0,0 +1,141 @@
+# -*- coding: utf8 -*-
+
+from __future__ import unicode_literals
+
+import time
+import logging
+import datetime
+from optparse import make_option
+
+from elasticsearch.helpers import bulk
+from elasticsearch.exceptions import ConnectionError
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
+from django.conf import settings
+
+from search import elastic
+from search.backends import get_backend
+from search.cache import bump_generation
+from search.utils import (
+    get_categories, get_indexable_revisions, iter_index_data,
+    get_index_alias)
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_since(value):
+    """Parse a date or datetime, e.g "2015-10-01" or "2015-10-01T12:00"."""
+    since = parse_datetime(value)
+    if since is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError('Invalid date {}'.format(value))
+        since = datetime.datetime.combine(day, datetime.time())
+
+    if timezone.is_naive(since):
+        since = timezone.make_aware(since, timezone.get_current_timezone())
+    return since
+
+
+class Command(BaseCommand):
+    """Reindex some documents in the live index.
+
+    Contrary to `reindex_all`, documents are directly written in the current
+    index. Use it to recover from lost updates, e.g after a failed deploy or
+    an index restore.
+
+    """
+    help = 'Reindex documents modified since a date, or specific documents.'
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--since',
+            dest='since', default=None,
+            help='Only reindex documents modified since this date '
+                 '(e.g 2015-10-01 or 2015-10-01T12:00).'),
+        make_option(
+            '--category',
+            action='append', dest='categories', default=[],
+            help='Only reindex this category (organisation_slug/'
+                 'category_slug). Can be used several times.'),
+        make_option(
+            '--document-keys',
+            action='append', dest='document_keys', default=[],
+            help='Comma separated list of document keys to reindex.'),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            categories = get_categories(options['categories'])
+            since = parse_since(options['since']) if options['since'] else None
+        except ValueError as e:
+            raise CommandError(e)
+
+        document_keys = [
+            key.strip()
+            for keys in options['document_keys']
+            for key in keys.split(',') if key.strip()]
+
+        started = time.time()
+        total = 0
+        try:
+            for category in categories:
+                revisions = self.get_revisions(category, since, document_keys)
+                total += self.index_revisions(category, revisions)
+        except ConnectionError:
+            raise CommandError('Elasticsearch cannot be found')
+
+        duration = time.time() - started
+        self.stdout.write(
+            '{} revisions indexed in {:.1f}s ({:.0f} revisions/s)'.format(
+                total, duration, total / duration if duration else 0))
+
+    def get_revisions(self, category, since=None, document_keys=None):
+        revisions = get_indexable_revisions(category)
+        if since is not None:
+            revisions = revisions.filter(
+                Q(document__updated_on__gte=since) | Q(updated_on__gte=since))
+        if document_keys:
+            revisions = revisions.filter(
+                document__document_key__in=document_keys)
+        return revisions
+
+    def index_revisions(self, category, revisions):
+        """Index revisions by chunks, to keep the memory usage low."""
+        pks = list(revisions.values_list('pk', flat=True))
+        if not pks:
+            return 0
+
+        backend = get_backend()
+        chunk_size = settings.ELASTIC_REINDEX_CHUNK_SIZE
+        nb_indexed = 0
+        for start in range(0, len(pks), chunk_size):
+            chunk_started = time.time()
+            chunk = pks[start:start + chunk_size]
+            actions = iter_index_data(category, chunk)
+            if backend.uses_elasticsearch:
+                nb_written, _ = bulk(
+                    elastic,
+                    actions,
+                    chunk_size=settings.ELASTIC_BULK_SIZE,
+                    request_timeout=600)
+            else:
+                nb_written, _ = backend.bulk(actions)
+            nb_indexed += nb_written
+            duration = time.time() - chunk_started
+            logger.info('{}: {}/{} revisions indexed ({:.0f}/s)'.format(
+                category, nb_indexed, len(pks),
+                nb_written / duration if duration else 0))
+
+        if backend.uses_elasticsearch:
+            elastic.indices.refresh(
+                index=get_index_alias(category.document_type()))
+        else:
+            backend.refresh()
+        bump_generation(category.document_type())
+        self.stdout.write('{}: {} revisions indexed'.format(
+            category, nb_indexed))
+        return nb_indexed
@@ -22,53 +22,120 @@
 
 from __future__ import unicode_literals
 
+import os
+import json
 import logging
 import datetime
-import sys
+from multiprocessing import Pool
 from optparse import make_option
 
+from elasticsearch import Elasticsearch, RequestsHttpConnection
 from elasticsearch.helpers import bulk
 
-from django.core.management.base import BaseCommand
-from django.core.management import call_command
-from django.utils.six.moves import input
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.conf import settings
 
+from bookmarks.models import Bookmark
 from categories.models import Category
-from search import elastic
-from django.conf import settings
+from search import elastic, ANALYSIS_PROFILES
+from search.cache import bump_generation
+from search.consistency import ConsistencyChecker
+from search.percolator import register_subscription
+from search.utils import (
+    create_versioned_index, end_bulk_load, iter_index_data,
+    get_aliased_indexes, get_indexable_revisions, put_category_mapping,
+    switch_alias, get_index_alias, get_index_aliases)
 
 logger = logging.getLogger(__name__)
 
 
+# Each worker process uses it's own ES connection
+worker_elastic = None
+
+
+def init_worker():
+    """Make sure forked processes don't share parent's connections."""
+    global worker_elastic
+    connections.close_all()
+    worker_elastic = Elasticsearch(
+        settings.ELASTIC_HOSTS,
+        connection_class=RequestsHttpConnection)
+
+
+def index_chunk(chunk):
+    """Index a range of revisions from a single category.
+
+    `chunk` is a (category_id, first_pk, last_pk, index) tuple. `last_pk` can
+    be None, meaning there is no upper bound.
+
+    """
+    category_id, first_pk, last_pk, index = chunk
+    category = Category.objects \
+        .select_related('organisation', 'category_template__metadata_model') \
+        .get(pk=category_id)
+
+    revisions = get_indexable_revisions(category).filter(pk__gte=first_pk)
+    if last_pk is not None:
+        revisions = revisions.filter(pk__lte=last_pk)
+
+    actions = iter_index_data(category, revisions, index=index)
+    nb_indexed, _ = bulk(
+        worker_elastic or elastic,
+        actions,
+        chunk_size=settings.ELASTIC_BULK_SIZE,
+        request_timeout=600)
+    return chunk, nb_indexed
+
+
 class Command(BaseCommand):
+    """Rebuild the search index without any downtime.
+
+    Data is indexed in brand new indexes, one for every alias of the index
+    layout (see `settings.ELASTIC_INDEX_LAYOUT`), and the aliases are only
+    switched to the new indexes when they are complete.
+
+    Categories are splitted in chunks of revisions that are indexed in
+    parallel. Progress is saved after every chunk, so an interrupted
+    reindex can be resumed.
+
+    """
     option_list = BaseCommand.option_list + (
         make_option(
             '--noinput',
             action='store_false', dest='interactive', default=True,
-            help='Tells Django to NOT prompt the user for input of any kind.'),
+            help='Kept for backward compatibility. Reindexing does not '
+                 'require any confirmation anymore.'),
+        make_option(
+            '--workers',
+            type='int', dest='workers',
+            default=settings.ELASTIC_REINDEX_WORKERS,
+            help='Number of parallel indexing processes.'),
+        make_option(
+            '--resume',
+            action='store_true', dest='resume', default=False,
+            help='Resume the last interrupted reindex.'),
+        make_option(
+            '--keep-old',
+            action='store_true', dest='keep_old', default=False,
+            help='Do not delete the previous index after the alias switch.'),
+        make_option(
+            '--analysis-profile',
+            dest='profile', default=None,
+            help='Analysis profile of the new index ({}). Defaults to '
+                 'settings.ELASTIC_ANALYSIS_PROFILE.'.format(
+                     ', '.join(sorted(ANALYSIS_PROFILES.keys())))),
     )
 
     def handle(self, *args, **options):
-        interactive = options.get('interactive')
-        if interactive:
-            confirm = input("""
-You have requested a flush of the search index.
-This will IRREVERSIBLY DESTROY all data currently indexed by Elasticsearch.
-Are you sure you want to do this?
-
-Type 'yes' to continue, or 'no' to cancel: """)
-        else:
-            confirm = 'yes'
-
-        if confirm != 'yes':
-            sys.exit(1)
-
         start_reindex = datetime.datetime.now()
         logger.info('Reindex starting at %s' % start_reindex)
 
-        call_command('delete_index', **options)
-        call_command('create_index', **options)
-        call_command('set_mappings', **options)
+        profile = options['profile'] or settings.ELASTIC_ANALYSIS_PROFILE
+        if profile not in ANALYSIS_PROFILES:
+            raise CommandError('Unknown analysis profile {}'.format(profile))
 
         categories = Category.objects \
             .select_related(
@@ -77,40 +144,226 @@ Type 'yes' to continue, or 'no' to cancel: """)
                 'category_template__metadata_model') \
             .order_by('organisation__name', 'category_template__name')
 
-        logger.info('Preparing index data')
+        checkpoint = self.load_checkpoint() if options['resume'] else None
+        if checkpoint is None:
+            self.clear_checkpoint()
+            indexes = {}
+            for alias in get_index_aliases(categories):
+                indexes[alias] = create_versioned_index(
+                    alias, bulk_load=True, profile=profile)
+                logger.info('Created new index {} ({} analysis)'.format(
+                    indexes[alias], profile))
+            checkpoint = {
+                'indexes': indexes,
+                'started_on': timezone.now().isoformat(),
+                'chunks': list(self.get_chunks(categories, indexes)),
+                'done': [],
+            }
+            self.save_checkpoint(checkpoint)
+        else:
+            indexes = checkpoint['indexes']
+            logger.info('Resuming reindex in indexes {}'.format(
+                ', '.join(sorted(indexes.values()))))
+
+        for category in categories:
+            put_category_mapping(
+                category.id, index=self.get_index(indexes, category))
+
+        done = set(checkpoint['done'])
+        chunks = [chunk for chunk in checkpoint['chunks']
+                  if self.chunk_key(chunk) not in done]
+        logger.info('{} chunks of revisions to index'.format(len(chunks)))
+        for chunk, nb_indexed in self.index_chunks(chunks, options['workers']):
+            checkpoint['done'].append(self.chunk_key(chunk))
+            self.save_checkpoint(checkpoint)
+            logger.info('Indexed {} revisions of category {}'.format(
+                nb_indexed, chunk[0]))
+
+        catch_up_started_on = timezone.now()
+        self.catch_up(
+            categories, indexes, parse_datetime(checkpoint['started_on']))
+        for index in indexes.values():
+            end_bulk_load(index)
+
+        errors = self.check_counts(categories, indexes)
+        if errors:
+            raise CommandError(
+                'Indexes {} are incomplete, aliases were not switched. '
+                'Run the command again with --resume.\n{}'.format(
+                    ', '.join(sorted(indexes.values())), '\n'.join(errors)))
+
+        old_indexes = []
+        for alias, index in sorted(indexes.items()):
+            old_indexes += switch_alias(alias, index)
+            logger.info('Alias {} now points to {}'.format(alias, index))
+
+        # Modifications made during the catch up were only written in the
+        # old indexes, which are about to be deleted
+        self.catch_up(categories, indexes, catch_up_started_on)
+        self.register_subscriptions(categories, indexes)
         for category in categories:
-            document_type = category.document_type()
-            RevisionClass = category.revision_class()
-            revisions = RevisionClass.objects \
-                .select_related() \
-                .filter(document__category=category)
-
-            count = 0
-            actions = []
-            logger.info('Starting bulk index of category {}'.format(category))
-            for revision in revisions:
-                if revision.document.is_indexable:
-                    actions.append({
-                        '_index': settings.ELASTIC_INDEX,
-                        '_type': document_type,
-                        '_id': revision.unique_id,
-                        '_source': revision.to_json(),
-                    })
-
-                    count += 1
-                    if count % settings.ELASTIC_BULK_SIZE == 0:
-                        bulk(
-                            elastic,
-                            actions,
-                            chunk_size=settings.ELASTIC_BULK_SIZE,
-                            request_timeout=600)
-                        actions = []
+            bump_generation(category.document_type())
+        if old_indexes and not options['keep_old']:
+            elastic.indices.delete(index=','.join(old_indexes))
+        self.clear_checkpoint()
+
+        end_reindex = datetime.datetime.now()
+        logger.info('Reindex ending at %s' % end_reindex)
 
+    def get_index(self, indexes, category):
+        """Returns the new index the category is indexed into."""
+        return indexes[get_index_alias(category.document_type())]
+
+    def get_chunks(self, categories, indexes):
+        """Split every category in ranges of revisions.
+
+        The last range of each category is left open, so revisions created
+        while the reindex is running are included.
+
+        Chunks are computed once and saved in the checkpoint, so a resumed
+        reindex uses the same ranges, even if revisions were created or
+        deleted in the meantime.
+
+        """
+        chunk_size = settings.ELASTIC_REINDEX_CHUNK_SIZE
+        for category in categories:
+            index = self.get_index(indexes, category)
+            pks = get_indexable_revisions(category) \
+                .values_list('pk', flat=True)
+            first_pk = None
+            for count, pk in enumerate(pks.iterator()):
+                if count % chunk_size == 0:
+                    if first_pk is not None:
+                        yield (category.id, first_pk, pk - 1, index)
+                    first_pk = pk
+
+            if first_pk is not None:
+                yield (category.id, first_pk, None, index)
+
+    def chunk_key(self, chunk):
+        return '{}:{}:{}'.format(*chunk[:3])
+
+    def index_chunks(self, chunks, workers):
+        """Dispatch the chunks to index across a pool of processes."""
+        if workers <= 1:
+            for chunk in chunks:
+                yield index_chunk(chunk)
+            return
+
+        # Forked processes must not inherit the current db connection
+        connections.close_all()
+        pool = Pool(workers, initializer=init_worker)
+        try:
+            for result in pool.imap_unordered(index_chunk, chunks):
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def catch_up(self, categories, indexes, since):
+        """Apply the modifications made since the reindex started.
+
+        Those modifications were only written in the live indexes. Modified
+        revisions are indexed again, then the consistency checker deletes
+        the revisions that do not exist anymore (and repairs any remaining
+        difference).
+
+        """
+        for category in categories:
+            revisions = get_indexable_revisions(category) \
+                .filter(document__updated_on__gte=since)
+            actions = iter_index_data(
+                category, revisions, index=self.get_index(indexes, category))
             bulk(
                 elastic,
                 actions,
                 chunk_size=settings.ELASTIC_BULK_SIZE,
-                request_timeout=60)
+                request_timeout=600)
 
-        end_reindex = datetime.datetime.now()
-        logger.info('Reindex ending at %s' % end_reindex)
+        # Refresh is disabled during the bulk load
+        elastic.indices.refresh(index=','.join(set(indexes.values())))
+        for category in categories:
+            checker = ConsistencyChecker(
+                category, index=self.get_index(indexes, category))
+            report = checker.check()
+            if not report.is_consistent():
+                logger.info('Catching up: {}'.format(unicode(report)))
+                checker.repair(report)
+
+    def register_subscriptions(self, categories, indexes):
+        """Copy the bookmark percolator queries to the new indexes.
+
+        This is done once the aliases were switched, so subscriptions that
+        are modified from now on are written in the new indexes.
+
+        """
+        categories = dict((category.id, category) for category in categories)
+        subscriptions = Bookmark.objects \
+            .filter(subscribed=True) \
+            .values_list('id', 'category_id')
+        for bookmark_id, category_id in subscriptions:
+            register_subscription(
+                bookmark_id,
+                index=self.get_index(indexes, categories[category_id]))
+
+    def check_counts(self, categories, indexes):
+        """Make sure that every revision made it to the new indexes."""
+        errors = []
+        for category in categories:
+            db_count = get_indexable_revisions(category).count()
+            es_count = elastic.count(
+                index=self.get_index(indexes, category),
+                doc_type=category.document_type())['count']
+            if db_count != es_count:
+                errors.append('{}: {} revisions in db, {} in index'.format(
+                    category, db_count, es_count))
+        return errors
+
+    def load_checkpoint(self):
+        """Get the interrupted reindex data, if it's still valid."""
+        path = settings.ELASTIC_REINDEX_CHECKPOINT
+        if not os.path.exists(path):
+            raise CommandError('There is no reindex to resume.')
+
+        with open(path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+
+        for alias, index in checkpoint['indexes'].items():
+            if not elastic.indices.exists(index=index):
+                raise CommandError(
+                    'Index {} does not exist anymore.'.format(index))
+
+            if index in get_aliased_indexes(alias):
+                raise CommandError('Index {} is already live.'.format(index))
+
+        # The index layout was changed since the reindex started
+        if set(checkpoint['indexes'].keys()) != set(get_index_aliases()):
+            raise CommandError(
+                'The index layout changed, the reindex cannot be resumed.')
+
+        return checkpoint
+
+    def save_checkpoint(self, checkpoint):
+        path = settings.ELASTIC_REINDEX_CHECKPOINT
+        checkpoint_dir = os.path.dirname(path)
+        if not os.path.exists(checkpoint_dir):
+            os.makedirs(checkpoint_dir)
+
+        tmp_path = '{}.tmp'.format(path)
+        with open(tmp_path, 'w') as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file)
+        os.rename(tmp_path, path)
+
+    def clear_checkpoint(self):
+        """Remove the checkpoint and the unfinished index it refers to."""
+        path = settings.ELASTIC_REINDEX_CHECKPOINT
+        if not os.path.exists(path):
+            return
+
+        with open(path) as checkpoint_file:
+            indexes = json.load(checkpoint_file)['indexes']
+        os.remove(path)
+
+        for alias, index in indexes.items():
+            if index not in get_aliased_indexes(alias):
+                elastic.indices.delete(index=index, ignore=404)
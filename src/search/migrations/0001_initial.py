@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexOperation',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('document_id', models.IntegerField(unique=True, verbose_name='Document id')),
+                ('operation', models.CharField(default='index', max_length=10, verbose_name='Operation', choices=[('index', 'Index'), ('unindex', 'Unindex')])),
+                ('document_type', models.CharField(max_length=250, verbose_name='Document type', blank=True)),
+                ('es_ids', models.TextField(help_text='Ids of the revisions to remove from the index', verbose_name='Index ids', blank=True)),
+                ('created_on', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Created on')),
+                ('updated_on', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Updated on')),
+            ],
+            options={
+                'verbose_name': 'Index operation',
+                'verbose_name_plural': 'Index operations',
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='indexoperation',
+            name='revision_ids',
+            field=models.TextField(help_text='Ids of the revisions that must be entirely reindexed', verbose_name='Revision ids', blank=True),
+        ),
+    ]
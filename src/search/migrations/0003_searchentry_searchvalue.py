@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0002_indexoperation_revision_ids'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchEntry',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('document_type', models.CharField(max_length=250, verbose_name='Document type')),
+                ('index_id', models.CharField(max_length=250, verbose_name='Index id')),
+                ('document_key', models.CharField(max_length=250, verbose_name='Document key', db_index=True)),
+                ('is_latest_revision', models.BooleanField(default=False, verbose_name='Is latest revision')),
+                ('search_text', models.TextField(help_text='Normalized values of the searchable fields', verbose_name='Search text', blank=True)),
+                ('source', models.TextField(verbose_name='Source')),
+            ],
+            options={
+                'verbose_name': 'Search entry',
+                'verbose_name_plural': 'Search entries',
+            },
+        ),
+        migrations.CreateModel(
+            name='SearchValue',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('field', models.CharField(max_length=250, verbose_name='Field')),
+                ('value', models.CharField(max_length=255, verbose_name='Value', blank=True)),
+                ('number', models.FloatField(null=True, verbose_name='Number', blank=True)),
+                ('entry', models.ForeignKey(related_name='values', to='search.SearchEntry')),
+            ],
+            options={
+                'verbose_name': 'Search value',
+                'verbose_name_plural': 'Search values',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='searchentry',
+            unique_together=set([('document_type', 'index_id')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='searchvalue',
+            unique_together=set([('entry', 'field')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='searchvalue',
+            index_together=set([('field', 'number'), ('field', 'value')]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0003_searchentry_searchvalue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='indexoperation',
+            name='version',
+            field=models.PositiveIntegerField(default=0, help_text='Incremented every time the operation is updated', verbose_name='Version'),
+        ),
+    ]
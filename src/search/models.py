@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+from django.db import models, transaction, IntegrityError
+from django.utils.translation import ugettext_lazy as _
+from django.utils import timezone
+
+from model_utils import Choices
+
+
+class IndexOperationManager(models.Manager):
+    def queue(self, document_id, operation, revision_ids=(), **kwargs):
+        """Upsert the pending operation for the given document.
+
+        There is at most one pending operation per document, so successive
+        updates are coalesced. Revision ids to reindex are merged, and the
+        operation `version` is incremented, so the queue processing can tell
+        if the operation was updated since it was read.
+
+        Returns True if a new operation was created, False if an existing one
+        was updated.
+
+        """
+        try:
+            with transaction.atomic():
+                operation_obj = self \
+                    .select_for_update() \
+                    .filter(document_id=document_id) \
+                    .first()
+                created = operation_obj is None
+                if created:
+                    operation_obj = self.model(document_id=document_id)
+
+                operation_obj.operation = operation
+                operation_obj.add_revision_ids(revision_ids)
+                operation_obj.version += 1
+                operation_obj.updated_on = timezone.now()
+                for key, value in kwargs.items():
+                    setattr(operation_obj, key, value)
+                operation_obj.save()
+        except IntegrityError:
+            # The same document was queued concurrently
+            return self.queue(document_id, operation, revision_ids, **kwargs)
+
+        return created
+
+    def queue_index(self, document, revision_ids=()):
+        """Queue the indexation of the document.
+
+        Revisions listed in `revision_ids` will be entirely reindexed. Other
+        revisions will only be updated if document level fields changed.
+
+        """
+        return self.queue(
+            document.pk,
+            self.model.OPERATIONS.index,
+            revision_ids=revision_ids,
+            document_type='',
+            es_ids='')
+
+    def queue_unindex(self, document):
+        """Queue the removal of the document from the index.
+
+        The index ids must be computed right now, since the revisions will
+        not exist anymore when the operation is processed.
+
+        """
+        revisions = document.get_all_revisions()
+        return self.queue(
+            document.pk,
+            self.model.OPERATIONS.unindex,
+            document_type=document.document_type(),
+            es_ids=','.join(revision.unique_id for revision in revisions))
+
+
+class IndexOperation(models.Model):
+    """A pending index update, waiting to be sent to elasticsearch."""
+    OPERATIONS = Choices(
+        ('index', _('Index')),
+        ('unindex', _('Unindex')),
+    )
+
+    objects = IndexOperationManager()
+
+    # Not a foreign key, since the document may be deleted
+    document_id = models.IntegerField(
+        _('Document id'),
+        unique=True)
+    operation = models.CharField(
+        _('Operation'),
+        max_length=10,
+        choices=OPERATIONS,
+        default=OPERATIONS.index)
+    document_type = models.CharField(
+        _('Document type'),
+        max_length=250,
+        blank=True)
+    revision_ids = models.TextField(
+        _('Revision ids'),
+        blank=True,
+        help_text=_('Ids of the revisions that must be entirely reindexed'))
+    es_ids = models.TextField(
+        _('Index ids'),
+        blank=True,
+        help_text=_('Ids of the revisions to remove from the index'))
+    created_on = models.DateTimeField(
+        _('Created on'),
+        default=timezone.now)
+    updated_on = models.DateTimeField(
+        _('Updated on'),
+        default=timezone.now)
+    version = models.PositiveIntegerField(
+        _('Version'),
+        default=0,
+        help_text=_('Incremented every time the operation is updated'))
+
+    class Meta:
+        app_label = 'search'
+        verbose_name = _('Index operation')
+        verbose_name_plural = _('Index operations')
+
+    def __unicode__(self):
+        return '{} {}'.format(self.operation, self.document_id)
+
+    def get_revision_ids(self):
+        return set(int(pk) for pk in self.revision_ids.split(',') if pk)
+
+    def add_revision_ids(self, revision_ids):
+        revision_ids = self.get_revision_ids() | set(revision_ids)
+        self.revision_ids = ','.join(str(pk) for pk in sorted(revision_ids))
+
+
+class SearchEntry(models.Model):
+    """An indexed revision, used by the database search backend.
+
+    This is the equivalent of an elasticsearch document. The `source` is the
+    indexed json, and every field value is also stored as a `SearchValue`,
+    so it can be filtered, sorted and aggregated on.
+
+    """
+    document_type = models.CharField(
+        _('Document type'),
+        max_length=250)
+    index_id = models.CharField(
+        _('Index id'),
+        max_length=250)
+    document_key = models.CharField(
+        _('Document key'),
+        max_length=250,
+        db_index=True)
+    is_latest_revision = models.BooleanField(
+        _('Is latest revision'),
+        default=False)
+    search_text = models.TextField(
+        _('Search text'),
+        blank=True,
+        help_text=_('Normalized values of the searchable fields'))
+    source = models.TextField(
+        _('Source'))
+
+    class Meta:
+        app_label = 'search'
+        verbose_name = _('Search entry')
+        verbose_name_plural = _('Search entries')
+        unique_together = ('document_type', 'index_id')
+
+    def __unicode__(self):
+        return '{} {}'.format(self.document_type, self.index_id)
+
+
+class SearchValue(models.Model):
+    """A single field value of an indexed revision."""
+    entry = models.ForeignKey(
+        SearchEntry,
+        related_name='values')
+    field = models.CharField(
+        _('Field'),
+        max_length=250)
+    value = models.CharField(
+        _('Value'),
+        max_length=255,
+        blank=True)
+    number = models.FloatField(
+        _('Number'),
+        null=True,
+        blank=True)
+
+    class Meta:
+        app_label = 'search'
+        verbose_name = _('Search value')
+        verbose_name_plural = _('Search values')
+        unique_together = ('entry', 'field')
+        index_together = (
+            ('field', 'value'),
+            ('field', 'number'),
+        )
+
+    def __unicode__(self):
+        return '{}={}'.format(self.field, self.value)
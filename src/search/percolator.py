@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+"""Bookmark subscriptions.
+
+The search of a subscribed bookmark is registered as an elasticsearch
+percolator query, in the index of the bookmark's category. Revisions sent
+through the index queue are percolated in batches, and the subscribers of
+the matching bookmarks are notified.
+
+"""
+
+from __future__ import unicode_literals
+
+import logging
+from collections import defaultdict
+from urlparse import urlparse
+
+from django.http import QueryDict
+from django.utils.html import format_html, format_html_join
+from django.utils.translation import ugettext
+from django.conf import settings
+
+from core.celery import app
+from bookmarks.models import Bookmark
+from notifications.models import notify
+from search import elastic
+from search.builder import SearchBuilder, PAGINATION_FILTERS
+from search.utils import get_index_alias
+
+logger = logging.getLogger(__name__)
+
+
+PERCOLATOR_TYPE = '.percolator'
+
+
+def get_percolator_id(bookmark_id):
+    return 'bookmark_{}'.format(bookmark_id)
+
+
+def get_bookmark_filters(bookmark):
+    """Returns the search filters stored in the bookmark url.
+
+    Filters are a `QueryDict`, like the `request.GET` the search view gives
+    to the builder, so fields with several values keep all of them.
+
+    """
+    filters = QueryDict(urlparse(bookmark.url).query, mutable=True)
+    for key in PAGINATION_FILTERS:
+        filters.pop(key, None)
+    return filters
+
+
+def build_percolator_query(bookmark):
+    """Returns the ES query matching the bookmark's latest revisions."""
+    builder = SearchBuilder(bookmark.category, get_bookmark_filters(bookmark))
+    return builder.build_query().to_dict()['query']
+
+
+@app.task
+def register_subscription(bookmark_id, index=None):
+    """Register (or update) the percolator query of a bookmark."""
+    bookmark = Bookmark.objects \
+        .select_related(
+            'category__organisation',
+            'category__category_template__metadata_model') \
+        .get(pk=bookmark_id)
+
+    try:
+        query = build_percolator_query(bookmark)
+    except RuntimeError:
+        logger.warning('Bookmark {} has invalid search filters'.format(
+            bookmark_id))
+        return
+
+    elastic.index(
+        index=index or get_index_alias(bookmark.category.document_type()),
+        doc_type=PERCOLATOR_TYPE,
+        id=get_percolator_id(bookmark_id),
+        body={
+            'query': query,
+            'category_id': bookmark.category_id,
+        })
+
+
+@app.task
+def unregister_subscription(bookmark_id, document_type):
+    elastic.delete(
+        index=get_index_alias(document_type),
+        doc_type=PERCOLATOR_TYPE,
+        id=get_percolator_id(bookmark_id),
+        ignore=404)
+
+
+def percolate(category, sources):
+    """Percolate indexed revisions against the category subscriptions.
+
+    `sources` is the list of revisions indexed data. Requests are sent by
+    batches of `settings.ELASTIC_BULK_SIZE` revisions.
+
+    Returns a dict of `{bookmark_id: [source, …]}`.
+
+    """
+    document_type = category.document_type()
+    header = {'percolate': {
+        'index': get_index_alias(document_type),
+        'type': document_type,
+    }}
+    category_filter = {'term': {'category_id': category.id}}
+
+    matches = defaultdict(list)
+    batch_size = settings.ELASTIC_BULK_SIZE
+    for start in range(0, len(sources), batch_size):
+        batch = sources[start:start + batch_size]
+        body = []
+        for source in batch:
+            body += [header, {'doc': source, 'filter': category_filter}]
+
+        response = elastic.mpercolate(body=body)
+        for source, result in zip(batch, response['responses']):
+            if 'error' in result:
+                logger.error('Percolation failed: {}'.format(result['error']))
+                continue
+            for match in result.get('matches', []):
+                bookmark_id = int(match['_id'].split('_')[-1])
+                matches[bookmark_id].append(source)
+    return matches
+
+
+def notify_subscribers(category, sources):
+    """Notify users whose subscriptions match the indexed revisions."""
+    if not sources:
+        return
+
+    subscriptions = Bookmark.objects \
+        .filter(category=category) \
+        .filter(subscribed=True)
+    if not subscriptions.exists():
+        return
+
+    matches = percolate(category, sources)
+    if not matches:
+        return
+
+    for bookmark in subscriptions.filter(id__in=matches.keys()):
+        message = format_html(
+            ugettext('Documents matching your bookmark "{}" were updated:'),
+            bookmark.name)
+        doc_list = format_html_join(
+            '', '<li><a href="{}">{}</a></li>',
+            ((source['url'], source['document_key'])
+             for source in matches[bookmark.id]))
+        notify(bookmark.user_id, format_html(
+            '{} <ul>{}</ul>', message, doc_list))
@@ -2,13 +2,19 @@
 
 from __future__ import unicode_literals
 
-from django.db.models.signals import post_save, pre_delete
+from django.db import transaction
+from django.db.models.signals import post_save, pre_save, pre_delete
 from django.conf import settings
 
 
+from bookmarks.models import Bookmark
 from categories.models import Category
-from search.utils import index_document, unindex_document, put_category_mapping
-from documents.models import Document
+from search.backends import get_backend
+from search.models import IndexOperation
+from search.percolator import register_subscription, unregister_subscription
+from search.tasks import process_index_queue
+from search.utils import put_category_mapping
+from documents.models import Document, MetadataRevision
 
 
 def update_index(sender, instance, **kwargs):
@@ -20,29 +26,127 @@ def update_index(sender, instance, **kwargs):
     # Thus, we MUST not index the document on the first save, since the
     # metadata and revision does not exist yet
     if not created and instance.is_indexable:
-        index_document(instance.pk)
+        queued = IndexOperation.objects.queue_index(instance)
+        schedule_index_queue(queued)
+
+
+def update_revision_index(sender, instance, **kwargs):
+    """Queue the reindexation of a saved revision.
+
+    When a new revision is created, the previous latest revision is not the
+    latest anymore, so it must be reindexed as well.
+
+    The handler is connected without sender, since revision classes are
+    not known when signals are connected, so any other saved model is
+    filtered out right away.
+
+    """
+    if not issubclass(sender, MetadataRevision):
+        return
+
+    # Revisions loaded from fixtures are ignored
+    if kwargs.get('raw'):
+        return
+
+    revision_ids = [instance.pk]
+    if kwargs.get('created'):
+        previous_ids = type(instance).objects \
+            .filter(document_id=instance.document_id) \
+            .filter(revision__lt=instance.revision) \
+            .order_by('-revision') \
+            .values_list('id', flat=True)[:1]
+        revision_ids += list(previous_ids)
+
+    queued = IndexOperation.objects.queue_index(
+        instance.document, revision_ids=revision_ids)
+    schedule_index_queue(queued)
 
 
 def remove_from_index(sender, instance, **kwargs):
-    unindex_document(instance.pk)
+    queued = IndexOperation.objects.queue_unindex(instance)
+    schedule_index_queue(queued)
+
+
+def schedule_index_queue(queued):
+    """Make sure the index queue will be processed soon.
+
+    A document is usually saved several times in a row. The queue processing
+    is delayed so all those updates are coalesced into a single operation.
+    There is no need to schedule anything if the document was already
+    waiting in the queue.
+
+    The task is only sent once the current transaction is committed, so the
+    queued operation is visible when the queue is processed.
+
+    """
+    if queued:
+        on_commit(lambda: process_index_queue.apply_async(
+            countdown=settings.ELASTIC_QUEUE_DELAY))
+
+
+def on_commit(func):
+    """Run `func` once the current transaction is committed.
+
+    Requires a `transaction_hooks` database engine. With other engines,
+    `func` is run right away.
+
+    """
+    connection = transaction.get_connection()
+    if hasattr(connection, 'on_commit'):
+        connection.on_commit(func)
+    else:
+        func()
 
 
 def save_mapping(sender, instance, **kwargs):
     created = kwargs.pop('created')
-    if created:
+    if created and get_backend().uses_elasticsearch:
         put_category_mapping.delay(instance.pk)
 
 
+def track_subscription(sender, instance, **kwargs):
+    """Remember if the bookmark was subscribed before being saved."""
+    instance._was_subscribed = instance.pk is not None and Bookmark.objects \
+        .filter(pk=instance.pk) \
+        .filter(subscribed=True) \
+        .exists()
+
+
+def update_subscription(sender, instance, **kwargs):
+    if not get_backend().uses_elasticsearch:
+        return
+
+    if instance.subscribed:
+        register_subscription.delay(instance.pk)
+    elif getattr(instance, '_was_subscribed', False):
+        unregister_subscription.delay(
+            instance.pk, instance.category.document_type())
+
+
+def remove_subscription(sender, instance, **kwargs):
+    if instance.subscribed and get_backend().uses_elasticsearch:
+        unregister_subscription.delay(
+            instance.pk, instance.category.document_type())
+
+
 def connect_signals():
     post_save.connect(update_index, sender=Document, dispatch_uid='update_index')
+    post_save.connect(update_revision_index, dispatch_uid='update_revision_index')
     pre_delete.connect(remove_from_index, sender=Document, dispatch_uid='remove_from_index')
     post_save.connect(save_mapping, sender=Category, dispatch_uid='put_category_mapping')
+    pre_save.connect(track_subscription, sender=Bookmark, dispatch_uid='track_subscription')
+    post_save.connect(update_subscription, sender=Bookmark, dispatch_uid='update_subscription')
+    pre_delete.connect(remove_subscription, sender=Bookmark, dispatch_uid='remove_subscription')
 
 
 def disconnect_signals():
     post_save.disconnect(update_index, sender=Document, dispatch_uid='update_index')
+    post_save.disconnect(update_revision_index, dispatch_uid='update_revision_index')
     pre_delete.disconnect(remove_from_index, sender=Document, dispatch_uid='remove_from_index')
     post_save.disconnect(save_mapping, sender=Category, dispatch_uid='put_category_mapping')
+    pre_save.disconnect(track_subscription, sender=Bookmark, dispatch_uid='track_subscription')
+    post_save.disconnect(update_subscription, sender=Bookmark, dispatch_uid='update_subscription')
+    pre_delete.disconnect(remove_subscription, sender=Bookmark, dispatch_uid='remove_subscription')
 
 
 if settings.ELASTIC_AUTOINDEX:
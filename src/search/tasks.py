@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import logging
+from collections import defaultdict, Counter
+
+from django.db import transaction
+from django.conf import settings
+
+from elasticsearch.helpers import bulk, BulkIndexError
+from elasticsearch.serializer import JSONSerializer
+from elasticsearch.exceptions import ElasticsearchException
+
+from core.celery import app
+from documents.models import Document
+from search import elastic
+from search.backends import get_backend
+from search.cache import bump_generation
+from search.consistency import check_index
+from search.models import IndexOperation
+from search.percolator import notify_subscribers
+from search.utils import (
+    serialize_revisions, get_document_fields, get_index_alias,
+    get_type_indexes)
+
+
+logger = logging.getLogger(__name__)
+
+
+# Maximum number of operations processed at once
+QUEUE_BATCH_SIZE = 1000
+
+serializer = JSONSerializer()
+
+
+@app.task(bind=True, max_retries=8)
+def process_index_queue(self):
+    """Send pending index operations to elasticsearch.
+
+    In case of failure, the task is retried with an exponential backoff.
+
+    """
+    try:
+        flush_index_queue()
+    except ElasticsearchException as exc:
+        countdown = settings.ELASTIC_QUEUE_DELAY * 2 ** self.request.retries
+        logger.warning('Cannot process index queue, retrying in {}s'.format(
+            countdown))
+        raise self.retry(exc=exc, countdown=countdown)
+
+
+@app.task
+def check_index_consistency():
+    """Fix revisions that are not correctly indexed.
+
+    Meant to be run periodically, to catch index updates that were lost.
+    Only elasticsearch indexes are checked.
+
+    """
+    if not get_backend().uses_elasticsearch:
+        return
+
+    reports = check_index(repair=True)
+    nb_repaired = sum(len(report.to_index) + len(report.to_delete)
+                      for report in reports)
+    if nb_repaired:
+        logger.warning('{} revisions were repaired in the index'.format(
+            nb_repaired))
+
+
+def flush_index_queue(document_ids=None):
+    """Synchronously process pending index operations.
+
+    Use this whenever the index must be up to date before going further,
+    e.g at the end of a batch task. If `document_ids` is given, only those
+    documents are processed.
+
+    Operations are only removed from the queue once they were successfully
+    processed. Operations that were updated in the meantime (i.e their
+    version changed) are kept for the next run.
+
+    Returns counters of processed operations, written documents and
+    revisions.
+
+    """
+    stats = Counter()
+    while True:
+        operations = get_pending_operations(document_ids)
+        if not operations:
+            break
+
+        stats.update(run_operations(operations))
+        delete_operations(operations)
+
+        stats['operations'] += len(operations)
+        if len(operations) < QUEUE_BATCH_SIZE:
+            break
+
+    if stats:
+        logger.info(
+            'Index queue: {0[operations]} operations, {0[documents]} '
+            'documents, {0[indexed]} revisions indexed, {0[updated]} '
+            'updated, {0[deleted]} deleted'.format(stats))
+    return stats
+
+
+def get_pending_operations(document_ids=None):
+    # Locking prevents from reading a row that is being updated in a
+    # transaction that is not commited yet.
+    with transaction.atomic():
+        qs = IndexOperation.objects \
+            .select_for_update() \
+            .order_by('id')
+        if document_ids is not None:
+            qs = qs.filter(document_id__in=document_ids)
+        operations = list(qs[:QUEUE_BATCH_SIZE])
+    return operations
+
+
+def delete_operations(operations):
+    """Remove processed operations, unless they were updated since."""
+    ids_by_version = defaultdict(list)
+    for operation in operations:
+        ids_by_version[operation.version].append(operation.id)
+
+    for version, ids in ids_by_version.items():
+        IndexOperation.objects \
+            .filter(id__in=ids) \
+            .filter(version=version) \
+            .delete()
+
+
+def run_operations(operations):
+    """Send the operations to the search backend.
+
+    Returns counters of written documents and revisions.
+
+    """
+    backend = get_backend()
+    if not backend.uses_elasticsearch:
+        stats, document_types = backend.run_operations(operations)
+        backend.refresh()
+        for document_type in document_types:
+            bump_generation(document_type)
+        return stats
+
+    stats = Counter()
+    unindex_operations = [
+        operation for operation in operations
+        if operation.operation == IndexOperation.OPERATIONS.unindex]
+    index_operations = [
+        operation for operation in operations
+        if operation.operation == IndexOperation.OPERATIONS.index]
+
+    document_types = set()
+    if unindex_operations:
+        stats.update(unindex_documents(unindex_operations))
+        document_types.update(
+            operation.document_type for operation in unindex_operations)
+
+    if index_operations:
+        index_stats, index_types = index_documents(index_operations)
+        stats.update(index_stats)
+        document_types.update(index_types)
+
+    if document_types:
+        # Modifications must be visible before cached results are invalidated
+        elastic.indices.refresh(index=get_type_indexes(document_types))
+        for document_type in document_types:
+            bump_generation(document_type)
+
+    return stats
+
+
+def unindex_documents(operations):
+    actions = [
+        {
+            '_op_type': 'delete',
+            '_index': get_index_alias(operation.document_type),
+            '_type': operation.document_type,
+            '_id': es_id,
+        }
+        for operation in operations
+        for es_id in operation.es_ids.split(',') if es_id
+    ]
+    bulk(
+        elastic,
+        actions,
+        raise_on_error=False,
+        chunk_size=settings.ELASTIC_BULK_SIZE,
+        request_timeout=60)
+    return Counter(documents=len(operations), deleted=len(actions))
+
+
+def index_documents(operations):
+    """Index the documents that were modified.
+
+    Only the revisions that were modified are entirely reindexed, along with
+    the latest revision of each document. If document level fields changed,
+    other revisions are updated with a partial update.
+
+    Returns counters of written documents and revisions, and the list of
+    updated document types.
+
+    """
+    stats = Counter()
+    revision_ids = dict(
+        (operation.document_id, operation.get_revision_ids())
+        for operation in operations)
+    documents = Document.objects \
+        .filter(id__in=revision_ids.keys()) \
+        .filter(is_indexable=True) \
+        .select_related(
+            'category__organisation',
+            'category__category_template__metadata_model')
+
+    documents_by_category = defaultdict(list)
+    for document in documents:
+        documents_by_category[document.category].append(document)
+
+    for category, documents in documents_by_category.items():
+        indexer = CategoryIndexer(category, documents, revision_ids)
+        stats.update(indexer.run())
+
+        # Subscriptions are a best effort, the index must not be updated
+        # again because of them
+        try:
+            notify_subscribers(category, indexer.latest_json.values())
+        except ElasticsearchException:
+            logger.exception('Cannot percolate revisions of {}'.format(
+                category))
+
+    document_types = [category.document_type()
+                      for category in documents_by_category.keys()]
+    return stats, document_types
+
+
+class CategoryIndexer(object):
+    """Send index updates for a bunch of documents from a single category."""
+
+    def __init__(self, category, documents, revision_ids):
+        self.category = category
+        self.documents = dict((document.id, document) for document in documents)
+        self.doc_type = category.document_type()
+        self.index = get_index_alias(self.doc_type)
+        self.Revision = category.revision_class()
+
+        # For each document, the list of (revision id, es id), sorted by
+        # revision number
+        revisions = self.Revision.objects \
+            .filter(document_id__in=self.documents.keys()) \
+            .order_by('revision') \
+            .values_list('id', 'document_id', 'revision')
+        self.revisions = defaultdict(list)
+        for revision_id, document_id, revision in revisions:
+            document = self.documents[document_id]
+            es_id = '{}_{:02d}'.format(document.document_key, revision)
+            self.revisions[document_id].append((revision_id, es_id))
+
+        # Modified revisions and latest revisions are entirely reindexed
+        self.modified = {}
+        self.unmodified = {}
+        self.latest_ids = set()
+        for document_id, revisions in self.revisions.items():
+            modified_ids = revision_ids.get(document_id, set())
+            latest_id = revisions[-1][0]
+            self.latest_ids.add(latest_id)
+            self.modified[document_id] = [
+                revision for revision in revisions
+                if revision[0] in modified_ids or revision[0] == latest_id]
+            self.unmodified[document_id] = [
+                revision for revision in revisions
+                if revision not in self.modified[document_id]]
+
+    def run(self):
+        self.stats = Counter(documents=len(self.documents))
+        self.references = self.get_references()
+        self.latest_json = {}
+
+        # Unmodified revisions that cannot be found in the index must be
+        # entirely reindexed
+        for document_id, reference in self.references.items():
+            if reference is None:
+                self.modified[document_id] += self.unmodified.pop(document_id)
+                del self.references[document_id]
+
+        errors = self.bulk(self.get_actions())
+
+        # Partial updates fail if the revision is missing from the index. In
+        # this case, the revision must be entirely reindexed.
+        missing_ids = [
+            error['update']['_id'] for error in errors
+            if error.get('update', {}).get('status') == 404]
+        if len(missing_ids) < len(errors):
+            raise BulkIndexError(
+                '{} revision(s) failed to index.'.format(len(errors)), errors)
+
+        if missing_ids:
+            revision_ids = [
+                revision_id
+                for revisions in self.unmodified.values()
+                for revision_id, es_id in revisions if es_id in missing_ids]
+            self.stats['updated'] -= len(revision_ids)
+            errors = self.bulk(self.get_index_actions(revision_ids))
+            if errors:
+                raise BulkIndexError(
+                    '{} revision(s) failed to index.'.format(len(errors)),
+                    errors)
+
+        return self.stats
+
+    def bulk(self, actions):
+        nb_written, errors = bulk(
+            elastic,
+            actions,
+            raise_on_error=False,
+            chunk_size=settings.ELASTIC_BULK_SIZE,
+            request_timeout=60)
+        return errors
+
+    def get_references(self):
+        """Fetch the indexed data of an unmodified revision per document.
+
+        It will be compared to the up to date data to check if the document
+        level fields were modified.
+
+        """
+        es_ids = dict(
+            (revisions[-1][1], document_id)
+            for document_id, revisions in self.unmodified.items()
+            if revisions)
+        if not es_ids:
+            return {}
+
+        response = elastic.mget(
+            index=self.index,
+            doc_type=self.doc_type,
+            body={'ids': es_ids.keys()})
+        references = {}
+        for doc in response['docs']:
+            document_id = es_ids[doc['_id']]
+            references[document_id] = doc['_source'] if doc['found'] else None
+        return references
+
+    def get_actions(self):
+        revision_ids = [
+            revision_id
+            for revisions in self.modified.values()
+            for revision_id, es_id in revisions]
+        for action in self.get_index_actions(revision_ids):
+            yield action
+
+        for document_id, reference in self.references.items():
+            # The latest revision was deleted in the meantime
+            if document_id not in self.latest_json:
+                continue
+
+            fields = self.get_modified_fields(
+                self.latest_json[document_id], reference)
+            if not fields:
+                continue
+
+            for revision_id, es_id in self.unmodified[document_id]:
+                self.stats['updated'] += 1
+                yield {
+                    '_op_type': 'update',
+                    '_index': self.index,
+                    '_type': self.doc_type,
+                    '_id': es_id,
+                    'doc': fields,
+                }
+
+    def get_index_actions(self, revision_ids):
+        for revision, json in serialize_revisions(self.category, revision_ids):
+            self.stats['indexed'] += 1
+            if revision.id in self.latest_ids:
+                self.latest_json[revision.document_id] = json
+            yield {
+                '_index': self.index,
+                '_type': self.doc_type,
+                '_id': revision.unique_id,
+                '_source': json,
+            }
+
+    def get_modified_fields(self, json, reference):
+        """Compare document level fields with the indexed ones."""
+        fields = get_document_fields(self.Revision, json)
+
+        # Make sure values can be compared with the indexed data (e.g dates)
+        fields = serializer.loads(serializer.dumps(fields))
+        return dict((key, value) for key, value in fields.items()
+                    if reference.get(key) != value)
@@ -0,0 +1,267 @@
+# -*- coding: utf8 -*-
+
+from __future__ import unicode_literals
+
+import datetime
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.contrib.contenttypes.models import ContentType
+
+from accounts.factories import UserFactory
+from categories.factories import CategoryFactory
+from documents.factories import DocumentFactory
+from default_documents.factories import (
+    ContractorDeliverableFactory, ContractorDeliverableRevisionFactory)
+from default_documents.models import ContractorDeliverable
+from search.backends import get_backend
+from search.backends.db import DatabaseBackend
+from search.builder import SearchBuilder, GlobalSearchBuilder
+from search.models import IndexOperation, SearchEntry
+from search.tasks import flush_index_queue
+
+
+@override_settings(SEARCH_BACKEND='search.backends.db.DatabaseBackend')
+class DatabaseBackendTests(TestCase):
+    def setUp(self):
+        Model = ContentType.objects.get_for_model(ContractorDeliverable)
+        self.category = CategoryFactory(category_template__metadata_model=Model)
+        self.docs = [
+            self.create_document('Élévation générale', 'STD'),
+            self.create_document('Process flow diagram', 'CLD'),
+            self.create_document('Elevation drawing', None),
+        ]
+        for doc in self.docs:
+            IndexOperation.objects.queue_index(doc)
+        flush_index_queue()
+        self.backend = get_backend()
+
+    def create_document(self, title, status, **revision):
+        revision['status'] = status
+        return DocumentFactory(
+            category=self.category,
+            metadata_factory_class=ContractorDeliverableFactory,
+            revision_factory_class=ContractorDeliverableRevisionFactory,
+            metadata={'title': title},
+            revision=revision)
+
+    def index_due_dates(self, *due_dates):
+        for doc, due_date in zip(self.docs, due_dates):
+            revision = doc.get_latest_revision()
+            revision.review_due_date = due_date
+            revision.save()
+            IndexOperation.objects.queue_index(doc)
+        flush_index_queue()
+
+    def search(self, **filters):
+        filters.setdefault('show_cld_spd', True)
+        builder = SearchBuilder(self.category, filters)
+        results = self.backend.search(builder, with_aggregations=True)
+        return results
+
+    def get_keys(self, results):
+        return [doc['document_key'] for doc in results['data']]
+
+    def test_backend_setting(self):
+        self.assertIsInstance(self.backend, DatabaseBackend)
+
+    def test_documents_are_indexed(self):
+        self.assertEqual(SearchEntry.objects.count(), 3)
+        results = self.search()
+        self.assertEqual(results['total'], 3)
+        self.assertIsNone(results['cursor'])
+
+    def test_search_terms_ignore_case_and_accents(self):
+        results = self.search(search_terms='ELEVATION')
+        self.assertEqual(
+            sorted(self.get_keys(results)),
+            sorted([self.docs[0].document_key, self.docs[2].document_key]))
+
+    def test_search_terms_match_the_whole_phrase(self):
+        results = self.search(search_terms='elevation dra')
+        self.assertEqual(self.get_keys(results), [self.docs[2].document_key])
+
+        results = self.search(search_terms='drawing elevation')
+        self.assertEqual(results['total'], 0)
+
+    @override_settings(ELASTIC_ANALYSIS_PROFILE='edge_ngram')
+    def test_search_terms_match_every_word(self):
+        results = self.search(search_terms='drawing  elevation')
+        self.assertEqual(self.get_keys(results), [self.docs[2].document_key])
+
+        results = self.search(search_terms='elevation flow')
+        self.assertEqual(results['total'], 0)
+
+    def test_custom_filters(self):
+        results = self.search(show_cld_spd=False)
+        self.assertEqual(results['total'], 2)
+        self.assertNotIn(self.docs[1].document_key, self.get_keys(results))
+
+    def test_term_filter(self):
+        q = self.backend.get_filter_q({'term': {'status.raw': 'STD'}})
+        entries = SearchEntry.objects.filter(q)
+        self.assertEqual(
+            [entry.document_key for entry in entries],
+            [self.docs[0].document_key])
+
+    def test_missing_filter(self):
+        q = self.backend.get_filter_q({'missing': {'field': 'status.raw'}})
+        entries = SearchEntry.objects.filter(q)
+        self.assertEqual(
+            [entry.document_key for entry in entries],
+            [self.docs[2].document_key])
+
+    def test_unsupported_filter(self):
+        with self.assertRaises(ValueError):
+            self.backend.get_filter_q({'geo_distance': {}})
+
+    def test_sort_puts_missing_values_last(self):
+        results = self.search(sort_by='-status')
+        self.assertEqual(self.get_keys(results), [
+            self.docs[0].document_key,
+            self.docs[1].document_key,
+            self.docs[2].document_key])
+
+    def test_pagination(self):
+        results = self.search(sort_by='title', start=1, size=1)
+        self.assertEqual(results['total'], 3)
+        self.assertEqual(self.get_keys(results), [self.docs[1].document_key])
+
+    def test_aggregations(self):
+        results = self.search()
+        self.assertEqual(results['aggregations']['status'], {
+            'STD': 1, 'CLD': 1})
+
+    @override_settings(SEARCH_FACET_SIZE=1)
+    def test_aggregations_are_bounded(self):
+        results = self.search()
+        self.assertEqual(len(results['aggregations']['status']), 1)
+
+    def test_date_range_filter(self):
+        self.index_due_dates(
+            datetime.date(2015, 9, 15),
+            datetime.date(2015, 10, 2),
+            datetime.date(2015, 10, 20))
+        results = self.search(
+            review_due_date_from='2015-10-01',
+            review_due_date_to='2015-10-10')
+        self.assertEqual(self.get_keys(results), [self.docs[1].document_key])
+
+        results = self.search(review_due_date_from='2015-10-01')
+        self.assertEqual(results['total'], 2)
+
+    def test_date_histogram(self):
+        self.index_due_dates(
+            datetime.date(2015, 9, 15),
+            datetime.date(2015, 10, 2),
+            datetime.date(2015, 10, 20))
+        results = self.search()
+        self.assertEqual(results['aggregations']['review_due_date'], {
+            '2015-09-01': 1, '2015-10-01': 2})
+
+    def test_prefix_filter(self):
+        q = self.backend.get_filter_q({'prefix': {'status.raw': 'ST'}})
+        entries = SearchEntry.objects.filter(q)
+        self.assertEqual(
+            [entry.document_key for entry in entries],
+            [self.docs[0].document_key])
+
+    def test_facet_values(self):
+        builder = SearchBuilder(self.category, {'show_cld_spd': True})
+        self.assertEqual(
+            self.backend.facet_values(builder, 'status', 'C'), {'CLD': 1})
+        self.assertEqual(self.backend.facet_values(builder, 'status', 'X'), {})
+
+    def test_foreign_key_facet_values(self):
+        leader = UserFactory(name='Zoe Leader', category=self.category)
+        doc = self.create_document('Leader doc', 'STD')
+        revision = doc.get_latest_revision()
+        revision.leader = leader
+        revision.save()
+        IndexOperation.objects.queue_index(doc)
+        flush_index_queue()
+
+        builder = SearchBuilder(self.category)
+        self.assertEqual(
+            self.backend.facet_values(builder, 'leader', 'Zoe'),
+            {leader.pk: 1})
+
+    def test_unknown_facet(self):
+        builder = SearchBuilder(self.category)
+        with self.assertRaises(ValueError):
+            self.backend.facet_values(builder, 'title', 'E')
+
+    def test_global_search(self):
+        other_category = CategoryFactory(
+            category_template__metadata_model=self.category.category_template
+            .metadata_model)
+        doc = DocumentFactory(
+            category=other_category,
+            metadata_factory_class=ContractorDeliverableFactory,
+            revision_factory_class=ContractorDeliverableRevisionFactory,
+            metadata={'title': 'Elevation view'})
+        IndexOperation.objects.queue_index(doc)
+        flush_index_queue()
+
+        builder = GlobalSearchBuilder(
+            [self.category, other_category], 'elevation', size=1)
+        results = self.backend.global_search(builder)
+        self.assertEqual(results['total'], 3)
+        self.assertEqual(
+            [(category['document_type'], category['total'])
+             for category in results['categories']],
+            [(self.category.document_type(), 2),
+             (other_category.document_type(), 1)])
+        hits = results['categories'][0]['hits']
+        self.assertEqual(len(hits), 1)
+        self.assertEqual(
+            sorted(hits[0].keys()),
+            ['document_key', 'document_number', 'title', 'url'])
+
+    def test_global_search_matches_the_whole_phrase(self):
+        builder = GlobalSearchBuilder([self.category], 'générale élévation')
+        results = self.backend.global_search(builder)
+        self.assertEqual(results['total'], 0)
+
+    @override_settings(ELASTIC_ANALYSIS_PROFILE='edge_ngram')
+    def test_global_search_matches_every_word(self):
+        builder = GlobalSearchBuilder([self.category], 'générale élévation')
+        results = self.backend.global_search(builder)
+        self.assertEqual(results['total'], 1)
+        hits = results['categories'][0]['hits']
+        self.assertEqual(hits[0]['document_key'], self.docs[0].document_key)
+
+    def test_source_fields(self):
+        builder = SearchBuilder(self.category)
+        results = self.backend.search(builder, source_fields=['title'])
+        self.assertEqual(results['data'][0].keys(), ['title'])
+
+    def test_scan(self):
+        revision = ContractorDeliverableRevisionFactory(
+            document=self.docs[0], revision=2)
+        IndexOperation.objects.queue_index(
+            self.docs[0], revision_ids=[revision.pk])
+        flush_index_queue()
+
+        builder = SearchBuilder(self.category, {'show_cld_spd': True})
+        pks = [doc['pk'] for doc in self.backend.scan(
+            builder, ['pk'], only_latest_revisions=False)]
+        self.assertEqual(len(pks), 4)
+        self.assertIn(revision.pk, pks)
+
+    def test_count(self):
+        revision = ContractorDeliverableRevisionFactory(
+            document=self.docs[0], revision=2)
+        IndexOperation.objects.queue_index(
+            self.docs[0], revision_ids=[revision.pk])
+        flush_index_queue()
+
+        builder = SearchBuilder(self.category, {'show_cld_spd': True})
+        self.assertEqual(self.backend.count(builder), 3)
+        self.assertEqual(
+            self.backend.count(builder, only_latest_revisions=False), 4)
+
+    def test_unindex(self):
+        IndexOperation.objects.queue_unindex(self.docs[0])
+        flush_index_queue()
+        self.assertEqual(self.search()['total'], 2)
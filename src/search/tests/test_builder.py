@@ -0,0 +1,188 @@
+# -*- coding: utf8 -*-
+
+from __future__ import unicode_literals
+
+import json
+
+from django.test import TestCase
+
+from mock import MagicMock
+
+from django.contrib.contenttypes.models import ContentType
+
+from categories.factories import CategoryFactory
+from default_documents.models import ContractorDeliverable
+from search.builder import (
+    SearchBuilder, GlobalSearchBuilder, encode_cursor, decode_cursor)
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        self.category = CategoryFactory()
+
+    def get_body(self, **filters):
+        builder = SearchBuilder(self.category, filters)
+        return builder.build_query().to_dict()
+
+    def get_cursor_filter(self, body):
+        filters = body['query']['filtered']['filter']['bool']['must']
+        return filters[-1]
+
+    def test_cursor_encoding(self):
+        cursor = encode_cursor(['Title', 'KEY-001'])
+        self.assertEqual(decode_cursor(cursor), ['Title', 'KEY-001'])
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(RuntimeError):
+            SearchBuilder(self.category, {'cursor': 'invalid'})
+
+        with self.assertRaises(RuntimeError):
+            SearchBuilder(self.category, {'cursor': encode_cursor('test')})
+
+    def test_tiebreaker_sort(self):
+        body = self.get_body(sort_by='title')
+        self.assertEqual(body['sort'][1], {
+            'document_key.raw': {'order': 'asc'}})
+
+    def test_start_pagination(self):
+        body = self.get_body(start=50, size=25)
+        self.assertEqual(body['from'], 50)
+        self.assertEqual(body['size'], 25)
+
+    def test_cursor_pagination(self):
+        cursor = encode_cursor(['Title', 'KEY-001'])
+        body = self.get_body(start=50, size=25, cursor=cursor, sort_by='title')
+        self.assertEqual(body['from'], 0)
+        self.assertEqual(body['size'], 25)
+        self.assertEqual(self.get_cursor_filter(body), {'or': {'filters': [
+            {'range': {'title.raw': {'gt': 'Title'}}},
+            {'and': {'filters': [
+                {'term': {'title.raw': 'Title'}},
+                {'range': {'document_key.raw': {'gt': 'KEY-001'}}},
+            ]}},
+            {'missing': {'field': 'title.raw'}},
+        ]}})
+
+    def test_descending_cursor_pagination(self):
+        cursor = encode_cursor(['Title', 'KEY-001'])
+        body = self.get_body(cursor=cursor, sort_by='-title')
+        cursor_filter = self.get_cursor_filter(body)
+        self.assertEqual(cursor_filter['or']['filters'][0], {
+            'range': {'title.raw': {'lt': 'Title'}}})
+
+    def test_count_query_ignores_the_cursor(self):
+        cursor = encode_cursor(['Title', 'KEY-001'])
+        builder = SearchBuilder(
+            self.category, {'cursor': cursor, 'sort_by': 'title'})
+        body = builder.build_query(paginate=False).to_dict()
+        self.assertNotIn('from', body)
+        self.assertNotIn('size', body)
+        self.assertNotIn('KEY-001', json.dumps(body))
+
+    def test_facets_query_ignores_the_cursor(self):
+        cursor = encode_cursor(['Title', 'KEY-001'])
+        builder = SearchBuilder(
+            self.category, {'cursor': cursor, 'sort_by': 'title'})
+        facets_body = builder.build_facets_query().to_dict()
+        values_body = builder.build_facet_values_query('status', 'S').to_dict()
+        self.assertNotIn('KEY-001', json.dumps(facets_body))
+        self.assertNotIn('KEY-001', json.dumps(values_body))
+
+    def test_cursor_with_missing_value(self):
+        cursor = encode_cursor([None, 'KEY-001'])
+        body = self.get_body(cursor=cursor, sort_by='title')
+        self.assertEqual(self.get_cursor_filter(body), {'and': {'filters': [
+            {'missing': {'field': 'title.raw'}},
+            {'range': {'document_key.raw': {'gt': 'KEY-001'}}},
+        ]}})
+
+    def test_get_cursor(self):
+        builder = SearchBuilder(self.category, {'size': 2})
+        hits = [MagicMock(), MagicMock()]
+        hits[-1].meta.sort = ['Title', 'KEY-001']
+        response = MagicMock(hits=hits)
+        self.assertEqual(
+            decode_cursor(builder.get_cursor(response)),
+            ['Title', 'KEY-001'])
+
+    def test_no_cursor_on_last_page(self):
+        builder = SearchBuilder(self.category, {'size': 2})
+        response = MagicMock(hits=[MagicMock()])
+        self.assertIsNone(builder.get_cursor(response))
+
+
+class SourceFieldsTests(TestCase):
+    def setUp(self):
+        self.category = CategoryFactory()
+        self.builder = SearchBuilder(self.category)
+
+    def test_list_fields(self):
+        fields = self.builder.list_fields
+        for field in ('document_key', 'document_pk', 'url'):
+            self.assertIn(field, fields)
+        for field in self.builder.column_fields:
+            self.assertIn(field, fields)
+
+    def test_source_is_not_limited_by_default(self):
+        body = self.builder.build_query().to_dict()
+        self.assertNotIn('_source', body)
+
+    def test_source_fields(self):
+        body = self.builder.build_query(
+            source_fields=['document_key', 'title']).to_dict()
+        self.assertEqual(body['_source'], {
+            'include': ['document_key', 'title']})
+
+
+class DateFilterTests(TestCase):
+    def setUp(self):
+        Model = ContentType.objects.get_for_model(ContractorDeliverable)
+        self.category = CategoryFactory(category_template__metadata_model=Model)
+
+    def get_body(self, **filters):
+        builder = SearchBuilder(self.category, filters)
+        return builder.build_facets_query().to_dict()
+
+    def test_date_range_filter(self):
+        body = self.get_body(
+            review_due_date_from='2015-10-01',
+            review_due_date_to='2015-10-31',
+            status_ifa_forecast_date_to='2015-12-31')
+        filters = body['query']['filtered']['filter']['bool']['must']
+        self.assertIn({'range': {'review_due_date': {
+            'gte': '2015-10-01', 'lte': '2015-10-31'}}}, filters)
+        self.assertIn({'range': {'status_ifa_forecast_date': {
+            'lte': '2015-12-31'}}}, filters)
+
+    def test_invalid_date(self):
+        with self.assertRaises(RuntimeError):
+            SearchBuilder(self.category, {'review_due_date_from': 'nope'})
+
+    def test_date_histogram(self):
+        body = self.get_body()
+        self.assertEqual(body['aggs']['review_due_date'], {
+            'date_histogram': {
+                'field': 'review_due_date',
+                'interval': 'month',
+                'format': 'yyyy-MM-dd',
+            }})
+
+
+class GlobalSearchBuilderTests(TestCase):
+    def setUp(self):
+        self.categories = [CategoryFactory(), CategoryFactory()]
+        self.builder = GlobalSearchBuilder(self.categories, 'pump', size=3)
+
+    def test_query_targets_all_categories(self):
+        s = self.builder.build_query()
+        self.assertEqual(
+            s._doc_type,
+            [category.document_type() for category in self.categories])
+
+    def test_hits_are_grouped_by_category(self):
+        body = self.builder.build_query().to_dict()
+        self.assertEqual(body['size'], 0)
+        aggregation = body['aggs']['categories']
+        self.assertEqual(aggregation['terms'], {'field': '_type', 'size': 2})
+        self.assertEqual(
+            aggregation['aggs']['top_hits']['top_hits']['size'], 3)
@@ -0,0 +1,127 @@
+# -*- coding: utf8 -*-
+
+from __future__ import unicode_literals
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.core.cache import cache
+
+from mock import Mock, patch
+
+from categories.factories import CategoryFactory
+from search.cache import (
+    SearchCache, normalize_filters, bump_generation, get_stats)
+
+
+class NormalizeFiltersTests(TestCase):
+    def test_keys_order_does_not_matter(self):
+        self.assertEqual(
+            normalize_filters({'a': 1, 'b': 2}),
+            normalize_filters({'b': 2, 'a': 1}))
+
+    def test_empty_values_are_ignored(self):
+        self.assertEqual(
+            normalize_filters({'a': 1, 'b': None, 'c': ''}),
+            normalize_filters({'a': 1}))
+
+    def test_models_are_replaced_by_pk(self):
+        category = CategoryFactory()
+        self.assertEqual(
+            normalize_filters({'category': category}),
+            normalize_filters({'category': category.pk}))
+
+
+@override_settings(SEARCH_CACHE_TIMEOUT=60)
+class SearchCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = CategoryFactory()
+        self.filters = {'search_terms': 'test', 'start': 0}
+        self.execute = Mock(return_value={'total': 1, 'data': []})
+
+    def test_cache_miss_then_hit(self):
+        search_cache = SearchCache(self.category)
+
+        results, hit = search_cache.get_or_execute(self.filters, self.execute)
+        self.assertFalse(hit)
+        self.assertEqual(results, {'total': 1, 'data': []})
+
+        results, hit = search_cache.get_or_execute(self.filters, self.execute)
+        self.assertTrue(hit)
+        self.assertEqual(results, {'total': 1, 'data': []})
+
+        self.assertEqual(self.execute.call_count, 1)
+        stats = get_stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_different_filters_are_cached_separately(self):
+        search_cache = SearchCache(self.category)
+        search_cache.get_or_execute(self.filters, self.execute)
+        search_cache.get_or_execute({'start': 50}, self.execute)
+        self.assertEqual(self.execute.call_count, 2)
+
+    def test_generation_bump_invalidates_results(self):
+        search_cache = SearchCache(self.category)
+        search_cache.get_or_execute(self.filters, self.execute)
+
+        bump_generation(self.category.document_type())
+        results, hit = search_cache.get_or_execute(self.filters, self.execute)
+        self.assertFalse(hit)
+        self.assertEqual(self.execute.call_count, 2)
+
+    def test_other_categories_are_not_invalidated(self):
+        search_cache = SearchCache(self.category)
+        search_cache.get_or_execute(self.filters, self.execute)
+
+        bump_generation(CategoryFactory().document_type())
+        results, hit = search_cache.get_or_execute(self.filters, self.execute)
+        self.assertTrue(hit)
+
+    def test_zero_timeout_disables_cache(self):
+        document_type = self.category.document_type()
+        with self.settings(SEARCH_CACHE_TIMEOUTS={document_type: 0}):
+            search_cache = SearchCache(self.category)
+            search_cache.get_or_execute(self.filters, self.execute)
+            results, hit = search_cache.get_or_execute(
+                self.filters, self.execute)
+
+        self.assertFalse(hit)
+        self.assertEqual(self.execute.call_count, 2)
+
+    def test_concurrent_requests_are_coalesced(self):
+        search_cache = SearchCache(self.category)
+        key = search_cache.get_key(self.filters)
+        cache.add('{}_lock'.format(key), 1)
+
+        # Another process computes the results while we wait
+        def get(cache_key, *args, **kwargs):
+            if cache_key == key and sleep_mock.called:
+                return {'total': 2, 'data': []}
+            return original_get(cache_key, *args, **kwargs)
+
+        original_get = cache.get
+        with patch('search.cache.time.sleep') as sleep_mock:
+            with patch.object(cache, 'get', side_effect=get):
+                results, hit = search_cache.get_or_execute(
+                    self.filters, self.execute)
+
+        self.assertTrue(hit)
+        self.assertEqual(results, {'total': 2, 'data': []})
+        self.assertFalse(self.execute.called)
+        self.assertEqual(get_stats()['coalesced'], 1)
+
+    def test_wait_timeout_executes_the_search(self):
+        search_cache = SearchCache(self.category)
+        key = search_cache.get_key(self.filters)
+        cache.add('{}_lock'.format(key), 1)
+
+        with patch('search.cache.time.sleep'):
+            results, hit = search_cache.get_or_execute(
+                self.filters, self.execute)
+
+        self.assertFalse(hit)
+        self.assertEqual(self.execute.call_count, 1)
+
+        # The lock belongs to the other process
+        self.assertIsNotNone(cache.get('{}_lock'.format(key)))
@@ -0,0 +1,213 @@
+# -*- coding: utf8 -*-
+
+from __future__ import unicode_literals
+
+import os
+import datetime
+from StringIO import StringIO
+
+from django.test import TestCase
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils import timezone
+from django.conf import settings
+
+from mock import patch
+
+from accounts.factories import UserFactory
+from bookmarks.factories import BookmarkFactory
+from categories.factories import CategoryFactory
+from documents.factories import DocumentFactory
+from documents.models import Document
+from search import elastic
+from search.management.commands import reindex_all
+from search.percolator import PERCOLATOR_TYPE, get_percolator_id
+from search.utils import get_aliased_indexes
+
+
+class ReindexAllTests(TestCase):
+    def setUp(self):
+        self.category = CategoryFactory()
+        call_command('delete_index')
+        call_command('create_index')
+        call_command('set_mappings')
+        self.old_indexes = get_aliased_indexes(settings.ELASTIC_INDEX)
+
+        for i in range(5):
+            DocumentFactory(category=self.category)
+
+    def tearDown(self):
+        call_command('delete_index')
+
+    def test_reindex_switches_alias(self):
+        call_command('reindex_all', workers=1)
+
+        indexes = get_aliased_indexes(settings.ELASTIC_INDEX)
+        self.assertEqual(len(indexes), 1)
+        self.assertNotEqual(indexes, self.old_indexes)
+        self.assertFalse(elastic.indices.exists(index=self.old_indexes[0]))
+
+        count = elastic.count(
+            index=settings.ELASTIC_INDEX,
+            doc_type=self.category.document_type())['count']
+        self.assertEqual(count, 5)
+
+    def test_reindex_can_keep_old_index(self):
+        call_command('reindex_all', workers=1, keep_old=True)
+        self.assertTrue(elastic.indices.exists(index=self.old_indexes[0]))
+        elastic.indices.delete(index=self.old_indexes[0])
+
+    def test_checkpoint_is_removed(self):
+        call_command('reindex_all', workers=1)
+        self.assertFalse(os.path.exists(settings.ELASTIC_REINDEX_CHECKPOINT))
+
+    def test_deletions_are_caught_up(self):
+        deleted = Document.objects.all()[0]
+        original_index_chunk = reindex_all.index_chunk
+
+        def index_chunk(chunk):
+            result = original_index_chunk(chunk)
+            deleted.delete()
+            return result
+
+        with patch.object(reindex_all, 'index_chunk', index_chunk):
+            call_command('reindex_all', workers=1)
+
+        count = elastic.count(
+            index=settings.ELASTIC_INDEX,
+            doc_type=self.category.document_type())['count']
+        self.assertEqual(count, 4)
+
+    def test_deletions_during_alias_switch_are_caught_up(self):
+        deleted = Document.objects.all()[0]
+        original_switch_alias = reindex_all.switch_alias
+
+        def switch_alias(alias, index):
+            if Document.objects.filter(pk=deleted.pk).exists():
+                deleted.delete()
+            return original_switch_alias(alias, index)
+
+        with patch.object(reindex_all, 'switch_alias', switch_alias):
+            call_command('reindex_all', workers=1)
+
+        count = elastic.count(
+            index=settings.ELASTIC_INDEX,
+            doc_type=self.category.document_type())['count']
+        self.assertEqual(count, 4)
+
+    def test_subscriptions_made_during_reindex_are_copied(self):
+        original_index_chunk = reindex_all.index_chunk
+        bookmarks = []
+
+        def index_chunk(chunk):
+            bookmarks.append(BookmarkFactory(
+                user=UserFactory(category=self.category),
+                category=self.category,
+                url='/org/cat/?status=STD',
+                subscribed=True))
+            return original_index_chunk(chunk)
+
+        with patch.object(reindex_all, 'index_chunk', index_chunk):
+            call_command('reindex_all', workers=1)
+
+        self.assertTrue(elastic.exists(
+            index=settings.ELASTIC_INDEX,
+            doc_type=PERCOLATOR_TYPE,
+            id=get_percolator_id(bookmarks[0].pk)))
+
+
+class ReindexTests(TestCase):
+    def setUp(self):
+        self.category = CategoryFactory()
+        self.other_category = CategoryFactory()
+        self.docs = [DocumentFactory(category=self.category) for i in range(3)]
+        self.other_doc = DocumentFactory(category=self.other_category)
+        self.actions = []
+
+        patcher = patch(
+            'search.management.commands.reindex.bulk',
+            side_effect=self.bulk)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = patch('search.management.commands.reindex.elastic')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def bulk(self, client, actions, **kwargs):
+        actions = list(actions)
+        self.actions += actions
+        return len(actions), []
+
+    def reindex(self, **options):
+        call_command('reindex', stdout=StringIO(), **options)
+        return sorted(action['_id'] for action in self.actions)
+
+    def test_reindex_everything(self):
+        ids = self.reindex()
+        self.assertEqual(len(ids), 4)
+
+    def test_reindex_category(self):
+        slug = '{}/{}'.format(
+            self.category.organisation.slug, self.category.slug)
+        ids = self.reindex(categories=[slug])
+        self.assertEqual(ids, sorted(
+            doc.latest_revision.unique_id for doc in self.docs))
+
+    def test_reindex_document_keys(self):
+        keys = '{},{}'.format(
+            self.docs[0].document_key, self.other_doc.document_key)
+        ids = self.reindex(document_keys=[keys])
+        self.assertEqual(ids, sorted([
+            self.docs[0].latest_revision.unique_id,
+            self.other_doc.latest_revision.unique_id]))
+
+    def test_reindex_since(self):
+        Document.objects \
+            .filter(pk=self.docs[0].pk) \
+            .update(updated_on=timezone.now() + datetime.timedelta(days=2))
+        since = (timezone.now() + datetime.timedelta(days=1)).isoformat()
+        ids = self.reindex(since=since)
+        self.assertEqual(ids, [self.docs[0].latest_revision.unique_id])
+
+    def test_invalid_options(self):
+        with self.assertRaises(CommandError):
+            self.reindex(categories=['unknown/category'])
+
+        with self.assertRaises(CommandError):
+            self.reindex(since='yesterday')
+
+
+class AuditMappingsTests(TestCase):
+    def setUp(self):
+        self.category = CategoryFactory()
+        doc_type = self.category.document_type()
+
+        patcher = patch('search.management.commands.audit_mappings.elastic')
+        elastic_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+        elastic_mock.indices.get_mapping.return_value = {
+            'documents_20150101120000': {'mappings': {doc_type: {
+                'properties': {
+                    'pk': {'type': 'long'},
+                    'title': {
+                        'type': 'string',
+                        'fields': {'raw': {
+                            'type': 'string',
+                            'index': 'not_analyzed',
+                            'doc_values': True,
+                        }},
+                    },
+                },
+            }}}
+        }
+
+    def test_fielddata_fields_are_reported(self):
+        stdout = StringIO()
+        slug = '{}/{}'.format(
+            self.category.organisation.slug, self.category.slug)
+        call_command('audit_mappings', slug, stdout=stdout)
+        self.assertEqual(stdout.getvalue().splitlines(), [
+            '{}: pk'.format(self.category.document_type()),
+            '1 field(s) rely on fielddata',
+        ])
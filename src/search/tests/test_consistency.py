@@ -0,0 +1,174 @@
+# -*- coding: utf8 -*-
+
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+from django.test import TestCase
+from django.contrib.contenttypes.models import ContentType
+from django.utils.dateparse import parse_datetime
+
+from mock import patch
+from elasticsearch.serializer import JSONSerializer
+
+from categories.factories import CategoryFactory
+from documents.factories import DocumentFactory
+from default_documents.factories import (
+    ContractorDeliverableFactory, ContractorDeliverableRevisionFactory)
+from default_documents.models import ContractorDeliverable
+from search.consistency import ConsistencyChecker, to_timestamp
+
+
+serializer = JSONSerializer()
+
+
+class ConsistencyCheckerTests(TestCase):
+    def setUp(self):
+        Model = ContentType.objects.get_for_model(ContractorDeliverable)
+        self.category = CategoryFactory(category_template__metadata_model=Model)
+        self.docs = [
+            DocumentFactory(
+                category=self.category,
+                metadata_factory_class=ContractorDeliverableFactory,
+                revision_factory_class=ContractorDeliverableRevisionFactory)
+            for i in range(3)]
+
+        metadata = self.docs[0].metadata
+        metadata.latest_revision = ContractorDeliverableRevisionFactory(
+            document=self.docs[0],
+            revision=2,
+            received_date=self.docs[0].current_revision_date)
+        metadata.save()
+
+        # Simulate a perfectly indexed category
+        self.index = {}
+        for doc in self.docs:
+            for revision in doc.get_all_revisions():
+                self.index[revision.unique_id] = serializer.loads(
+                    serializer.dumps(revision.to_json()))
+
+        self.checker = ConsistencyChecker(self.category, bucket_size=2)
+
+        patcher = patch('search.consistency.elastic')
+        self.elastic_mock = patcher.start()
+        self.elastic_mock.search.side_effect = self.search
+        self.addCleanup(patcher.stop)
+
+        patcher = patch('search.consistency.scan', side_effect=self.scan)
+        self.scan_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def search(self, index, doc_type, body):
+        interval = body['aggs']['buckets']['histogram']['interval']
+        buckets = defaultdict(lambda: {
+            'doc_count': 0,
+            'pk_sum': {'value': 0},
+            'updated_sum': {'value': 0},
+            'latest': {'doc_count': 0},
+        })
+        for source in self.index.values():
+            key = source['pk'] // interval * interval
+            bucket = buckets[key]
+            bucket['key'] = key
+            bucket['doc_count'] += 1
+            bucket['pk_sum']['value'] += float(source['pk'])
+            bucket['updated_sum']['value'] += float(to_timestamp(
+                parse_datetime(source['updated_on'])))
+            bucket['latest']['doc_count'] += int(source['is_latest_revision'])
+        return {'aggregations': {'buckets': {'buckets': buckets.values()}}}
+
+    def scan(self, client, index, doc_type, query):
+        pk_range = query['query']['filtered']['filter']['range']['pk']
+        for es_id, source in self.index.items():
+            if pk_range['gte'] <= source['pk'] < pk_range['lt']:
+                yield {'_id': es_id, '_source': source}
+
+    def test_consistent_index(self):
+        report = self.checker.check()
+        self.assertTrue(report.is_consistent())
+        self.assertEqual(report.diverging_buckets, [])
+        self.assertFalse(self.scan_mock.called)
+
+    def test_missing_revision(self):
+        revision = self.docs[1].latest_revision
+        del self.index[revision.unique_id]
+
+        report = self.checker.check()
+        self.assertEqual(report.to_index, [revision.pk])
+        self.assertEqual(report.to_delete, [])
+        self.assertEqual(len(report.diverging_buckets), 1)
+
+    def test_db_checksums(self):
+        revisions = list(self.checker.iter_db_revisions())
+        revision = self.docs[1].latest_revision
+        revision.__class__.objects \
+            .filter(pk=revision.pk) \
+            .update(updated_on=parse_datetime('2015-06-01T12:30:45.999999Z'))
+
+        checksums = defaultdict(lambda: [0, 0, 0, 0])
+        for es_id, (pk, updated_on, is_latest) in \
+                self.checker.iter_db_revisions():
+            checksum = checksums[self.checker.get_bucket(pk)]
+            for i, value in enumerate((1, pk, updated_on, int(is_latest))):
+                checksum[i] += value
+
+        db_checksums = self.checker.get_db_checksums()
+        self.assertEqual(len(db_checksums), len(checksums))
+        for bucket, checksum in checksums.items():
+            self.assertEqual(tuple(db_checksums[bucket]), tuple(checksum))
+        self.assertEqual(
+            sum(checksum.count for checksum in db_checksums.values()),
+            len(revisions))
+
+    def test_outdated_revision(self):
+        revision = self.docs[1].latest_revision
+        self.index[revision.unique_id]['updated_on'] = '2015-01-01T00:00:00Z'
+
+        report = self.checker.check()
+        self.assertEqual(report.to_index, [revision.pk])
+
+    def test_wrong_latest_revision(self):
+        first_revision = self.docs[0].get_all_revisions().get(revision=1)
+        self.index[first_revision.unique_id]['is_latest_revision'] = True
+
+        report = self.checker.check()
+        self.assertEqual(report.to_index, [first_revision.pk])
+
+    def test_deleted_revision(self):
+        revision = self.docs[2].latest_revision
+        revision.delete()
+
+        report = self.checker.check()
+        self.assertEqual(report.to_index, [])
+        self.assertEqual(report.to_delete, [revision.unique_id])
+
+    def test_repair(self):
+        missing = self.docs[1].latest_revision
+        del self.index[missing.unique_id]
+        deleted = self.docs[2].latest_revision
+        deleted.delete()
+
+        report = self.checker.check()
+        with patch('search.consistency.bulk_actions') as bulk_mock:
+            self.checker.repair(report)
+
+        actions = bulk_mock.call_args[0][0]
+        self.assertEqual(len(actions), 2)
+        self.assertEqual(actions[0]['_id'], missing.unique_id)
+        self.assertEqual(actions[1]['_op_type'], 'delete')
+        self.assertEqual(actions[1]['_id'], deleted.unique_id)
+
+    def test_repair_another_index(self):
+        checker = ConsistencyChecker(
+            self.category, bucket_size=2, index='documents_new')
+        missing = self.docs[1].latest_revision
+        del self.index[missing.unique_id]
+
+        report = checker.check()
+        with patch('search.consistency.bulk_actions') as bulk_mock:
+            checker.repair(report)
+
+        actions = bulk_mock.call_args[0][0]
+        self.assertEqual(actions[0]['_index'], 'documents_new')
+        self.assertEqual(
+            self.elastic_mock.search.call_args[1]['index'], 'documents_new')
@@ -0,0 +1,128 @@
+# -*- coding: utf8 -*-
+
+from __future__ import unicode_literals
+
+from django.test import TestCase
+
+from mock import patch
+
+from accounts.factories import UserFactory
+from bookmarks.factories import BookmarkFactory
+from categories.factories import CategoryFactory
+from documents.factories import DocumentFactory
+from notifications.models import Notification
+from search.models import IndexOperation
+from search.percolator import (
+    get_bookmark_filters, build_percolator_query, register_subscription,
+    notify_subscribers, PERCOLATOR_TYPE)
+from search.tasks import flush_index_queue
+
+
+class SubscriptionTests(TestCase):
+    def setUp(self):
+        self.category = CategoryFactory()
+        self.user = UserFactory(category=self.category)
+        self.bookmark = BookmarkFactory(
+            user=self.user,
+            category=self.category,
+            url='/org/cat/?status=STD&sort_by=title&size=50',
+            subscribed=True)
+        self.doc = DocumentFactory(category=self.category)
+
+        patcher = patch('search.percolator.elastic')
+        self.elastic_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def percolate_response(self, *matches):
+        return {'responses': [
+            {'total': len(ids), 'matches': [
+                {'_index': 'test_documents', '_id': 'bookmark_{}'.format(id)}
+                for id in ids]}
+            for ids in matches]}
+
+    def test_bookmark_filters(self):
+        self.assertEqual(
+            get_bookmark_filters(self.bookmark).dict(), {'status': 'STD'})
+
+    def test_bookmark_filters_with_several_values(self):
+        self.bookmark.url = '/org/cat/?status=STD&status=CLD&start=50'
+        filters = get_bookmark_filters(self.bookmark)
+        self.assertEqual(filters.getlist('status'), ['STD', 'CLD'])
+        self.assertNotIn('start', filters)
+
+    def test_percolator_query(self):
+        query = build_percolator_query(self.bookmark)
+        filters = query['filtered']['filter']['bool']['must']
+        self.assertIn({'term': {'is_latest_revision': True}}, filters)
+        self.assertIn({'term': {'status.raw': 'STD'}}, filters)
+
+    def test_register_subscription(self):
+        register_subscription(self.bookmark.pk)
+        kwargs = self.elastic_mock.index.call_args[1]
+        self.assertEqual(kwargs['doc_type'], PERCOLATOR_TYPE)
+        self.assertEqual(kwargs['id'], 'bookmark_{}'.format(self.bookmark.pk))
+        self.assertEqual(kwargs['body']['category_id'], self.category.pk)
+
+    def test_matching_subscriptions_are_notified(self):
+        self.elastic_mock.mpercolate.return_value = self.percolate_response(
+            [self.bookmark.pk], [])
+        sources = [
+            {'url': '/doc1/', 'document_key': 'DOC-1'},
+            {'url': '/doc2/', 'document_key': 'DOC-2'},
+        ]
+        notify_subscribers(self.category, sources)
+
+        notification = Notification.objects.get()
+        self.assertEqual(notification.user, self.user)
+        self.assertIn('DOC-1', notification.body)
+        self.assertNotIn('DOC-2', notification.body)
+
+    def test_notifications_are_escaped(self):
+        self.bookmark.name = '<script>alert("name")</script>'
+        self.bookmark.save()
+        self.elastic_mock.mpercolate.return_value = self.percolate_response(
+            [self.bookmark.pk])
+        notify_subscribers(self.category, [
+            {'url': '/doc1/?a=1&b=2', 'document_key': '<b>DOC-1</b>'}])
+
+        body = Notification.objects.get().body
+        self.assertNotIn('<script>', body)
+        self.assertNotIn('<b>', body)
+        self.assertIn('&lt;script&gt;', body)
+        self.assertIn('href="/doc1/?a=1&amp;b=2"', body)
+        self.assertIn('<ul><li><a href=', body)
+
+    def test_unsubscribed_bookmarks_are_ignored(self):
+        self.bookmark.subscribed = False
+        self.bookmark.save()
+        notify_subscribers(self.category, [{'url': '/', 'document_key': 'K'}])
+
+        self.assertFalse(self.elastic_mock.mpercolate.called)
+        self.assertEqual(Notification.objects.count(), 0)
+
+    def test_percolation_is_batched(self):
+        self.elastic_mock.mpercolate.side_effect = lambda body: \
+            self.percolate_response(*([[]] * (len(body) / 2)))
+        sources = [{'url': '/', 'document_key': 'K'}] * 5
+        with self.settings(ELASTIC_BULK_SIZE=2):
+            notify_subscribers(self.category, sources)
+
+        self.assertEqual(self.elastic_mock.mpercolate.call_count, 3)
+
+    def test_indexed_revisions_are_percolated(self):
+        self.elastic_mock.mpercolate.return_value = self.percolate_response(
+            [self.bookmark.pk])
+        IndexOperation.objects.queue_index(self.doc)
+
+        def bulk(client, actions, **kwargs):
+            return len(list(actions)), []
+
+        with patch('search.tasks.elastic'):
+            with patch('search.tasks.bulk', side_effect=bulk):
+                flush_index_queue()
+
+        body = self.elastic_mock.mpercolate.call_args[1]['body']
+        self.assertEqual(body[0]['percolate']['type'], self.doc.document_type())
+        self.assertEqual(
+            body[1]['doc']['document_key'], self.doc.document_key)
+        self.assertEqual(Notification.objects.count(), 1)
@@ -2,6 +2,7 @@
 
 from __future__ import unicode_literals
 
+from django.db import transaction
 from django.test import TestCase
 from django.core.management import call_command
 from django.test.utils import override_settings
@@ -9,9 +10,17 @@ from django.test.utils import override_settings
 from mock import patch
 
 from accounts.factories import UserFactory
+from bookmarks.factories import BookmarkFactory
 from categories.factories import CategoryFactory
 from documents.factories import DocumentFactory
-from search.signals import connect_signals
+from search.models import IndexOperation
+from search.signals import (
+    connect_signals, disconnect_signals, schedule_index_queue,
+    update_revision_index)
+
+
+def run_now(func):
+    func()
 
 
 @override_settings(ELASTIC_AUTOINDEX=True)
@@ -29,6 +38,13 @@ class SignalTests(TestCase):
         # Since test settings disable auto indexing, we need to
         # manually connect the signal here
         connect_signals()
+        self.addCleanup(disconnect_signals)
+
+        # Test transactions are never committed
+        patcher = patch('search.signals.on_commit', side_effect=run_now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
         call_command('delete_index')
         call_command('create_index')
         call_command('set_mappings')
@@ -38,42 +54,153 @@ class SignalTests(TestCase):
         CategoryFactory()
         self.assertEqual(index_mock.call_count, 1)
 
-    @patch('search.signals.index_document')
-    def test_created_document_is_indexed(self, index_mock):
-        DocumentFactory(
+    @patch('search.signals.process_index_queue')
+    def test_created_document_is_queued(self, task_mock):
+        doc = DocumentFactory(
             category=self.category,
             document_key='FAC09001-FWF-000-HSE-REP-0004',
         )
-        self.assertEqual(index_mock.call_count, 1)
+        operation = IndexOperation.objects.get()
+        self.assertEqual(operation.document_id, doc.id)
+        self.assertEqual(operation.operation, 'index')
+        self.assertEqual(task_mock.apply_async.call_count, 1)
 
-    @patch('search.signals.index_document')
-    @patch('search.signals.unindex_document')
-    def test_deleted_document_is_unindexed(self, index_mock, unindex_mock):
+    @patch('search.signals.process_index_queue')
+    def test_deleted_document_is_unindexed(self, task_mock):
         doc = DocumentFactory(
             category=self.category,
             document_key='FAC09001-FWF-000-HSE-REP-0004',
         )
+        doc_id = doc.id
         doc.delete()
-        self.assertEqual(unindex_mock.call_count, 1)
 
-    @patch('search.signals.index_document')
-    def test_updated_document_is_indexed(self, index_mock):
+        operation = IndexOperation.objects.get()
+        self.assertEqual(operation.document_id, doc_id)
+        self.assertEqual(operation.operation, 'unindex')
+        self.assertEqual(operation.document_type, doc.document_type())
+        self.assertEqual(operation.es_ids, 'FAC09001-FWF-000-HSE-REP-0004_01')
+
+    @patch('search.signals.process_index_queue')
+    def test_updated_document_is_coalesced(self, task_mock):
         doc = DocumentFactory(
             category=self.category,
             document_key='FAC09001-FWF-000-HSE-REP-0004',
         )
         doc.title = 'foobar'
         doc.save()
-        self.assertEqual(index_mock.call_count, 2)
+        doc.save()
+        self.assertEqual(IndexOperation.objects.count(), 1)
+        self.assertEqual(task_mock.apply_async.call_count, 1)
 
-    @patch('search.signals.index_document')
-    def test_revised_document_is_indexed(self, index_mock):
+    @patch('search.signals.process_index_queue')
+    def test_revised_document_is_queued(self, task_mock):
         doc = DocumentFactory(
             category=self.category,
             document_key='FAC09001-FWF-000-HSE-REP-0004',
         )
+        IndexOperation.objects.all().delete()
+
         revision = doc.latest_revision
         revision.pk = None
         revision.save()
         doc.save()
-        self.assertEqual(index_mock.call_count, 2)
+        self.assertEqual(IndexOperation.objects.count(), 1)
+        self.assertEqual(task_mock.apply_async.call_count, 2)
+
+    @patch('search.signals.process_index_queue')
+    def test_new_revision_queues_previous_revision(self, task_mock):
+        doc = DocumentFactory(
+            category=self.category,
+            document_key='FAC09001-FWF-000-HSE-REP-0004',
+        )
+        previous_revision = doc.latest_revision
+        revision = doc.latest_revision
+        revision.pk = None
+        revision.revision = 2
+        revision.save()
+
+        operation = IndexOperation.objects.get()
+        self.assertEqual(
+            operation.get_revision_ids(),
+            set([previous_revision.id, revision.id]))
+
+
+class ScheduleIndexQueueTests(TestCase):
+    def get_commit_hooks(self):
+        connection = transaction.get_connection()
+        return [func for sids, func in connection.run_on_commit]
+
+    @patch('search.signals.process_index_queue')
+    def test_queue_is_processed_on_commit(self, task_mock):
+        schedule_index_queue(True)
+        self.assertFalse(task_mock.apply_async.called)
+
+        hooks = self.get_commit_hooks()
+        self.assertEqual(len(hooks), 1)
+        hooks[0]()
+        self.assertEqual(task_mock.apply_async.call_count, 1)
+
+    @patch('search.signals.process_index_queue')
+    def test_queue_is_already_scheduled(self, task_mock):
+        schedule_index_queue(False)
+        self.assertEqual(self.get_commit_hooks(), [])
+
+
+class RevisionSignalTests(TestCase):
+    @patch('search.signals.schedule_index_queue')
+    def test_other_models_are_ignored(self, schedule_mock):
+        document = DocumentFactory()
+        update_revision_index(
+            sender=type(document), instance=document, created=True)
+        self.assertFalse(schedule_mock.called)
+
+    @patch('search.signals.schedule_index_queue')
+    def test_revisions_are_queued(self, schedule_mock):
+        revision = DocumentFactory().get_latest_revision()
+        update_revision_index(
+            sender=type(revision), instance=revision, created=False)
+        self.assertEqual(schedule_mock.call_count, 1)
+
+
+class SubscriptionSignalTests(TestCase):
+    def setUp(self):
+        category = CategoryFactory()
+        self.bookmark = BookmarkFactory(
+            user=UserFactory(category=category),
+            category=category,
+            url='/org/cat/?status=STD',
+            subscribed=False)
+        connect_signals()
+        self.addCleanup(disconnect_signals)
+
+        patcher = patch('search.signals.get_backend')
+        backend_mock = patcher.start()
+        backend_mock.return_value.uses_elasticsearch = True
+        self.addCleanup(patcher.stop)
+
+        patcher = patch('search.signals.register_subscription')
+        self.register_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        patcher = patch('search.signals.unregister_subscription')
+        self.unregister_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_subscription_is_registered(self):
+        self.bookmark.subscribed = True
+        self.bookmark.save()
+        self.register_mock.delay.assert_called_once_with(self.bookmark.pk)
+        self.assertFalse(self.unregister_mock.delay.called)
+
+    def test_unsubscription_is_unregistered(self):
+        self.bookmark.subscribed = True
+        self.bookmark.save()
+        self.bookmark.subscribed = False
+        self.bookmark.save()
+        self.assertEqual(self.unregister_mock.delay.call_count, 1)
+
+    def test_unsubscribed_bookmark_is_not_unregistered(self):
+        self.bookmark.name = 'Renamed'
+        self.bookmark.save()
+        self.assertFalse(self.register_mock.delay.called)
+        self.assertFalse(self.unregister_mock.delay.called)
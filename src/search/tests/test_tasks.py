@@ -0,0 +1,208 @@
+# -*- coding: utf8 -*-
+
+from __future__ import unicode_literals
+
+import datetime
+
+from django.test import TestCase
+from django.utils import timezone
+from django.contrib.contenttypes.models import ContentType
+
+from mock import patch
+from elasticsearch.exceptions import ConnectionError
+
+from categories.factories import CategoryFactory
+from documents.factories import DocumentFactory
+from default_documents.factories import (
+    ContractorDeliverableFactory, ContractorDeliverableRevisionFactory)
+from default_documents.models import ContractorDeliverable
+from search.cache import get_generation
+from search.models import IndexOperation
+from search.tasks import flush_index_queue, serializer
+
+
+class FlushIndexQueueTests(TestCase):
+    def setUp(self):
+        self.category = CategoryFactory()
+        self.docs = [DocumentFactory(category=self.category) for i in range(3)]
+        self.actions = []
+
+        patcher = patch('search.tasks.elastic')
+        self.elastic_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def bulk(self, client, actions, **kwargs):
+        actions = list(actions)
+        self.actions += actions
+        return len(actions), []
+
+    def test_index_operations(self):
+        for doc in self.docs:
+            IndexOperation.objects.queue_index(doc)
+
+        with patch('search.tasks.bulk', side_effect=self.bulk):
+            stats = flush_index_queue()
+
+        self.assertEqual(stats['operations'], 3)
+        self.assertEqual(stats['documents'], 3)
+        self.assertEqual(stats['indexed'], 3)
+        self.assertEqual(IndexOperation.objects.count(), 0)
+        self.assertEqual(
+            sorted(action['_id'] for action in self.actions),
+            sorted(doc.latest_revision.unique_id for doc in self.docs))
+
+    def test_cached_results_are_invalidated(self):
+        document_type = self.category.document_type()
+        generation = get_generation(document_type)
+        IndexOperation.objects.queue_index(self.docs[0])
+
+        with patch('search.tasks.bulk', side_effect=self.bulk):
+            flush_index_queue()
+
+        self.assertTrue(self.elastic_mock.indices.refresh.called)
+        self.assertNotEqual(get_generation(document_type), generation)
+
+    def test_unindex_operations(self):
+        doc = self.docs[0]
+        IndexOperation.objects.queue_index(doc)
+        IndexOperation.objects.queue_unindex(doc)
+
+        with patch('search.tasks.bulk', side_effect=self.bulk):
+            flush_index_queue()
+
+        self.assertEqual(self.actions, [{
+            '_op_type': 'delete',
+            '_index': 'test_documents',
+            '_type': doc.document_type(),
+            '_id': doc.latest_revision.unique_id,
+        }])
+
+    def test_flush_some_documents(self):
+        for doc in self.docs:
+            IndexOperation.objects.queue_index(doc)
+
+        with patch('search.tasks.bulk', side_effect=self.bulk):
+            flush_index_queue(document_ids=[self.docs[0].id])
+
+        self.assertEqual(len(self.actions), 1)
+        self.assertEqual(IndexOperation.objects.count(), 2)
+
+    def test_failed_operations_stay_in_queue(self):
+        IndexOperation.objects.queue_index(self.docs[0])
+
+        with patch('search.tasks.bulk', side_effect=ConnectionError):
+            with self.assertRaises(ConnectionError):
+                flush_index_queue()
+
+        self.assertEqual(IndexOperation.objects.count(), 1)
+
+    def test_operations_updated_during_flush_stay_in_queue(self):
+        doc = self.docs[0]
+        IndexOperation.objects.queue_index(doc)
+
+        def bulk(*args, **kwargs):
+            IndexOperation.objects.queue_index(doc)
+            return self.bulk(*args, **kwargs)
+
+        with patch('search.tasks.bulk', side_effect=bulk):
+            flush_index_queue()
+
+        self.assertEqual(IndexOperation.objects.count(), 1)
+
+    def test_operations_stamped_before_flush_stay_in_queue(self):
+        """The update was stamped before the flush, but committed during."""
+        doc = self.docs[0]
+        IndexOperation.objects.queue_index(doc)
+        stamped_on = timezone.now() - datetime.timedelta(minutes=1)
+
+        def bulk(*args, **kwargs):
+            with patch('search.models.timezone.now', return_value=stamped_on):
+                IndexOperation.objects.queue_index(doc)
+            return self.bulk(*args, **kwargs)
+
+        with patch('search.tasks.bulk', side_effect=bulk):
+            flush_index_queue()
+
+        operation = IndexOperation.objects.get()
+        self.assertEqual(operation.version, 2)
+
+
+class PartialUpdateTests(TestCase):
+    def setUp(self):
+        Model = ContentType.objects.get_for_model(ContractorDeliverable)
+        self.category = CategoryFactory(category_template__metadata_model=Model)
+        self.doc = DocumentFactory(
+            category=self.category,
+            metadata_factory_class=ContractorDeliverableFactory,
+            revision_factory_class=ContractorDeliverableRevisionFactory)
+        metadata = self.doc.metadata
+        for revision in (2, 3):
+            metadata.latest_revision = ContractorDeliverableRevisionFactory(
+                document=self.doc,
+                revision=revision,
+                received_date=self.doc.current_revision_date)
+            metadata.save()
+
+        self.revisions = list(metadata.get_all_revisions().order_by('revision'))
+        self.actions = []
+
+        # The indexed data of the second revision
+        source = serializer.loads(serializer.dumps(self.revisions[1].to_json()))
+        self.mget_response = {'docs': [{
+            '_id': self.revisions[1].unique_id,
+            '_source': source,
+            'found': True,
+        }]}
+
+    def bulk(self, client, actions, **kwargs):
+        actions = list(actions)
+        self.actions += actions
+        return len(actions), []
+
+    def flush(self):
+        with patch('search.tasks.bulk', side_effect=self.bulk):
+            with patch('search.tasks.elastic') as elastic_mock:
+                elastic_mock.mget.return_value = self.mget_response
+                return flush_index_queue()
+
+    def test_only_latest_revision_is_indexed(self):
+        IndexOperation.objects.queue_index(self.doc)
+        stats = self.flush()
+
+        self.assertEqual(stats['indexed'], 1)
+        self.assertEqual(stats['updated'], 0)
+        self.assertEqual(len(self.actions), 1)
+        self.assertEqual(self.actions[0]['_id'], self.revisions[2].unique_id)
+
+    def test_modified_revisions_are_indexed(self):
+        IndexOperation.objects.queue_index(
+            self.doc, revision_ids=[self.revisions[0].id])
+        stats = self.flush()
+
+        self.assertEqual(stats['indexed'], 2)
+        self.assertEqual(
+            [action['_id'] for action in self.actions],
+            [self.revisions[0].unique_id, self.revisions[2].unique_id])
+
+    def test_document_fields_are_updated(self):
+        self.mget_response['docs'][0]['_source']['title'] = 'Old title'
+        IndexOperation.objects.queue_index(self.doc)
+        stats = self.flush()
+
+        self.assertEqual(stats['indexed'], 1)
+        self.assertEqual(stats['updated'], 2)
+        updates = self.actions[1:]
+        self.assertEqual(
+            [action['_id'] for action in updates],
+            [self.revisions[0].unique_id, self.revisions[1].unique_id])
+        for action in updates:
+            self.assertEqual(action['_op_type'], 'update')
+            self.assertEqual(action['doc'], {'title': self.doc.title})
+
+    def test_missing_revisions_are_indexed(self):
+        self.mget_response['docs'][0]['found'] = False
+        IndexOperation.objects.queue_index(self.doc)
+        stats = self.flush()
+
+        self.assertEqual(stats['indexed'], 3)
+        self.assertEqual(stats['updated'], 0)
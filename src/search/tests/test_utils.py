@@ -0,0 +1,219 @@
+# -*- coding: utf8 -*-
+
+from __future__ import unicode_literals
+
+import datetime
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.contrib.contenttypes.models import ContentType
+
+from mock import patch
+
+from accounts.factories import UserFactory
+from categories.factories import CategoryFactory, OrganisationFactory
+from categories.models import Category
+from documents.factories import DocumentFactory
+from default_documents.factories import (
+    ContractorDeliverableFactory, ContractorDeliverableRevisionFactory)
+from default_documents.models import (
+    ContractorDeliverable, ContractorDeliverableRevision)
+from search import ANALYSIS_PROFILES
+from search.utils import (
+    serialize_revisions, iter_index_data, get_mapping, get_index_settings,
+    get_index_profile, get_fielddata_fields, get_index_alias,
+    get_index_aliases, get_type_indexes, get_versioned_index_name)
+
+
+class SerializeRevisionsTests(TestCase):
+    def setUp(self):
+        Model = ContentType.objects.get_for_model(ContractorDeliverable)
+        category = CategoryFactory(category_template__metadata_model=Model)
+        self.category = Category.objects \
+            .select_related('organisation', 'category_template__metadata_model') \
+            .get(pk=category.pk)
+        self.user = UserFactory(category=category)
+
+        for i in range(10):
+            doc = DocumentFactory(
+                category=category,
+                metadata_factory_class=ContractorDeliverableFactory,
+                revision_factory_class=ContractorDeliverableRevisionFactory,
+                revision={'leader': self.user})
+            ContractorDeliverableRevisionFactory(
+                document=doc,
+                revision=2,
+                received_date=doc.current_revision_date,
+                leader=self.user)
+
+        self.revisions = ContractorDeliverableRevision.objects.order_by('pk')
+
+    def test_json_is_the_same_as_to_json(self):
+        expected = [revision.to_json() for revision in self.revisions]
+        serialized = list(serialize_revisions(self.category, self.revisions))
+        self.assertEqual([json for revision, json in serialized], expected)
+
+    def test_revision_ids_are_accepted(self):
+        ids = list(self.revisions.values_list('pk', flat=True))
+        serialized = serialize_revisions(self.category, ids)
+        self.assertEqual([revision.pk for revision, json in serialized], ids)
+
+    def test_query_count_does_not_depend_on_revisions(self):
+        ids = list(self.revisions.values_list('pk', flat=True))
+
+        with self.assertNumQueries(2):
+            list(serialize_revisions(self.category, ids[:1]))
+
+        with self.assertNumQueries(2):
+            list(serialize_revisions(self.category, ids))
+
+    def test_query_count_depends_on_batches(self):
+        ids = list(self.revisions.values_list('pk', flat=True))
+        with self.assertNumQueries(8):
+            list(serialize_revisions(self.category, ids, batch_size=5))
+
+    def test_index_data(self):
+        revision = self.revisions[0]
+        data = list(iter_index_data(self.category, [revision.pk], index='test'))
+        self.assertEqual(data, [{
+            '_index': 'test',
+            '_type': self.category.document_type(),
+            '_id': revision.unique_id,
+            '_source': revision.to_json(),
+        }])
+
+    @override_settings(ELASTIC_INDEX_LAYOUT='category')
+    def test_index_data_default_index(self):
+        revision = self.revisions[0]
+        data = list(iter_index_data(self.category, [revision.pk]))
+        self.assertEqual(
+            data[0]['_index'], get_index_alias(self.category.document_type()))
+
+
+@override_settings(ELASTIC_INDEX='documents')
+class IndexLayoutTests(TestCase):
+    def setUp(self):
+        organisation = OrganisationFactory(slug='org')
+        self.categories = [
+            CategoryFactory(
+                organisation=organisation,
+                category_template__slug='cat{}'.format(i))
+            for i in range(2)]
+
+    @override_settings(ELASTIC_INDEX_LAYOUT='shared')
+    def test_shared_layout(self):
+        self.assertEqual(get_index_alias('org.cat0'), 'documents')
+        self.assertEqual(get_index_aliases(), ['documents'])
+
+    @override_settings(ELASTIC_INDEX_LAYOUT='organisation')
+    def test_organisation_layout(self):
+        self.assertEqual(get_index_alias('org.cat0'), 'documents_org')
+        self.assertEqual(get_index_aliases(), ['documents_org'])
+
+    @override_settings(ELASTIC_INDEX_LAYOUT='category')
+    def test_category_layout(self):
+        self.assertEqual(get_index_alias('Org.Cat0'), 'documents_org_cat0')
+        self.assertEqual(
+            get_index_aliases(),
+            ['documents_org_cat0', 'documents_org_cat1'])
+        self.assertEqual(
+            get_index_aliases(self.categories[1:]), ['documents_org_cat1'])
+
+    @override_settings(ELASTIC_INDEX_LAYOUT='category')
+    def test_type_indexes(self):
+        self.assertEqual(
+            get_type_indexes(['org.cat1', 'org.cat0', 'org.cat1']),
+            'documents_org_cat0,documents_org_cat1')
+
+    @override_settings(ELASTIC_INDEX_LAYOUT='unknown')
+    def test_unknown_layout(self):
+        with self.assertRaises(ValueError):
+            get_index_alias('org.cat0')
+
+    @patch('search.utils.timezone.now')
+    def test_versioned_index_names_are_unique(self, now_mock):
+        now_mock.side_effect = [
+            datetime.datetime(2015, 1, 1, 12, 0, 0, 1),
+            datetime.datetime(2015, 1, 1, 12, 0, 0, 2),
+        ]
+        first = get_versioned_index_name('documents')
+        second = get_versioned_index_name('documents')
+        self.assertEqual(first, 'documents_20150101120000000001')
+        self.assertNotEqual(first, second)
+
+
+class AnalysisProfileTests(TestCase):
+    def test_profile_analyzers_are_defined(self):
+        for profile in ANALYSIS_PROFILES.values():
+            analyzers = profile['analysis']['analyzer']
+            self.assertIn(profile['index_analyzer'], analyzers)
+            self.assertIn(profile['search_analyzer'], analyzers)
+
+    @override_settings(ELASTIC_ANALYSIS_PROFILE='edge_ngram')
+    def test_default_profile(self):
+        index_settings = get_index_settings()
+        self.assertIn(
+            'edge_nGram_analyzer',
+            index_settings['settings']['analysis']['analyzer'])
+
+        mapping = get_mapping(ContractorDeliverable)
+        self.assertEqual(mapping['_all']['index_analyzer'], 'edge_nGram_analyzer')
+        self.assertEqual(mapping['_all']['search_analyzer'], 'word_analyzer')
+
+    def test_mapping_profile(self):
+        mapping = get_mapping(ContractorDeliverable, 'ngram')
+        self.assertEqual(mapping['_all']['index_analyzer'], 'nGram_analyzer')
+
+    @patch('search.utils.elastic')
+    def test_index_profile(self, elastic_mock):
+        elastic_mock.indices.get_settings.return_value = {
+            'documents_20150101120000': {'settings': {
+                'index.analysis.analyzer.edge_nGram_analyzer.type': 'custom',
+                'index.number_of_replicas': '1',
+            }}
+        }
+        self.assertEqual(get_index_profile(), 'edge_ngram')
+
+
+class MappingTests(TestCase):
+    def setUp(self):
+        self.properties = get_mapping(ContractorDeliverable)['properties']
+
+    def test_raw_fields_use_doc_values(self):
+        status = self.properties['status']
+        self.assertNotIn('doc_values', status)
+        self.assertTrue(status['fields']['raw']['doc_values'])
+
+    def test_indexable_fields_have_no_raw_field(self):
+        is_existing = self.properties['is_existing']
+        self.assertEqual(is_existing['type'], 'boolean')
+        self.assertTrue(is_existing['doc_values'])
+        self.assertNotIn('fields', is_existing)
+
+    def test_foreign_key_ids(self):
+        self.assertEqual(self.properties['leader_id'], {
+            'type': 'long',
+            'include_in_all': False,
+            'doc_values': True,
+        })
+
+    def test_base_fields(self):
+        self.assertIn('raw', self.properties['document_key']['fields'])
+        self.assertEqual(self.properties['pk']['type'], 'long')
+        self.assertEqual(self.properties['updated_on']['type'], 'date')
+
+    def test_generated_mapping_does_not_use_fielddata(self):
+        self.assertEqual(get_fielddata_fields(self.properties), [])
+
+    def test_fielddata_fields(self):
+        properties = {
+            'title': {
+                'type': 'string',
+                'fields': {'raw': {'type': 'string', 'index': 'not_analyzed'}},
+            },
+            'pk': {'type': 'long'},
+            'revision': {'type': 'long', 'doc_values': True},
+            'url': {'type': 'string', 'index': 'no'},
+        }
+        self.assertEqual(
+            get_fielddata_fields(properties), ['pk', 'title.raw'])
@@ -0,0 +1,250 @@
+# -*- coding: utf8 -*-
+
+from __future__ import unicode_literals
+
+import json
+
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.core.urlresolvers import reverse
+from django.core.cache import cache
+from django.contrib.contenttypes.models import ContentType
+
+from mock import patch
+
+from accounts.factories import UserFactory
+from categories.factories import CategoryFactory
+from documents.factories import DocumentFactory
+from default_documents.factories import (
+    ContractorDeliverableFactory, ContractorDeliverableRevisionFactory)
+from default_documents.models import ContractorDeliverable
+from search.builder import encode_cursor
+from search.models import IndexOperation
+from search.tasks import flush_index_queue
+
+
+class SearchViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = CategoryFactory()
+        user = UserFactory(
+            email='testadmin@phase.fr',
+            password='pass',
+            is_superuser=True,
+            category=self.category)
+        self.client.login(email=user.email, password='pass')
+        args = [self.category.organisation.slug, self.category.slug]
+        self.url = reverse('search_documents', args=args)
+        self.facets_url = reverse('search_facets', args=args)
+        self.facet_values_url = reverse(
+            'search_facet_values', args=args + ['status'])
+
+        self.aggregations = {'status': {'STD': 3}}
+        patcher = patch(
+            'search.views.SearchDocuments.execute_search',
+            side_effect=self.execute_search)
+        self.execute_mock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def execute_search(self, builder, with_aggregations=True):
+        return {
+            'total': 3,
+            'data': [],
+            'cursor': None,
+            'aggregations': self.aggregations if with_aggregations else None,
+        }
+
+    def get(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response, json.loads(response.content)
+
+    def test_aggregations_are_computed_on_first_page(self):
+        response, data = self.get(self.url)
+        self.assertEqual(response['X-Search-Cache'], 'miss')
+        self.assertEqual(data['aggregations'], self.aggregations)
+        self.execute_mock.assert_called_once_with(
+            self.execute_mock.call_args[0][0], True)
+
+    def test_next_pages_use_cached_aggregations(self):
+        self.get(self.url)
+        response, data = self.get(self.url, start=25)
+
+        self.assertEqual(data['aggregations'], self.aggregations)
+        self.assertFalse(self.execute_mock.call_args[0][1])
+
+    def test_cursor_pages_do_not_compute_aggregations(self):
+        cursor = encode_cursor(['Title', 'KEY-001'])
+        response, data = self.get(self.url, cursor=cursor)
+        self.assertIsNone(data['aggregations'])
+        self.assertFalse(self.execute_mock.call_args[0][1])
+
+    def test_aggregations_are_reused_when_sorting(self):
+        self.get(self.url)
+        response, data = self.get(self.url, sort_by='title')
+
+        self.assertEqual(data['aggregations'], self.aggregations)
+        self.assertFalse(self.execute_mock.call_args[0][1])
+
+    def test_aggregations_are_not_computed_on_request(self):
+        response, data = self.get(self.url, facets='false')
+        self.assertIsNone(data['aggregations'])
+        self.assertFalse(self.execute_mock.call_args[0][1])
+
+    def test_cached_results_compute_missing_aggregations(self):
+        self.get(self.url, facets='false')
+        with patch('search.views.SearchDocuments.execute_facets') as facets_mock:
+            facets_mock.return_value = self.aggregations
+            response, data = self.get(self.url)
+            self.assertEqual(response['X-Search-Cache'], 'hit')
+            self.assertEqual(data['aggregations'], self.aggregations)
+            self.assertEqual(facets_mock.call_count, 1)
+
+            response, data = self.get(self.url)
+            self.assertEqual(data['aggregations'], self.aggregations)
+            self.assertEqual(facets_mock.call_count, 1)
+        self.assertEqual(self.execute_mock.call_count, 1)
+
+    def test_cached_results(self):
+        self.get(self.url)
+        response, data = self.get(self.url)
+        self.assertEqual(response['X-Search-Cache'], 'hit')
+        self.assertEqual(self.execute_mock.call_count, 1)
+
+    def test_facets_view(self):
+        with patch('search.views.SearchFacets.execute_facets') as facets_mock:
+            facets_mock.return_value = self.aggregations
+            response, data = self.get(self.facets_url, start=25)
+            self.assertEqual(data, {'aggregations': self.aggregations})
+            self.assertEqual(response['X-Search-Cache'], 'miss')
+
+            response, data = self.get(self.facets_url, start=50)
+            self.assertEqual(response['X-Search-Cache'], 'hit')
+            self.assertEqual(facets_mock.call_count, 1)
+
+    def test_facets_view_shares_the_cache(self):
+        self.get(self.url)
+        with patch('search.views.SearchFacets.execute_facets') as facets_mock:
+            response, data = self.get(self.facets_url)
+            self.assertEqual(data, {'aggregations': self.aggregations})
+            self.assertFalse(facets_mock.called)
+
+    def test_facet_values_view(self):
+        with patch('search.views.SearchFacetValues.execute_facet_values') \
+                as values_mock:
+            values_mock.return_value = {'STD': 3}
+            response, data = self.get(self.facet_values_url, q='S')
+            self.assertEqual(data, {'field': 'status', 'buckets': {'STD': 3}})
+            self.assertEqual(values_mock.call_args[0][1:], ('status', 'S'))
+
+            response, data = self.get(self.facet_values_url, q='S')
+            self.assertEqual(response['X-Search-Cache'], 'hit')
+
+            response, data = self.get(self.facet_values_url, q='ST')
+            self.assertEqual(response['X-Search-Cache'], 'miss')
+            self.assertEqual(values_mock.call_count, 2)
+
+    def test_unknown_facet_values(self):
+        args = [self.category.organisation.slug, self.category.slug, 'title']
+        response = self.client.get(reverse('search_facet_values', args=args))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(SEARCH_BACKEND='search.backends.db.DatabaseBackend')
+class CursorPaginationViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        Model = ContentType.objects.get_for_model(ContractorDeliverable)
+        self.category = CategoryFactory(category_template__metadata_model=Model)
+        user = UserFactory(
+            email='testadmin@phase.fr',
+            password='pass',
+            is_superuser=True,
+            category=self.category)
+        self.client.login(email=user.email, password='pass')
+        self.url = reverse('search_documents', args=[
+            self.category.organisation.slug, self.category.slug])
+
+        titles = ['Title {}'.format(i % 3) for i in range(7)]
+        self.docs = [
+            DocumentFactory(
+                category=self.category,
+                metadata_factory_class=ContractorDeliverableFactory,
+                revision_factory_class=ContractorDeliverableRevisionFactory,
+                metadata={'title': title})
+            for title in titles]
+        for doc in self.docs:
+            IndexOperation.objects.queue_index(doc)
+        flush_index_queue()
+
+    def get(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_pages_keep_the_total_number_of_hits(self):
+        keys = []
+        params = {'size': 2, 'sort_by': 'title', 'facets': 'false'}
+        data = self.get(**params)
+        pages = 1
+        keys += [hit['document_key'] for hit in data['data']]
+        while data['cursor']:
+            self.assertEqual(data['total'], 7)
+            data = self.get(cursor=data['cursor'], **params)
+            pages += 1
+            keys += [hit['document_key'] for hit in data['data']]
+
+        self.assertEqual(pages, 4)
+        self.assertEqual(data['total'], 7)
+        self.assertEqual(len(keys), len(set(keys)))
+        self.assertEqual(
+            sorted(keys), sorted(doc.document_key for doc in self.docs))
+
+
+class GlobalSearchViewTests(TestCase):
+    def setUp(self):
+        self.category = CategoryFactory()
+        self.user = UserFactory(
+            email='testuser@phase.fr',
+            password='pass',
+            category=self.category)
+        self.client.login(email=self.user.email, password='pass')
+        self.url = reverse('global_search')
+
+    def get(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_empty_search(self):
+        with patch('search.views.get_backend') as backend_mock:
+            data = self.get(q=' ')
+            self.assertFalse(backend_mock.called)
+        self.assertEqual(data, {'total': 0, 'categories': []})
+
+    def test_search_user_categories(self):
+        other_category = CategoryFactory()
+        with patch('search.views.get_backend') as backend_mock:
+            global_search = backend_mock.return_value.global_search
+            global_search.return_value = {
+                'total': 1,
+                'categories': [{
+                    'document_type': self.category.document_type(),
+                    'total': 1,
+                    'hits': [{'document_key': 'KEY-001'}],
+                }],
+            }
+            data = self.get(q='key')
+
+        builder = global_search.call_args[0][0]
+        self.assertEqual(builder.categories, [self.category])
+        self.assertNotIn(other_category, builder.categories)
+        self.assertEqual(builder.search_terms, 'key')
+        self.assertEqual(data['categories'][0]['name'], unicode(self.category))
+        self.assertEqual(
+            data['categories'][0]['url'], self.category.get_absolute_url())
+
+    def test_login_required(self):
+        self.client.logout()
+        response = self.client.get(self.url, {'q': 'key'})
+        self.assertEqual(response.status_code, 302)
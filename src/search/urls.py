@@ -1,13 +1,26 @@
 from django.conf.urls import patterns, url
 
 
-from search.views import SearchDocuments
+from search.views import (
+    SearchDocuments, SearchFacets, SearchFacetValues, GlobalSearch)
 
 
 urlpatterns = patterns(
     '',
 
+    url(r'^$',
+        GlobalSearch.as_view(),
+        name='global_search'),
+
     url(r'^(?P<organisation>[\w-]+)/(?P<category>[\w-]+)/$',
         SearchDocuments.as_view(),
         name='search_documents'),
+
+    url(r'^(?P<organisation>[\w-]+)/(?P<category>[\w-]+)/facets/$',
+        SearchFacets.as_view(),
+        name='search_facets'),
+
+    url(r'^(?P<organisation>[\w-]+)/(?P<category>[\w-]+)/facets/(?P<field>\w+)/$',
+        SearchFacetValues.as_view(),
+        name='search_facet_values'),
 )
@@ -3,114 +3,395 @@
 from __future__ import unicode_literals
 
 import logging
+from itertools import islice
 
 from django.db.models.fields import FieldDoesNotExist
 from django.db import models
+from django.utils import timezone
 
 from elasticsearch.helpers import bulk
-from elasticsearch.exceptions import ConnectionError
 
 from core.celery import app
 from categories.models import Category
-from search import elastic, INDEX_SETTINGS
-from documents.models import Document
+from search import elastic, ANALYSIS_PROFILES
+from search.backends import get_backend
+from search.cache import bump_generation
 from django.conf import settings
 
 
 logger = logging.getLogger(__name__)
 
 
+# Index settings used while a brand new index is being filled
+BULK_LOAD_SETTINGS = {
+    'index': {
+        'refresh_interval': '-1',
+        'number_of_replicas': 0,
+    }
+}
+
+
+INDEX_LAYOUTS = ('shared', 'organisation', 'category')
+
+
+def get_index_alias(document_type):
+    """Returns the alias of the index where the document type is stored.
+
+    Depending on `settings.ELASTIC_INDEX_LAYOUT`, all categories share the
+    `settings.ELASTIC_INDEX` index, or every organisation or category has
+    its own index, e.g "documents_organisation_category".
+
+    """
+    layout = settings.ELASTIC_INDEX_LAYOUT
+    if layout not in INDEX_LAYOUTS:
+        raise ValueError('Unknown index layout {}'.format(layout))
+
+    if layout == 'shared':
+        return settings.ELASTIC_INDEX
+
+    organisation_slug, category_slug = document_type.split('.', 1)
+    parts = [settings.ELASTIC_INDEX, organisation_slug]
+    if layout == 'category':
+        parts.append(category_slug)
+    return '_'.join(parts).lower()
+
+
+def get_index_aliases(categories=None):
+    """Returns the index aliases of the given categories (default: all)."""
+    if settings.ELASTIC_INDEX_LAYOUT == 'shared':
+        return [settings.ELASTIC_INDEX]
+
+    if categories is None:
+        categories = get_categories()
+    return sorted(set(
+        get_index_alias(category.document_type())
+        for category in categories))
+
+
+def get_type_indexes(document_types):
+    """Comma separated list of the indexes of the given document types."""
+    return ','.join(sorted(set(
+        get_index_alias(document_type) for document_type in document_types)))
+
+
 def create_index():
-    """Create all needed indexes."""
-    index = settings.ELASTIC_INDEX
-    elastic.indices.create(index=index, ignore=400, body=INDEX_SETTINGS)
+    """Create all needed indexes.
+
+    Every index name is an alias, pointing to a versioned index. Existing
+    aliases are left untouched.
+
+    """
+    for alias in get_index_aliases():
+        ensure_index(alias)
+
+
+def ensure_index(alias):
+    """Create a versioned index behind the alias, if it does not exist."""
+    if elastic.indices.exists(index=alias):
+        return
+
+    index = create_versioned_index(alias)
+    elastic.indices.put_alias(index=index, name=alias)
 
 
 def delete_index():
-    """Delete existing ES indexes."""
-    index = settings.ELASTIC_INDEX
-    elastic.indices.delete(index=index, ignore=404)
-
-
-def index_revision(revision):
-    """Saves a document's revision into ES's index."""
-    document = revision.document
-    es_key = '{}_{}'.format(document.document_key, revision.revision)
-    try:
-        elastic.index(
-            index=settings.ELASTIC_INDEX,
-            doc_type=document.document_type(),
-            id=es_key,
-            body=revision.to_json(),
-        )
-    except ConnectionError:
-        logger.error('Error connecting to ES. The doc %d will no be indexed' %
-                     es_key)
+    """Delete existing ES indexes.
 
+    All the indexes behind the aliases are deleted. If `settings.ELASTIC_INDEX`
+    is an old fashioned, non aliased index, it is deleted as well.
 
-@app.task
-def index_document(document_id):
-    """Index all revisions for a document"""
-    document = Document.objects \
-        .select_related() \
-        .get(pk=document_id)
-    revisions = document.get_all_revisions()
-    actions = map(build_index_data, revisions)
-
-    bulk(
-        elastic,
-        actions,
-        chunk_size=settings.ELASTIC_BULK_SIZE,
-        request_timeout=60)
-
-
-def index_revisions(revisions):
-    """Index a bunch of revisions."""
-    actions = map(build_index_data, revisions)
-    bulk(
-        elastic,
-        actions,
-        chunk_size=settings.ELASTIC_BULK_SIZE,
-        request_timeout=60)
+    """
+    indexes = get_aliased_indexes(settings.ELASTIC_INDEX) or \
+        [settings.ELASTIC_INDEX]
+    for alias in get_index_aliases():
+        indexes += get_aliased_indexes(alias)
+    elastic.indices.delete(index=','.join(set(indexes)), ignore=404)
+
+
+def get_versioned_index_name(alias):
+    """Returns a new physical index name.
+
+    e.g "documents_20150101120000123456". Microseconds make sure indexes
+    created in the same second get distinct names.
+
+    """
+    return '{}_{:%Y%m%d%H%M%S%f}'.format(alias, timezone.now())
+
+
+def get_index_settings(profile=None):
+    """Returns the settings of a new index, using the given analysis profile.
+
+    Defaults to `settings.ELASTIC_ANALYSIS_PROFILE`.
+
+    """
+    profile = profile or settings.ELASTIC_ANALYSIS_PROFILE
+    return {
+        'settings': {
+            'analysis': ANALYSIS_PROFILES[profile]['analysis'],
+        }
+    }
+
+
+def get_index_profile(index=None):
+    """Returns the name of the analysis profile an index was created with.
+
+    Since the analysis settings cannot be changed once the index is created,
+    indexes keep their profile until they are rebuilt with `reindex_all`.
+
+    """
+    response = elastic.indices.get_settings(
+        index=index or settings.ELASTIC_INDEX,
+        flat_settings=True)
+    for index_settings in response.values():
+        for name, profile in ANALYSIS_PROFILES.items():
+            key = 'index.analysis.analyzer.{}.type'.format(
+                profile['index_analyzer'])
+            if key in index_settings['settings']:
+                return name
+    return settings.ELASTIC_ANALYSIS_PROFILE
+
+
+def create_versioned_index(alias, bulk_load=False, profile=None):
+    """Creates a new physical index and returns it's name.
+
+    If `bulk_load` is set, refresh and replication are disabled until
+    `end_bulk_load` is called. `profile` is the name of the analysis profile
+    to use (see `search.ANALYSIS_PROFILES`).
+
+    """
+    index = get_versioned_index_name(alias)
+    body = get_index_settings(profile)
+    if bulk_load:
+        body['settings'] = dict(body['settings'], **BULK_LOAD_SETTINGS)
+    elastic.indices.create(index=index, body=body)
+    return index
+
+
+def end_bulk_load(index):
+    """Restore the default refresh and replication settings."""
+    elastic.indices.put_settings(index=index, body={
+        'index': {
+            'refresh_interval': '1s',
+            'number_of_replicas': settings.ELASTIC_REPLICAS,
+        }
+    })
+    elastic.indices.refresh(index=index)
+
+
+def get_aliased_indexes(alias):
+    """Returns the list of physical indexes the alias points to."""
+    if not elastic.indices.exists_alias(name=alias):
+        return []
+    return list(elastic.indices.get_alias(name=alias).keys())
+
+
+def switch_alias(alias, index):
+    """Atomically points the alias to the given index.
+
+    Returns the list of indexes the alias previously pointed to.
+
+    """
+    old_indexes = get_aliased_indexes(alias)
+
+    # Before aliases were introduced, `settings.ELASTIC_INDEX` was the actual
+    # index name. An alias cannot be created as long as this index exists.
+    if not old_indexes and elastic.indices.exists(index=alias):
+        logger.warning('Deleting non aliased index {}'.format(alias))
+        elastic.indices.delete(index=alias)
+
+    actions = [{'remove': {'index': old_index, 'alias': alias}}
+               for old_index in old_indexes]
+    actions.append({'add': {'index': index, 'alias': alias}})
+    elastic.indices.update_aliases(body={'actions': actions})
+    return old_indexes
+
+
+def get_categories(slugs=None):
+    """Returns the categories matching "organisation_slug/category_slug" slugs.
+
+    All categories are returned if no slug is given.
+
+    """
+    categories = Category.objects \
+        .select_related(
+            'organisation',
+            'category_template__metadata_model') \
+        .order_by('organisation__name', 'category_template__name')
+    if not slugs:
+        return list(categories)
+
+    selected = []
+    for slug in slugs:
+        try:
+            organisation_slug, category_slug = slug.split('/')
+            category = categories.get(
+                organisation__slug=organisation_slug,
+                category_template__slug=category_slug)
+        except (ValueError, Category.DoesNotExist):
+            raise ValueError('Unknown category {}'.format(slug))
+        selected.append(category)
+    return selected
+
+
+def get_indexable_revisions(category):
+    """Return all indexable revisions from a category."""
+    RevisionClass = category.revision_class()
+    revisions = RevisionClass.objects \
+        .filter(document__category=category) \
+        .filter(document__is_indexable=True) \
+        .order_by('pk')
+    return revisions
 
 
 def bulk_actions(actions):
-    bulk(
-        elastic,
-        actions,
-        chunk_size=settings.ELASTIC_BULK_SIZE,
-        request_timeout=60)
+    """Send a list of actions to the search backend.
 
+    The index is refreshed, and cached search results are invalidated.
 
-def build_index_data(revision):
+    """
+    document_types = set(action['_type'] for action in actions)
+    backend = get_backend()
+    if backend.uses_elasticsearch:
+        bulk(
+            elastic,
+            actions,
+            chunk_size=settings.ELASTIC_BULK_SIZE,
+            request_timeout=60)
+        elastic.indices.refresh(index=get_type_indexes(document_types))
+    else:
+        backend.bulk(actions)
+        backend.refresh()
+
+    for document_type in document_types:
+        bump_generation(document_type)
+
+
+def build_index_data(revision, index=None):
+    document_type = revision.document.document_type()
     return {
-        '_index': settings.ELASTIC_INDEX,
-        '_type': revision.document.document_type(),
+        '_index': index or get_index_alias(document_type),
+        '_type': document_type,
         '_id': revision.unique_id,
         '_source': revision.to_json(),
     }
 
 
-@app.task
-def unindex_document(document_id):
-    """Removes all revisions of a document from the index."""
-    document = Document.objects \
-        .select_related() \
-        .get(pk=document_id)
-    revisions = document.get_all_revisions()
-    actions = map(lambda revision: {
-        '_op_type': 'delete',
-        '_index': settings.ELASTIC_INDEX,
-        '_type': document.document_type(),
-        '_id': revision.unique_id,
-    }, revisions)
+def iter_index_data(category, revisions, index=None):
+    """Same as `build_index_data`, for a bunch of revisions."""
+    document_type = category.document_type()
+    index = index or get_index_alias(document_type)
+    for revision, json in serialize_revisions(category, revisions):
+        yield {
+            '_index': index,
+            '_type': document_type,
+            '_id': revision.unique_id,
+            '_source': json,
+        }
+
+
+def serialize_revisions(category, revisions, batch_size=None):
+    """Yields (revision, json) tuples for a bunch of revisions.
+
+    `revisions` is a revision queryset or a list of revision ids. All the
+    revisions must belong to `category`.
+
+    The json data is the same as `MetadataRevision.to_json()`, but the
+    documents, metadata and related objects are fetched for a whole batch of
+    revisions at once (see `prefetch_revisions`).
+
+    """
+    for revision in prefetch_revisions(category, revisions, batch_size):
+        yield revision, revision.to_json()
+
+
+def prefetch_revisions(category, revisions, batch_size=None):
+    """Yields revisions with their document, metadata and related objects.
 
-    bulk(
-        elastic,
-        actions,
-        raise_on_error=False,
-        chunk_size=settings.ELASTIC_BULK_SIZE,
-        request_timeout=60)
+    `revisions` is a revision queryset or an iterable of revision ids, that
+    is consumed by batches of `batch_size` ids, so it can be a generator.
+    All the revisions must belong to `category`, and are yielded in the
+    same order as the ids.
+
+    Related objects are fetched for a whole batch of revisions at once.
+    Hence, the number of queries does not depend on the number of
+    revisions in the batch.
+
+    """
+    batch_size = batch_size or settings.ELASTIC_BULK_SIZE
+    Metadata = category.document_class()
+    Revision = Metadata.get_revision_class()
+
+    if isinstance(revisions, models.query.QuerySet):
+        revisions = revisions.values_list('pk', flat=True)
+    revision_ids = iter(revisions)
+
+    revision_fks = get_foreign_keys(Revision, exclude=('document',))
+    metadata_fks = get_foreign_keys(
+        Metadata, exclude=('document', 'latest_revision'))
+    metadata_fks += ['latest_revision__{}'.format(fk) for fk in revision_fks]
+
+    while True:
+        batch_ids = list(islice(revision_ids, batch_size))
+        if not batch_ids:
+            break
+
+        revisions = Revision.objects \
+            .filter(pk__in=batch_ids) \
+            .select_related('document', *revision_fks)
+        revisions = dict((revision.pk, revision) for revision in revisions)
+
+        document_ids = set(rev.document_id for rev in revisions.values())
+        metadatas = Metadata.objects \
+            .filter(document_id__in=document_ids) \
+            .select_related('latest_revision', *metadata_fks)
+        metadatas = dict((meta.document_id, meta) for meta in metadatas)
+
+        for revision_id in batch_ids:
+            # The revision may have been deleted in the meantime
+            revision = revisions.get(revision_id)
+            if revision is None:
+                continue
+
+            document = revision.document
+            document.category = category
+            metadata = metadatas[document.pk]
+            metadata.document = document
+            metadata.latest_revision.document = document
+            revision.metadata = metadata
+            yield revision
+
+
+# Keys of the `to_json` output that depend on the revision itself
+REVISION_KEYS = ('pk', 'revision', 'is_latest_revision')
+
+
+def get_document_fields(revision_class, json):
+    """Extract the document level fields from a revision's json data.
+
+    Those are the fields whose value does not come from the revision itself,
+    but from the document or metadata. They are the same for every revision
+    of a given document.
+
+    """
+    field_names = revision_class._meta.get_all_field_names()
+
+    def is_revision_field(key):
+        if key.endswith('_id') and key[:-3] in json:
+            key = key[:-3]
+        return any((
+            key in REVISION_KEYS,
+            key in field_names,
+            hasattr(revision_class, key)))
+
+    return dict((key, value) for key, value in json.items()
+                if not is_revision_field(key))
+
+
+def get_foreign_keys(model, exclude=()):
+    """Returns the names of the model's foreign keys."""
+    return [field.name for field in model._meta.fields
+            if isinstance(field, models.ForeignKey) and
+            field.name not in exclude]
 
 
 TYPE_MAPPING = [
@@ -122,40 +403,59 @@ TYPE_MAPPING = [
 ]
 
 
+# Fields indexed for every document type, that are sorted or filtered on
+BASE_FIELD_TYPES = (
+    ('document_key', 'string'),
+    ('pk', 'long'),
+    ('is_latest_revision', 'boolean'),
+    ('updated_on', 'date'),
+)
+BASE_RAW_FIELDS = ('document_key',)
+
+
 @app.task
-def put_category_mapping(category_id):
+def put_category_mapping(category_id, index=None):
     category = Category.objects \
         .select_related('organisation', 'category_template__metadata_model') \
         .get(pk=category_id)
 
     doc_class = category.document_class()
     doc_type = category.document_type()
-    mapping = get_mapping(doc_class)
+    if index is None:
+        index = get_index_alias(doc_type)
+        ensure_index(index)
+
+    mapping = get_mapping(doc_class, get_index_profile(index))
     elastic.indices.put_mapping(
-        index=settings.ELASTIC_INDEX,
+        index=index,
         doc_type=doc_type,
         body=mapping,
         ignore_conflicts=True
     )
 
 
-def get_mapping(doc_class):
+def get_mapping(doc_class, profile=None):
     """Creates an elasticsearch mapping for a given document class.
 
+    The `_all` field is analyzed according to the `profile` analysis profile
+    (default: `settings.ELASTIC_ANALYSIS_PROFILE`).
+
     See: http://www.elasticsearch.org/guide/en/elasticsearch/reference/current/mapping.html
 
     Note: with elasticsearch, sorting cannot be done on "analyzed" values. We
     use multifields so fields can be indexed twice, one analyzed version, and
-    one not_analyzed. Thus, we can search, filter, sort or query any field.
+    one not_analyzed. Thus, we can search, filter, sort or query any field
+    of the document list.
 
     See: http://www.elasticsearch.org/guide/en/elasticsearch/guide/current/multi-fields.html
 
     """
     revision_class = doc_class.get_revision_class()
+    analysis = ANALYSIS_PROFILES[profile or settings.ELASTIC_ANALYSIS_PROFILE]
     mapping = {
         '_all': {
-            'index_analyzer': 'nGram_analyzer',
-            'search_analyzer': 'whitespace_analyzer',
+            'index_analyzer': analysis['index_analyzer'],
+            'search_analyzer': analysis['search_analyzer'],
             'index': 'not_analyzed',
         },
         'properties': {}
@@ -165,8 +465,19 @@ def get_mapping(doc_class):
     filter_fields = list(config.filter_fields)
     searchable_fields = list(config.searchable_fields)
     column_fields = dict(config.column_fields).values()
+    date_filter_fields = list(getattr(config, 'date_filter_fields', []))
     additional_fields = getattr(config, 'indexable_fields', [])
-    fields = set(filter_fields + searchable_fields + column_fields + additional_fields)
+    field_types = getattr(config, 'indexable_field_types', {})
+    fields = set(filter_fields + searchable_fields + column_fields +
+                 date_filter_fields + additional_fields)
+
+    # Only fields that are sorted, filtered or exactly matched need a ".raw"
+    # version
+    raw_fields = set(filter_fields + searchable_fields + column_fields)
+
+    for field_name, es_type in BASE_FIELD_TYPES:
+        mapping['properties'][field_name] = get_field_mapping(
+            es_type, raw=field_name in BASE_RAW_FIELDS)
 
     for field_name in fields:
         try:
@@ -180,25 +491,77 @@ def get_mapping(doc_class):
                     warning = 'Field {} cannot be found and will not be indexed'.format(field_name)
                     logger.warning(warning)
 
-        es_type = get_mapping_type(field) if field else 'string'
+        if field_name in field_types:
+            es_type = field_types[field_name]
+        else:
+            es_type = get_mapping_type(field) if field else 'string'
 
-        mapping['properties'].update({
-            field_name: {
+        mapping['properties'][field_name] = get_field_mapping(
+            es_type,
+            include_in_all=field_name in searchable_fields,
+            raw=field_name in raw_fields)
+
+        # Foreign keys are filtered and aggregated by id
+        if isinstance(field, models.ForeignKey):
+            mapping['properties']['%s_id' % field_name] = get_field_mapping(
+                'long')
+
+    return mapping
+
+
+def get_field_mapping(es_type, include_in_all=False, raw=False):
+    """Returns the mapping of a single field.
+
+    Not analyzed values are stored as doc values, so sorting and aggregating
+    does not load them in the heap. Strings are analyzed, so the not
+    analyzed version goes in the `raw` sub-field if `raw` is set.
+
+    """
+    mapping = {
+        'type': es_type,
+        'include_in_all': include_in_all,
+    }
+    if es_type != 'string':
+        mapping['doc_values'] = True
+
+    if raw:
+        mapping['fields'] = {
+            'raw': {
                 'type': es_type,
-                'include_in_all': field_name in searchable_fields,
-                'fields': {
-                    'raw': {
-                        'type': es_type,
-                        'index': 'not_analyzed',
-                        'include_in_all': False
-                    }
-                }
+                'index': 'not_analyzed',
+                'include_in_all': False,
+                'doc_values': True,
             }
-        })
-
+        }
     return mapping
 
 
+def get_fielddata_fields(properties, prefix=''):
+    """Returns the not analyzed fields that are not stored as doc values.
+
+    `properties` are the properties of a mapping, as returned by
+    elasticsearch. Sorting or aggregating on those fields loads their values
+    in the heap (fielddata).
+
+    """
+    fields = []
+    for name, field in sorted(properties.items()):
+        path = prefix + name
+        if 'properties' in field:
+            fields += get_fielddata_fields(field['properties'], path + '.')
+            continue
+
+        es_type = field.get('type', 'string')
+        index = field.get('index', 'analyzed' if es_type == 'string' else None)
+        doc_values = field.get('doc_values') or \
+            field.get('fielddata', {}).get('format') == 'doc_values'
+        if index not in ('analyzed', 'no') and not doc_values:
+            fields.append(path)
+
+        fields += get_fielddata_fields(field.get('fields', {}), path + '.')
+    return fields
+
+
 def get_mapping_type(field):
     """Get the elasticsearch mapping type from a django field."""
     for typeinfo, typename in TYPE_MAPPING:
@@ -2,75 +2,206 @@
 
 from __future__ import unicode_literals
 
-from braces.views import JSONResponseMixin
+from braces.views import JSONResponseMixin, LoginRequiredMixin
 
-from search.builder import SearchBuilder
+from categories.models import Category
+from search.backends import get_backend
+from search.builder import SearchBuilder, GlobalSearchBuilder
+from search.cache import SearchCache
 from documents.views import BaseDocumentList
 from django.conf import settings
+from django.http import Http404
+from django.views.generic import View
 
 
 class SearchDocuments(JSONResponseMixin, BaseDocumentList):
+    """Search documents of a category.
+
+    The response contains a `cursor`, that can be passed as a parameter to
+    fetch the next page of results. This is much faster than using `start`
+    to fetch results far from the first page.
+
+    Aggregations (facets) do not depend on pagination and sorting, so they
+    are cached separately, and only computed for the first page of results
+    (without `start` nor `cursor`) when they are not in the cache yet. When
+    the results are cached but the aggregations are not (e.g the page was
+    first requested without facets), the aggregations are computed on their
+    own. If the `facets` parameter is set to "false", they are never
+    computed, and the client is expected to use the `SearchFacets` view
+    instead.
+
+    """
     http_method_names = ['get']
 
     def get_queryset(self):
-        """Given DataTables' GET parameters, filter the initial queryset."""
-        super(SearchDocuments, self).get_queryset()
+        """Given DataTables' GET parameters, filter the initial queryset.
 
+        Results are fetched from the cache when possible.
+
+        """
         try:
             builder = SearchBuilder(self.category, self.request.GET)
-            query = builder.build_query()
-            query = builder.add_aggregations(query)
-            results = query.execute()
         except RuntimeError:
-            results = []
+            self.cache_hit = False
+            return {'total': 0, 'data': [], 'cursor': None, 'aggregations': {}}
+
+        search_cache = SearchCache(self.category)
+        self.aggregations = search_cache.get(builder.facet_filters, 'facets')
+        results, self.cache_hit = search_cache.get_or_execute(
+            builder.filters,
+            lambda: self.get_results(builder, search_cache))
+        if self.cache_hit and self.with_aggregations(builder):
+            self.aggregations, _ = search_cache.get_or_execute(
+                builder.facet_filters,
+                lambda: self.execute_facets(builder),
+                'facets')
+        return dict(results, aggregations=self.aggregations)
+
+    def with_aggregations(self, builder):
+        if self.aggregations is not None:
+            return False
+        if self.request.GET.get('facets') == 'false':
+            return False
+        if builder.search_after is not None:
+            return False
+        return not builder.filters.get('start')
+
+    def get_results(self, builder, search_cache):
+        """Execute the search, and put the aggregations in their own cache.
+
+        Returned results do not contain aggregations.
 
+        """
+        with_aggregations = self.with_aggregations(builder)
+        results = self.execute_search(builder, with_aggregations)
+        aggregations = results.pop('aggregations')
+        if with_aggregations:
+            self.aggregations = aggregations
+            search_cache.set(builder.facet_filters, aggregations, 'facets')
         return results
 
+    def execute_search(self, builder, with_aggregations=True):
+        return get_backend().search(
+            builder,
+            source_fields=builder.list_fields,
+            with_aggregations=with_aggregations)
+
+    def execute_facets(self, builder):
+        return get_backend().facets(builder)
+
     def render_to_response(self, context, **response_kwargs):
-        return self.render_json_response(context, **response_kwargs)
+        response = self.render_json_response(context, **response_kwargs)
+        response['X-Search-Cache'] = 'hit' if self.cache_hit else 'miss'
+        return response
 
     def get_context_data(self, **kwargs):
-        response = self.get_queryset()
+        results = self.object_list
         start = int(self.request.GET.get('start', 0))
         end = start + int(self.request.GET.get('length', settings.PAGINATE_BY))
-        total = response.hits.total
+        total = results['total']
         display = min(end, total)
-        search_data = [hit._d_ for hit in response.hits]
-        aggregations = self.format_aggregations(response.aggregations)
 
         return {
             'total': total,
             'display': display,
-            'data': search_data,
-            'aggregations': aggregations,
+            'data': results['data'],
+            'cursor': results['cursor'],
+            'aggregations': results['aggregations'],
         }
 
-    def format_aggregations(self, aggregations):
-        """Transfroms the ES "aggregations" response into something we can use.
-
-        aggregations = {
-            'filter_name': {
-                'buckets': [
-                    {'key': 'some_name', 'doc_count': 123},
-                    …
-                ]
-            },
-            …
-        }
 
-        We want :
+class SearchFacets(SearchDocuments):
+    """Only returns the aggregations (facets) for the given filters.
+
+    This is cheaper than a full search, since no document is fetched, and
+    pagination does not matter.
+
+    """
+
+    def get_queryset(self):
+        try:
+            builder = SearchBuilder(self.category, self.request.GET)
+        except RuntimeError:
+            self.cache_hit = False
+            return {}
+
+        search_cache = SearchCache(self.category)
+        aggregations, self.cache_hit = search_cache.get_or_execute(
+            builder.facet_filters,
+            lambda: self.execute_facets(builder),
+            'facets')
+        return aggregations
+
+    def get_context_data(self, **kwargs):
+        return {'aggregations': self.object_list}
+
+
+class SearchFacetValues(SearchFacets):
+    """Search the values of a single facet.
 
-        aggregations = {
-            'filter_name': [{'some_name': 123}, …],
-            …
+    Facets only contain the most frequent values. This view returns the
+    values of the `field` facet starting with the `q` parameter, for the
+    given filters.
+
+    """
+
+    def get_queryset(self):
+        field = self.kwargs['field']
+        prefix = self.request.GET.get('q', '')
+        try:
+            builder = SearchBuilder(self.category, self.request.GET)
+        except RuntimeError:
+            self.cache_hit = False
+            return {}
+
+        if field not in builder.filter_fields:
+            raise Http404('Unknown facet {}'.format(field))
+
+        search_cache = SearchCache(self.category)
+        buckets, self.cache_hit = search_cache.get_or_execute(
+            dict(builder.facet_filters, facet=field, q=prefix),
+            lambda: self.execute_facet_values(builder, field, prefix),
+            'facet_values')
+        return buckets
+
+    def execute_facet_values(self, builder, field, prefix):
+        return get_backend().facet_values(builder, field, prefix)
+
+    def get_context_data(self, **kwargs):
+        return {
+            'field': self.kwargs['field'],
+            'buckets': self.object_list,
         }
 
-        """
-        def flatten(bucket):
-            key = bucket[0]
-            buckets = bucket[1]['buckets']
-            bucket_values = dict([(b['key'], b['doc_count']) for b in buckets])
-            return (key, bucket_values)
-        buckets = aggregations.to_dict().items()
-        response = dict(map(flatten, buckets))
-        return response
+
+class GlobalSearch(LoginRequiredMixin, JSONResponseMixin, View):
+    """Search documents in all the categories of the user at once.
+
+    A single query is run, so the view is fast enough to search as the user
+    types. For every category with hits, the number of hits and the most
+    relevant ones are returned.
+
+    """
+    http_method_names = ['get']
+
+    def get(self, request, *args, **kwargs):
+        search_terms = request.GET.get('q', '').strip()
+        categories = Category.objects \
+            .filter(users=request.user) \
+            .select_related('organisation', 'category_template__metadata_model')
+
+        results = {'total': 0, 'categories': []}
+        if search_terms and categories:
+            builder = GlobalSearchBuilder(categories, search_terms)
+            results = get_backend().global_search(builder)
+
+        categories = dict(
+            (category.document_type(), category) for category in categories)
+        for result in results['categories']:
+            category = categories[result['document_type']]
+            result.update({
+                'name': unicode(category),
+                'url': category.get_absolute_url(),
+            })
+
+        return self.render_json_response(results)
@@ -87,6 +87,7 @@ var Phase = Phase || {};
             this.urlField = this.$el.find('#id_url');
             this.urlField.val(currentUrl);
             this.nameField = this.$el.find('#id_name');
+            this.subscribedField = this.$el.find('#id_subscribed');
             this.modal = this.$el.find('.modal');
 
             this.listenTo(dispatcher, 'onUrlChange', this.onUrlChange);
@@ -101,6 +102,7 @@ var Phase = Phase || {};
             });
             this.collection.create(data, {wait: true});
             this.nameField.val('');
+            this.subscribedField.prop('checked', false);
             this.modal.modal('hide');
         },
         /**
@@ -15,7 +15,7 @@ var Phase = Phase || {};
             '': 'documentList'
         },
         initialize: function() {
-            _.bindAll(this, 'onDocumentsFetched');
+            _.bindAll(this, 'onDocumentsFetched', 'onFacetsFetched');
         },
         /**
          * The main document list view.
@@ -71,6 +71,7 @@ var Phase = Phase || {};
             // Data fetching
             this.bookmarkCollection.reset(Phase.Config.initialBookmarks);
             this.fetchDocuments(false);
+            this.fetchFacets();
         },
         /**
          * Extract the search parameters from the query string, and returns
@@ -99,13 +100,30 @@ var Phase = Phase || {};
          * Call the API to get actual search results.
          */
         fetchDocuments: function(reset) {
+            // Facets are fetched separately, see `fetchFacets`
+            var data = _.extend({facets: 'false'}, this.search.attributes);
+
+            // Next pages are fetched using the cursor returned with the
+            // previous results
+            if (!reset && this.documentsCollection.cursor) {
+                data.cursor = this.documentsCollection.cursor;
+            }
             this.documentsCollection.fetch({
-                data: this.search.attributes,
+                data: data,
                 remove: false,
                 reset: reset,
                 success: this.onDocumentsFetched
             });
         },
+        /**
+         * Call the API to get the facets counts.
+         *
+         * Facets don't change when the user scrolls down, so they are only
+         * fetched when the search parameters change.
+         */
+        fetchFacets: function() {
+            $.get(Phase.Config.facetsUrl, this.search.attributes, this.onFacetsFetched);
+        },
         /**
          * When we get the search results from the API, we need to trigger
          * different events so the different views can update themselves.
@@ -113,12 +131,13 @@ var Phase = Phase || {};
         onDocumentsFetched: function() {
             var displayedDocuments = this.documentsCollection.length;
             var totalDocuments = this.documentsCollection.total;
-            var aggregations = this.documentsCollection.aggregations;
             dispatcher.trigger('onDocumentsFetched', {
                 displayed: displayedDocuments,
                 total: totalDocuments
             });
-            dispatcher.trigger('onAggregationsFetched', aggregations);
+        },
+        onFacetsFetched: function(response) {
+            dispatcher.trigger('onAggregationsFetched', response.aggregations);
         },
         /**
          * User scrolled all the way to the bottom of the page, let's
@@ -145,6 +164,7 @@ var Phase = Phase || {};
             this.resetPagination();
             this.updateUrl();
             this.fetchDocuments(true);
+            this.fetchFacets();
         },
         onFavoriteSet: function(data) {
             var document_id = data.document_id;
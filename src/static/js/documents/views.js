@@ -359,6 +359,7 @@ var Phase = Phase || {};
             'submit form': 'submitForm',
             'keyup input': 'debouncedSetInput',
             'click input[type=checkbox]': 'setInput',
+            'changeDate input.dateinput': 'setDate',
             'change select.filter': 'setFilter',
             'click span.glyphicon-remove': 'removeFilter',
             'click #resetForm': 'resetForm'
@@ -368,6 +369,9 @@ var Phase = Phase || {};
 
             this.filterForm = this.$el.find('form').first();
             this.filterForm.get(0).reset();
+            this.filterForm.find('input.dateinput').datepicker({
+                format: 'yyyy-mm-dd'
+            });
 
             this.listenTo(dispatcher, 'onSearchFormDisplayed', this.showSearchForm);
             this.listenTo(dispatcher, 'onAggregationsFetched', this.updateFacets);
@@ -440,6 +444,10 @@ var Phase = Phase || {};
             }
             this.model.set(name, val);
         },
+        setDate: function(event) {
+            $(event.currentTarget).datepicker('hide');
+            this.setInput(event);
+        },
         debouncedSetInput: _.debounce(function(event) {
             this.setInput(event);
         }, 250),
@@ -468,12 +476,16 @@ var Phase = Phase || {};
         /**
          * Get the buckets values from Elasticsearch aggregations, and
          * update the filter fields display accordingly.
+         *
+         * Only the most frequent values are returned, so when the facet is
+         * truncated, a missing value does not mean there is no document.
          */
         updateFacet: function(buckets, facet) {
             // Let's get the field, and loop on every "option" tag
             var field = this.filterForm.find('#id_' + facet).first();
             var options = field.children('option');
             var option_text_re = /^(.+) \(\d+\)$/i;
+            var truncated = _.size(buckets) >= Phase.Config.facetSize;
             _.each(options, function(option) {
                 option = $(option);
                 var text = option.text();
@@ -493,6 +505,10 @@ var Phase = Phase || {};
                 // ES doesn'nt return a value if the bucket is empty
                 var bucket_number = buckets[val];
                 if (bucket_number === undefined) {
+                    if (truncated) {
+                        option.text(text);
+                        return;
+                    }
                     bucket_number = 0;
                 }
 
@@ -0,0 +1,7 @@
+var Phase = Phase || {};
+
+jQuery(function($) {
+    $('#export-list tr[data-poll-url]').each(function(index, row) {
+        var progressView = new Phase.Views.ExportProgressView({el: row});
+    });
+});
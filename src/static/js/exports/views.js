@@ -0,0 +1,34 @@
+var Phase = Phase || {};
+
+(function(exports, Phase, Backbone, _) {
+    "use strict";
+
+    Phase.Views = Phase.Views || {};
+
+    /**
+     * Displays the number of rows written by a pending export.
+     *
+     * The page is reloaded when the export task ends.
+     */
+    Phase.Views.ExportProgressView = Backbone.View.extend({
+        initialize: function() {
+            _.bindAll(this, 'poll', 'pollSuccess');
+            this.pollUrl = this.$el.data('poll-url');
+            this.rows = this.$el.find('.export-rows');
+            this.pollId = setInterval(this.poll, 2000);
+        },
+        poll: function() {
+            $.get(this.pollUrl, this.pollSuccess);
+        },
+        pollSuccess: function(data) {
+            if (data.hasOwnProperty('rows')) {
+                this.rows.text(data.rows);
+            }
+            if (data.done) {
+                clearInterval(this.pollId);
+                location.reload();
+            }
+        }
+    });
+
+})(this, Phase, Backbone, _);
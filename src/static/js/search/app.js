@@ -0,0 +1,9 @@
+var Phase = Phase || {};
+
+jQuery(function($) {
+    "use strict";
+
+    if ($('#global-search').length !== 0) {
+        var globalSearchView = new Phase.Views.GlobalSearchView();
+    }
+});
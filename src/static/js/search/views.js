@@ -0,0 +1,96 @@
+var Phase = Phase || {};
+
+(function(exports, Phase, Backbone, _) {
+    "use strict";
+
+    Phase.Views = Phase.Views || {};
+
+    /**
+     * Search documents in all the user categories from the navigation bar.
+     *
+     * Results are fetched as the user types, and only the last request
+     * is rendered.
+     */
+    Phase.Views.GlobalSearchView = Backbone.View.extend({
+        el: '#global-search',
+        events: {
+            'submit': 'submitForm',
+            'keyup input': 'debouncedSearch',
+            'focus input': 'showResults'
+        },
+        initialize: function() {
+            _.bindAll(this, 'render', 'hideResults');
+
+            this.input = this.$el.find('input');
+            this.results = this.$el.find('.global-search-results');
+            this.request = null;
+            this.terms = '';
+
+            $(document).on('click', this.hideResults);
+        },
+        submitForm: function(event) {
+            event.preventDefault();
+            this.search();
+        },
+        search: function() {
+            var terms = $.trim(this.input.val());
+            if (terms === this.terms) {
+                return;
+            }
+            this.terms = terms;
+
+            if (this.request !== null) {
+                this.request.abort();
+            }
+
+            if (terms === '') {
+                this.results.empty();
+                this.hideResults();
+                return;
+            }
+
+            this.request = $.get(Phase.Config.globalSearchUrl, {q: terms}, this.render);
+        },
+        debouncedSearch: _.debounce(function() {
+            this.search();
+        }, 250),
+        render: function(response) {
+            var results = this.results;
+            this.request = null;
+            results.empty();
+
+            if (response.total === 0) {
+                results.append($('<li class="dropdown-header"></li>').text('No results'));
+            }
+
+            _.each(response.categories, function(category) {
+                var header = $('<li class="dropdown-header"></li>');
+                header.append($('<a></a>')
+                    .attr('href', category.url + '?search_terms=' + encodeURIComponent(this.terms))
+                    .text(category.name + ' (' + category.total + ')'));
+                results.append(header);
+
+                _.each(category.hits, function(hit) {
+                    var link = $('<a></a>').attr('href', hit.url);
+                    link.text(hit.document_number + (hit.title ? ' - ' + hit.title : ''));
+                    results.append($('<li></li>').append(link));
+                });
+            }, this);
+
+            this.showResults();
+            return this;
+        },
+        showResults: function() {
+            if (!this.results.is(':empty')) {
+                this.$el.addClass('open');
+            }
+        },
+        hideResults: function(event) {
+            if (event && $.contains(this.el, event.target)) {
+                return;
+            }
+            this.$el.removeClass('open');
+        }
+    });
+
+})(this, Phase, Backbone, _);